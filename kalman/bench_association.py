@@ -0,0 +1,120 @@
+"""Benchmark de asociacion.
+
+Compares the dense and the gated association of sort.py on synthetic frames
+of N detections against N predicted boxes, checks that both give the same
+matches, up to the order of the unmatched boxes, and reports how their run
+time grows with N.
+
+  $ python bench_association.py --sizes 100 1000 5000
+"""
+
+import argparse
+import time
+
+import numpy as np
+from sort import associate_detections_to_trackers
+
+
+def synthetic_frame(n, density=0.5, jitter=2.0, seed=0):
+    """Synthetic frame.
+
+    Returns n detections and n predicted boxes of 20-60 px scattered over a
+    square scene sized so that the boxes cover density times its area.
+    """
+    rng = np.random.RandomState(seed)
+    wh = rng.uniform(20, 60, (n, 2))
+    side = np.sqrt(np.sum(wh[:, 0] * wh[:, 1]) / density)
+    centres = rng.uniform(0, side, (n, 2))
+    trks = np.hstack((centres - wh / 2.0, centres + wh / 2.0))
+    dets = trks + rng.normal(0, jitter, trks.shape)
+    dets = np.hstack((dets, np.ones((n, 1))))
+    return dets[rng.permutation(n)], trks
+
+
+def best_time(fn, repeat):
+    """Best wall time of repeat calls to fn."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def same_matches(a, b):
+    """True if two association results pair the same boxes.
+
+    The unmatched detections and trackers are compared as sets: the gated
+    path returns them in ascending order and the dense one does not, which
+    only changes the order in which Sort numbers the new tracks.
+    """
+    return (
+        sorted(np.asarray(a[0]).tolist()) == sorted(np.asarray(b[0]).tolist())
+        and sorted(np.asarray(a[1]).tolist()) == sorted(np.asarray(b[1]).tolist())
+        and sorted(np.asarray(a[2]).tolist()) == sorted(np.asarray(b[2]).tolist())
+    )
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description="SORT association benchmark")
+    parser.add_argument(
+        "--sizes",
+        help="Number of detections and trackers per frame.",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 3000, 10000],
+    )
+    parser.add_argument(
+        "--density",
+        help="Fraction of the scene covered by boxes.",
+        type=float,
+        default=0.5,
+    )
+    parser.add_argument(
+        "--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3
+    )
+    parser.add_argument(
+        "--max_dense",
+        help="Largest N for which the dense N x M path is run.",
+        type=int,
+        default=3000,
+    )
+    parser.add_argument("--repeat", help="Runs per measurement.", type=int, default=3)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(
+        "%8s %12s %12s %8s %8s" % ("N", "dense [ms]", "gated [ms]", "speedup", "same")
+    )
+    for n in args.sizes:
+        dets, trks = synthetic_frame(n, args.density)
+        gated = associate_detections_to_trackers(
+            dets, trks, args.iou_threshold, gated=True
+        )
+        gated_time = best_time(
+            lambda: associate_detections_to_trackers(
+                dets, trks, args.iou_threshold, gated=True
+            ),
+            args.repeat,
+        )
+        if n > args.max_dense:
+            print("%8d %12s %12.2f %8s %8s" % (n, "-", gated_time * 1e3, "-", "-"))
+            continue
+        dense = associate_detections_to_trackers(dets, trks, args.iou_threshold)
+        dense_time = best_time(
+            lambda: associate_detections_to_trackers(dets, trks, args.iou_threshold),
+            args.repeat,
+        )
+        print(
+            "%8d %12.2f %12.2f %8.1f %8s"
+            % (
+                n,
+                dense_time * 1e3,
+                gated_time * 1e3,
+                dense_time / gated_time,
+                same_matches(dense, gated),
+            )
+        )
@@ -0,0 +1,96 @@
+"""Benchmark de importacion.
+
+Measures how long importing the tracking modules takes, each in a fresh
+interpreter, and which heavy modules they load, so that sort.py stays cheap
+to import from the drivers and from headless workers:
+
+  $ python bench_import.py --modules sort main_sort --max_ms 50
+
+NumPy is imported before the clock starts, every module needs it and its
+import time depends on the installation, not on this code.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+HEAVY_MODULES = (
+    "argparse",
+    "cv2",
+    "filterpy",
+    "matplotlib",
+    "scipy",
+    "skimage",
+    "tkinter",
+    "torch",
+)
+
+# run in the child, prints the seconds of the import and the heavy modules
+IMPORT_SCRIPT = """
+import json, sys, time
+import numpy
+start = time.perf_counter()
+import %s
+seconds = time.perf_counter() - start
+heavy = [m for m in %r if m in sys.modules]
+print(json.dumps({"seconds": seconds, "heavy": heavy}))
+"""
+
+
+def time_import(module):
+    """Seconds to import module in a new interpreter and the heavy modules loaded."""
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT % (module, HEAVY_MODULES)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout
+    result = json.loads(out.splitlines()[-1])
+    return result["seconds"], result["heavy"]
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description="SORT import benchmark")
+    parser.add_argument(
+        "--modules",
+        help="Modules to import.",
+        nargs="+",
+        default=["sort", "main_sort"],
+    )
+    parser.add_argument(
+        "--repeat", help="Interpreters started per module.", type=int, default=5
+    )
+    parser.add_argument(
+        "--max_ms",
+        help="Exit with 1 if the median import of the first module takes longer.",
+        type=float,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print("%-12s %12s %12s  %s" % ("module", "median [ms]", "best [ms]", "heavy"))
+    medians = []
+    for module in args.modules:
+        times = []
+        for _ in range(args.repeat):
+            seconds, heavy = time_import(module)
+            times.append(seconds)
+        medians.append(np.median(times) * 1e3)
+        print(
+            "%-12s %12.1f %12.1f  %s"
+            % (module, medians[-1], min(times) * 1e3, ", ".join(heavy) or "-")
+        )
+    if args.max_ms is not None and medians[0] > args.max_ms:
+        print(
+            "Importing %s takes %.1f ms, more than %.1f ms"
+            % (args.modules[0], medians[0], args.max_ms)
+        )
+        sys.exit(1)
@@ -0,0 +1,191 @@
+"""Benchmark de deteccion de movimiento.
+
+Runs MotionDetector configurations over the same frames and reports their
+detection time, and how close their boxes, and the tracks Sort makes of
+them, are to the reference boxes. Without --video the frames are a
+synthetic scene of boxes moving over a noisy background, and the reference
+are their true boxes; with a video, the reference are the boxes of the full
+resolution MOG2 detector of main_kalman.py.
+
+  $ python bench_motion.py --video camera.mp4 --scales 1 0.5 0.25
+"""
+
+import argparse
+import time
+
+import numpy as np
+from detectors import MotionDetector
+from sort import Sort, iou_batch, linear_assignment
+from video import FrameSource
+
+
+def synthetic_video(num_frames=150, width=1920, height=1080, num_objects=8, seed=0):
+    """Synthetic video.
+
+    Yields num_frames BGR frames, and their [x1,y1,x2,y2] boxes, of
+    num_objects boxes of 80-300 px moving at constant velocity over a static
+    textured background, with sensor noise. The frames only depend on the
+    arguments.
+    """
+    rng = np.random.RandomState(seed)
+    background = rng.randint(0, 120, (height // 8, width // 8, 3)).astype(np.uint8)
+    background = np.repeat(np.repeat(background, 8, axis=0), 8, axis=1)
+    wh = rng.randint(80, 300, (num_objects, 2))
+    pos = rng.uniform(0, 1, (num_objects, 2)) * ([width, height] - wh)
+    vel = rng.normal(0, 6, (num_objects, 2))
+    colours = rng.randint(130, 256, (num_objects, 3))
+    for _ in range(num_frames):
+        frame = background + rng.randint(0, 8, background.shape).astype(np.uint8)
+        pos += vel
+        bounce = (pos < 0) | (pos > [width, height] - wh)
+        vel[bounce] *= -1
+        pos = np.clip(pos, 0, [width, height] - wh)
+        xy = pos.astype(int)
+        for (x, y), (w, h), colour in zip(xy, wh, colours):
+            frame[y : y + h, x : x + w] = colour
+        yield frame, np.hstack((xy, xy + wh)).astype(float)
+
+
+def video_frames(path, num_frames):
+    """The first num_frames frames of a video."""
+    source = FrameSource(path, end=num_frames)
+    try:
+        while True:
+            frame = source.read()
+            if frame is None:
+                return
+            yield frame
+    finally:
+        source.release()
+
+
+def run_detector(detector, frames):
+    """Detections, tracks and per-frame detection time of a detector."""
+    tracker = Sort()
+    dets, tracks, latency = [], [], []
+    for frame in frames:
+        start = time.perf_counter()
+        frame_dets = detector(frame)
+        latency.append(time.perf_counter() - start)
+        dets.append(frame_dets)
+        tracks.append(tracker.update(frame_dets))
+    return dets, tracks, np.array(latency)
+
+
+def agreement(reference, boxes, iou_threshold=0.3):
+    """Agreement.
+
+    Matches the boxes of every frame to the reference ones and returns the
+    recall and precision of the matches with IOU >= iou_threshold and their
+    mean IOU.
+    """
+    matched = num_ref = num_boxes = 0
+    ious = []
+    for ref, box in zip(reference, boxes):
+        num_ref += len(ref)
+        num_boxes += len(box)
+        if len(ref) == 0 or len(box) == 0:
+            continue
+        iou = iou_batch(ref, box)
+        pairs = linear_assignment(-iou)
+        pair_ious = iou[pairs[:, 0], pairs[:, 1]]
+        pair_ious = pair_ious[pair_ious >= iou_threshold]
+        matched += len(pair_ious)
+        ious.extend(pair_ious)
+    return (
+        matched / max(num_ref, 1),
+        matched / max(num_boxes, 1),
+        float(np.mean(ious)) if ious else 0.0,
+    )
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description="Motion detector benchmark")
+    parser.add_argument("--video", help="Video to run, synthetic if missing.", type=str)
+    parser.add_argument("--frames", help="Frames to run.", type=int, default=150)
+    parser.add_argument(
+        "--width", help="Width of the synthetic video.", type=int, default=1920
+    )
+    parser.add_argument(
+        "--height", help="Height of the synthetic video.", type=int, default=1080
+    )
+    parser.add_argument(
+        "--scales",
+        help="Downscale factors to compare.",
+        type=float,
+        nargs="+",
+        default=[1.0, 0.5, 0.25],
+    )
+    parser.add_argument(
+        "--methods",
+        help="Background models to compare.",
+        choices=MotionDetector.METHODS,
+        nargs="+",
+        default=list(MotionDetector.METHODS),
+    )
+    parser.add_argument(
+        "--min_area",
+        help="Smallest blob area in full resolution pixels.",
+        type=int,
+        default=2000,
+    )
+    return parser.parse_args()
+
+
+def frames(args):
+    """Frames of --video, or of the synthetic video."""
+    if args.video:
+        return video_frames(args.video, args.frames)
+    return (frame for frame, _ in synthetic_video(args.frames, args.width, args.height))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.video:
+        reference, reference_tracks, _ = run_detector(
+            MotionDetector(min_area=args.min_area), frames(args)
+        )
+    else:
+        reference = [
+            boxes for _, boxes in synthetic_video(args.frames, args.width, args.height)
+        ]
+        reference_tracks = reference
+    print(
+        "%-16s %6s %9s %7s %9s %9s %8s %9s %9s"
+        % (
+            "method",
+            "scale",
+            "det [ms]",
+            "speedup",
+            "dets/frm",
+            "det rec",
+            "det IOU",
+            "trk rec",
+            "trk IOU",
+        )
+    )
+    base = None
+    for method in args.methods:
+        for scale in args.scales:
+            detector = MotionDetector(
+                min_area=args.min_area, scale=scale, method=method
+            )
+            dets, tracks, latency = run_detector(detector, frames(args))
+            base = base or np.mean(latency)
+            det_recall, _, det_iou = agreement(reference, dets)
+            trk_recall, _, trk_iou = agreement(reference_tracks, tracks)
+            print(
+                "%-16s %6.2f %9.2f %7.1f %9.1f %9.3f %8.3f %9.3f %9.3f"
+                % (
+                    method,
+                    scale,
+                    np.mean(latency) * 1e3,
+                    base / np.mean(latency),
+                    np.mean([len(d) for d in dets]),
+                    det_recall,
+                    det_iou,
+                    trk_recall,
+                    trk_iou,
+                )
+            )
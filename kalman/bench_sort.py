@@ -0,0 +1,419 @@
+"""Benchmark de Sort.
+
+Drives Sort.update over deterministic synthetic scenes of growing size and
+reports per-frame latency percentiles, throughput and peak memory. Results
+are saved as JSON so that runs can be compared to catch regressions. With
+--gain_cache the trackers use a GainCache, and its tracks are checked
+against those of the exact filter on a scene of their own, with the long
+max_age of real use (--gain_max_age, --gain_dropout), and the time of their
+predict and update stages compared. Only tracks matched frame after frame
+reach the steady state, so the cache pays off with few misses and thousands
+of tracks, where updating the covariances dominates.
+
+  $ python bench_sort.py --sizes 10 100 1000 10000 --output bench.json
+  $ python bench_sort.py --output new.json --compare bench.json
+  $ python bench_sort.py --sizes 1000 5000 --gated --gain_cache
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from sort import GainCache, Sort, SortStats
+
+
+def synthetic_scene(
+    num_objects,
+    num_frames=200,
+    density=0.2,
+    speed=2.0,
+    occlusion=0.01,
+    dropout=0.05,
+    jitter=1.0,
+    seed=0,
+):
+    """Synthetic scene.
+
+    Returns the list of per-frame [x1,y1,x2,y2,score] detections of
+    num_objects boxes of 20-80 px moving at constant velocity (speed px per
+    frame on average) and bouncing on the borders of a square scene sized so
+    that the boxes cover density times its area. Every frame an object starts
+    an occlusion of 5-20 frames with probability occlusion, and is missed with
+    probability dropout. Detections are jittered by jitter px.
+    """
+    rng = np.random.RandomState(seed)
+    wh = rng.uniform(20, 80, (num_objects, 2))
+    side = max(np.sqrt(np.sum(wh[:, 0] * wh[:, 1]) / density), 100.0)
+    pos = rng.uniform(0, side, (num_objects, 2))
+    vel = rng.normal(0, speed, (num_objects, 2))
+    occluded = np.zeros(num_objects, dtype=np.int64)
+    frames = []
+    for _ in range(num_frames):
+        pos += vel
+        bounce = (pos < 0) | (pos > side)
+        vel[bounce] *= -1
+        pos = np.clip(pos, 0, side)
+        occluded = np.maximum(occluded - 1, 0)
+        start = rng.uniform(size=num_objects) < occlusion
+        occluded[start] = rng.randint(5, 21, np.count_nonzero(start))
+        seen = (occluded == 0) & (rng.uniform(size=num_objects) >= dropout)
+        centres = pos[seen] + rng.normal(0, jitter, (np.count_nonzero(seen), 2))
+        half = wh[seen] / 2.0
+        frames.append(
+            np.hstack(
+                (centres - half, centres + half, rng.uniform(0.5, 1, (len(half), 1)))
+            )
+        )
+    return frames
+
+
+def new_tracker(sort_kwargs):
+    """A Sort of sort_kwargs, with a new GainCache if gain_tolerance is given."""
+    kwargs = dict(sort_kwargs)
+    tolerance = kwargs.pop("gain_tolerance", None)
+    if tolerance is not None:
+        kwargs["gain_cache"] = GainCache(tolerance, kwargs.get("dtype", np.float64))
+    return Sort(**kwargs)
+
+
+def run_frames(frames, sort_kwargs):
+    """Per-frame Sort.update latency in seconds of a new tracker over frames."""
+    tracker = new_tracker(sort_kwargs)
+    latency = np.empty(len(frames))
+    for i, dets in enumerate(frames):
+        start = time.perf_counter()
+        tracker.update(dets)
+        latency[i] = time.perf_counter() - start
+    return latency
+
+
+def peak_memory(frames, sort_kwargs):
+    """Peak bytes allocated while tracking frames, measured with tracemalloc."""
+    tracemalloc.start()
+    try:
+        tracker = new_tracker(sort_kwargs)
+        for dets in frames:
+            tracker.update(dets)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def gain_cache_check(frames, sort_kwargs):
+    """Gain cache check.
+
+    Tracks frames with the GainCache of sort_kwargs and with the exact
+    filter. Returns a dict with the largest difference in px of the boxes of
+    the frames where both report the same ids, the fraction of frames where
+    they do, the mean fraction of the live tracks at the steady state, and
+    the mean time in ms of the predict and update stages of both trackers.
+    """
+    exact_kwargs = dict(sort_kwargs)
+    del exact_kwargs["gain_tolerance"]
+    exact = Sort(stats=SortStats(len(frames)), **exact_kwargs)
+    cached = new_tracker(dict(sort_kwargs, stats=SortStats(len(frames))))
+    bank = cached.trackers
+    error = 0.0
+    same = 0
+    steady = 0.0
+    for dets in frames:
+        a, b = exact.update(dets), cached.update(dets)
+        if np.array_equal(a[:, 4], b[:, 4]):
+            same += 1
+            if len(a) > 0:
+                error = max(error, float(np.abs(a[:, :4] - b[:, :4]).max()))
+        if len(bank) > 0:
+            steady += np.count_nonzero(bank.steady) / len(bank)
+    result = {
+        "error_px": error,
+        "same_ids": same / max(len(frames), 1),
+        "steady": steady / max(len(frames), 1),
+    }
+    for name, tracker in (("exact", exact), ("cached", cached)):
+        summary = tracker.stats.summary()
+        for stage in ("predict", "update"):
+            result["%s_%s_ms" % (name, stage)] = summary[stage]["mean_ms"]
+    return result
+
+
+def benchmark(num_objects, args):
+    """Benchmark one scene size, returns its JSON result."""
+    gated = args.gated or num_objects > args.max_dense
+    sort_kwargs = dict(
+        max_age=args.max_age,
+        min_hits=args.min_hits,
+        iou_threshold=args.iou_threshold,
+        dtype=np.dtype(args.dtype),
+        gated=gated,
+    )
+    if args.gain_cache:
+        sort_kwargs["gain_tolerance"] = args.gain_tolerance
+    frames = synthetic_scene(
+        num_objects,
+        num_frames=args.frames,
+        density=args.density,
+        speed=args.speed,
+        occlusion=args.occlusion,
+        dropout=args.dropout,
+        seed=args.seed,
+    )
+    run_frames(frames[: args.warmup], sort_kwargs)
+    latency = min(
+        (run_frames(frames, sort_kwargs) for _ in range(args.repeat)),
+        key=np.sum,
+    )
+    num_dets = sum(len(dets) for dets in frames)
+    result = {
+        "num_objects": num_objects,
+        "gated": gated,
+        "frames": len(frames),
+        "detections": num_dets,
+        "p50_ms": float(np.percentile(latency, 50) * 1e3),
+        "p95_ms": float(np.percentile(latency, 95) * 1e3),
+        "p99_ms": float(np.percentile(latency, 99) * 1e3),
+        "mean_ms": float(np.mean(latency) * 1e3),
+        "fps": float(len(frames) / np.sum(latency)),
+        "detections_per_s": float(num_dets / np.sum(latency)),
+        "peak_memory_mb": peak_memory(frames[: args.memory_frames], sort_kwargs)
+        / 2.0**20,
+    }
+    if args.gain_cache:
+        check_frames = synthetic_scene(
+            num_objects,
+            num_frames=args.frames,
+            density=args.density,
+            speed=args.speed,
+            occlusion=args.occlusion,
+            dropout=args.gain_dropout,
+            seed=args.seed,
+        )
+        result["gain_cache"] = gain_cache_check(
+            check_frames, dict(sort_kwargs, max_age=args.gain_max_age)
+        )
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Compare against a baseline run.
+
+    Prints the change of the latency percentiles for every scene size found
+    in both runs. Returns the number of regressions, i.e. percentiles that
+    grew by more than tolerance (a fraction).
+    """
+    old = {(r["num_objects"], r["gated"]): r for r in baseline["results"]}
+    regressions = 0
+    for r in results:
+        base = old.get((r["num_objects"], r["gated"]))
+        if base is None:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            change = r[key] / base[key] - 1.0
+            flag = ""
+            if change > tolerance:
+                regressions += 1
+                flag = "  REGRESSION"
+            print(
+                "%8d %6s %8.3f -> %8.3f (%+.1f%%)%s"
+                % (r["num_objects"], key[:3], base[key], r[key], change * 100, flag)
+            )
+    return regressions
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description="SORT benchmark")
+    parser.add_argument(
+        "--sizes",
+        help="Number of objects of every scene.",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000],
+    )
+    parser.add_argument("--frames", help="Frames per scene.", type=int, default=200)
+    parser.add_argument(
+        "--density",
+        help="Fraction of the scene covered by boxes.",
+        type=float,
+        default=0.2,
+    )
+    parser.add_argument(
+        "--speed",
+        help="Mean speed of the objects in px/frame.",
+        type=float,
+        default=2.0,
+    )
+    parser.add_argument(
+        "--occlusion",
+        help="Probability per frame that an object starts an occlusion.",
+        type=float,
+        default=0.01,
+    )
+    parser.add_argument(
+        "--dropout",
+        help="Probability of missing a detection.",
+        type=float,
+        default=0.05,
+    )
+    parser.add_argument("--seed", help="Seed of the scenes.", type=int, default=0)
+    parser.add_argument(
+        "--max_age",
+        help="Maximum number of frames to keep alive a track without associated detections.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--min_hits",
+        help="Minimum number of associated detections before track is initialised.",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3
+    )
+    parser.add_argument(
+        "--dtype", help="Floating point type of the tracker.", default="float64"
+    )
+    parser.add_argument(
+        "--gated", help="Use the gated association for every size.", action="store_true"
+    )
+    parser.add_argument(
+        "--max_dense",
+        help="Scenes with more objects always use the gated association.",
+        type=int,
+        default=2000,
+    )
+    parser.add_argument(
+        "--gain_cache",
+        help="Track with a GainCache, checked against the exact filter.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--gain_tolerance",
+        help="Relative tolerance of the GainCache.",
+        type=float,
+        default=5e-3,
+    )
+    parser.add_argument(
+        "--gain_max_age",
+        help="max_age of the scene checking the GainCache.",
+        type=int,
+        default=30,
+    )
+    parser.add_argument(
+        "--gain_dropout",
+        help="Probability of missing a detection in the scene checking the GainCache.",
+        type=float,
+        default=0.05,
+    )
+    parser.add_argument(
+        "--max_gain_error",
+        help="Largest box difference in px to the exact filter accepted.",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--warmup", help="Frames tracked before measuring.", type=int, default=10
+    )
+    parser.add_argument(
+        "--repeat", help="Runs per scene, the fastest counts.", type=int, default=1
+    )
+    parser.add_argument(
+        "--memory_frames",
+        help="Frames tracked under tracemalloc to measure peak memory.",
+        type=int,
+        default=50,
+    )
+    parser.add_argument("--output", help="JSON file to write the results to.", type=str)
+    parser.add_argument("--compare", help="JSON results of a baseline run.", type=str)
+    parser.add_argument(
+        "--tolerance",
+        help="Relative latency increase reported as a regression.",
+        type=float,
+        default=0.1,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = []
+    print(
+        "%8s %6s %9s %9s %9s %9s %10s %9s"
+        % (
+            "objects",
+            "gated",
+            "p50 [ms]",
+            "p95 [ms]",
+            "p99 [ms]",
+            "FPS",
+            "dets/s",
+            "peak [MB]",
+        )
+    )
+    gain_errors = 0
+    for num_objects in args.sizes:
+        r = benchmark(num_objects, args)
+        results.append(r)
+        print(
+            "%8d %6s %9.3f %9.3f %9.3f %9.1f %10.0f %9.2f"
+            % (
+                r["num_objects"],
+                r["gated"],
+                r["p50_ms"],
+                r["p95_ms"],
+                r["p99_ms"],
+                r["fps"],
+                r["detections_per_s"],
+                r["peak_memory_mb"],
+            )
+        )
+        if args.gain_cache:
+            g = r["gain_cache"]
+            flag = ""
+            if g["error_px"] > args.max_gain_error or g["same_ids"] < 1.0:
+                gain_errors += 1
+                flag = "  TOO FAR"
+            print(
+                "%8s gain cache: %.2e px from the exact filter, same ids in %.1f%% of "
+                "frames, %.1f%% of the tracks at the steady state%s"
+                % ("", g["error_px"], g["same_ids"] * 100, g["steady"] * 100, flag)
+            )
+            print(
+                "%8s predict %.3f ms (exact %.3f ms, %.2fx), "
+                "update %.3f ms (exact %.3f ms, %.2fx)"
+                % (
+                    "",
+                    g["cached_predict_ms"],
+                    g["exact_predict_ms"],
+                    g["exact_predict_ms"] / max(g["cached_predict_ms"], 1e-9),
+                    g["cached_update_ms"],
+                    g["exact_update_ms"],
+                    g["exact_update_ms"] / max(g["cached_update_ms"], 1e-9),
+                )
+            )
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("%d latency regressions" % regressions)
+            sys.exit(1)
+    if gain_errors:
+        print("%d scenes where the gain cache is off the exact filter" % gain_errors)
+        sys.exit(1)
@@ -0,0 +1,308 @@
+"""Detectores.
+
+Detectors turn frames into the (N, 5) [x1,y1,x2,y2,score] arrays expected by
+Sort.update. Models are only loaded on the first call, so creating a
+detector is cheap, and every detector takes batches of frames:
+
+  detector = YoloDetector("yolov5s.pt", batch_size=8)
+  dets = detector(frames)  # list of (N, 5) arrays, one per frame
+  dets = detector(frame)  # a single (N, 5) array
+"""
+
+import os
+import time
+
+import numpy as np
+
+
+class Detector(object):
+    """Base detector.
+
+    Subclasses implement load, to create their model, and detect, to run it
+    on a list of at most batch_size frames. stateless is False for detectors
+    whose detections depend on the frames they saw before, which cannot start
+    in the middle of a video.
+    """
+
+    stateless = True
+
+    def __init__(self, batch_size=1):
+        """Initialization.
+
+        Params:
+          batch_size - maximum number of frames passed to detect at once
+        """
+        self.batch_size = batch_size
+        self.loaded = False
+
+    def load(self):
+        """Load the model, called once before the first detection."""
+
+    def detect(self, frames):
+        """Returns the list of (N, 5) detections of a list of frames."""
+        raise NotImplementedError
+
+    def __call__(self, frames):
+        """Detect.
+
+        Takes a single HxWxC frame or a sequence of them and returns its (N, 5)
+        detections or the list of detections of every frame. Sequences are
+        split into micro-batches of batch_size frames.
+        """
+        single = isinstance(frames, np.ndarray) and frames.ndim == 3
+        if single:
+            frames = [frames]
+        if not self.loaded:
+            self.load()
+            self.loaded = True
+        frames = list(frames)
+        dets = []
+        for i in range(0, len(frames), self.batch_size):
+            dets.extend(self.detect(frames[i : i + self.batch_size]))
+        return dets[0] if single else dets
+
+
+class YoloDetector(Detector):
+    """YOLOv5 through torch.hub.
+
+    weights is a local checkpoint, or else names the pretrained model (e.g.
+    "yolov5s" or "yolov5s.pt") downloaded by torch.hub. repo may be a local clone of yolov5 so
+    that no network access is needed. Only the boxes of the given classes
+    (COCO person by default) are returned.
+    """
+
+    def __init__(
+        self,
+        weights="yolov5s.pt",
+        repo="ultralytics/yolov5",
+        classes=(0,),
+        batch_size=8,
+    ):
+        """Initialization.
+
+        Params:
+          weights - path of a checkpoint or name of a pretrained model
+          repo - torch.hub repository, a GitHub name or a local directory
+          classes - classes kept, None keeps all
+          batch_size - frames per forward pass
+        """
+        super(YoloDetector, self).__init__(batch_size)
+        self.weights = weights
+        self.repo = repo
+        self.classes = classes
+        self.model = None
+
+    def load(self):
+        """Load the model with torch.hub."""
+        import torch
+
+        source = "local" if os.path.isdir(self.repo) else "github"
+        if os.path.isfile(self.weights):
+            self.model = torch.hub.load(
+                self.repo, "custom", path=self.weights, source=source
+            )
+        else:
+            name = os.path.splitext(os.path.basename(self.weights))[0]
+            self.model = torch.hub.load(self.repo, name, pretrained=True, source=source)
+
+    def detect(self, frames):
+        """Run the model on a batch of frames."""
+        results = self.model(frames)
+        dets = []
+        for xyxy in results.xyxy:
+            xyxy = xyxy.cpu().numpy()
+            if self.classes is not None:
+                xyxy = xyxy[np.isin(xyxy[:, 5], self.classes)]
+            dets.append(xyxy[:, :5].astype(float))
+        return dets
+
+
+class MotionDetector(Detector):
+    """Deteccion de movimiento.
+
+    Boxes of the moving blobs found by background subtraction, with a score
+    of 1. method is "mog2", a MOG2 background model, or "running_average", a
+    cheaper running average of the gray frames differenced with every frame.
+    With scale < 1 the masks are computed on frames downscaled by scale, and
+    the boxes and contours mapped back to full resolution, min_area being
+    scaled along. Frames must be passed in order, as the background model is
+    updated with every frame. The contours of the last call are kept in
+    contours, one list per frame, to draw them.
+    """
+
+    METHODS = ("mog2", "running_average")
+    stateless = False
+
+    def __init__(
+        self,
+        history=5500,
+        var_threshold=40,
+        min_area=2000,
+        scale=1.0,
+        method="mog2",
+        alpha=0.02,
+        diff_threshold=25,
+    ):
+        """Initialization.
+
+        Params:
+          history - frames of the MOG2 background model
+          var_threshold - MOG2 threshold on the squared Mahalanobis distance
+          min_area - smallest contour area kept, in full resolution pixels
+          scale - factor applied to the frames before subtraction
+          method - one of METHODS
+          alpha - weight of every frame in the running average
+          diff_threshold - gray level difference to the running average that
+            counts as motion
+        """
+        super(MotionDetector, self).__init__()
+        if method not in self.METHODS:
+            raise ValueError(
+                "Unknown motion method %r, expected one of %s"
+                % (method, ", ".join(self.METHODS))
+            )
+        self.history = history
+        self.var_threshold = var_threshold
+        self.min_area = min_area
+        self.scale = scale
+        self.method = method
+        self.alpha = alpha
+        self.diff_threshold = diff_threshold
+        self.subtractor = None
+        self.background = None
+        self.contours = []
+
+    def load(self):
+        """Create the background subtractor."""
+        import cv2
+
+        if self.method == "mog2":
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(
+                history=self.history, varThreshold=self.var_threshold
+            )
+
+    def mask(self, frame):
+        """Foreground mask of a frame, already downscaled."""
+        import cv2
+
+        if self.method == "mog2":
+            mask = self.subtractor.apply(frame)
+            # shadows are 127
+            _, mask = cv2.threshold(mask, 200, 255, cv2.THRESH_BINARY)
+            return mask
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.background is None:
+            self.background = gray.astype(np.float32)
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(gray, self.background, self.alpha)
+        _, mask = cv2.threshold(diff, self.diff_threshold, 255, cv2.THRESH_BINARY)
+        return mask
+
+    def detect(self, frames):
+        """Find the moving blobs of every frame."""
+        import cv2
+
+        dets = []
+        self.contours = []
+        min_area = self.min_area * self.scale**2
+        for frame in frames:
+            if self.scale != 1.0:
+                frame = cv2.resize(
+                    frame,
+                    None,
+                    fx=self.scale,
+                    fy=self.scale,
+                    interpolation=cv2.INTER_AREA,
+                )
+            mask = cv2.GaussianBlur(self.mask(frame), (5, 5), 0)
+            contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+            contours = [cnt for cnt in contours if cv2.contourArea(cnt) > min_area]
+            boxes = np.array([cv2.boundingRect(cnt) for cnt in contours], dtype=float)
+            frame_dets = np.ones((len(contours), 5))
+            if len(contours) > 0:
+                frame_dets[:, :2] = boxes[:, :2]
+                frame_dets[:, 2:4] = boxes[:, :2] + boxes[:, 2:4]
+                frame_dets[:, :4] /= self.scale
+            if self.scale != 1.0:
+                contours = [(cnt / self.scale).astype(np.int32) for cnt in contours]
+            dets.append(frame_dets)
+            self.contours.append(contours)
+        return dets
+
+
+class FakeDetector(Detector):
+    """Detector falso.
+
+    Ignores the pixels and returns the jittered boxes of num_objects objects
+    moving at constant velocity and bouncing on the borders of a width x
+    height frame, so that a pipeline can be run without any model. The
+    detections only depend on the seed and on the number of frames seen.
+    delay seconds are slept per frame to stand in for the cost of a model.
+    """
+
+    stateless = False
+
+    def __init__(
+        self,
+        num_objects=10,
+        width=1280,
+        height=720,
+        jitter=1.0,
+        dropout=0.05,
+        delay=0.0,
+        seed=0,
+        batch_size=1,
+    ):
+        """Initialization.
+
+        Params:
+          num_objects - number of moving objects
+          width, height - size of the scene in pixels
+          jitter - std in pixels of the noise added to the boxes
+          dropout - probability of missing an object in a frame
+          delay - seconds spent per frame
+          seed - seed of the objects and the noise
+          batch_size - frames per call to detect
+        """
+        super(FakeDetector, self).__init__(batch_size)
+        self.num_objects = num_objects
+        self.size = np.array([width, height], dtype=float)
+        self.jitter = jitter
+        self.dropout = dropout
+        self.delay = delay
+        self.seed = seed
+
+    def load(self):
+        """Place the objects."""
+        self.rng = np.random.RandomState(self.seed)
+        self.wh = self.rng.uniform(30, 120, (self.num_objects, 2))
+        self.pos = self.rng.uniform(0, 1, (self.num_objects, 2)) * (self.size - self.wh)
+        self.vel = self.rng.normal(0, 3, (self.num_objects, 2))
+
+    def detect(self, frames):
+        """Move the objects one step per frame."""
+        if self.delay > 0:
+            time.sleep(self.delay * len(frames))
+        dets = []
+        for _ in frames:
+            self.pos += self.vel
+            bounce = (self.pos < 0) | (self.pos > self.size - self.wh)
+            self.vel[bounce] *= -1
+            self.pos = np.clip(self.pos, 0, self.size - self.wh)
+            seen = self.rng.uniform(size=self.num_objects) >= self.dropout
+            x1y1 = self.pos[seen] + self.rng.normal(
+                0, self.jitter, (np.count_nonzero(seen), 2)
+            )
+            frame_dets = np.ones((len(x1y1), 5))
+            frame_dets[:, :2] = x1y1
+            frame_dets[:, 2:4] = x1y1 + self.wh[seen]
+            dets.append(frame_dets)
+        return dets
+
+
+# detectors by name, as chosen with --detector in the drivers
+DETECTORS = {
+    "yolo": YoloDetector,
+    "motion": MotionDetector,
+    "fake": FakeDetector,
+}
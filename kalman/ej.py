@@ -1,70 +1,333 @@
 """Seguimiento de objetos con filtro de Kalman."""
 
+import argparse
+import threading
+
 import cv2
 import numpy as np
-import torch
+from detectors import DETECTORS, YoloDetector
+from mot_io import TRACK_FORMATS, TrackWriter
+from pipeline import QUEUE_POLICIES, Pipeline, Stage
 from sort import Sort
+from video import FrameSource, VideoWriter, draw_tracks
 
-# modelo de yolo 5
-yolo = torch.hub.load("ultralytics/yolov5", "yolov5s", pretrained=True)
 
+class DetectionScheduler(object):
+    """Planificador de detecciones.
 
-def object_tracking():
-    """Rastreo de Objetos."""
-    cap = cv2.VideoCapture(r"test.mp4")
-    mov_tracker = Sort()
-    frame_id = 0  # contador de frames
-    skip_frames = 6  # número de frames a saltar
-
-    while True:
-        ret, frame = cap.read()  # leer cada frame del video
-        if not ret:
-            break
-
-        # procesar cuadro actual para detección o no
-        if frame_id % skip_frames == 0:
-            results = yolo(frame)  # aplicar modelo yolo al frame
-            results = results.xyxy[0].numpy()
-            yolo_people = results[
-                results[:, 5] == 0
-            ]  # obtener solo detecciones de personas de yolo
-
-        # procesar cada detección
-        dets = []
-        for *xyxy, conf, cls in yolo_people:
-            x1, y1, x2, y2 = map(int, xyxy)  # extraer las coordenadas
-            dets.append([x1, y1, x2, y2, conf])
-        dets = np.array(dets)
-
-        # actualizar SORT con nuevas detecciones
-        trackers = mov_tracker.update(dets)
-
-        # dibujar rectangulos delimitadores y etiquetas
-        for d in trackers:
-            x1, y1, x2, y2, track_id = map(int, d[:5])
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 3)
-            cv2.putText(
-                frame,
-                str(track_id),
-                (x1, y1 - 10),
-                cv2.FONT_HERSHEY_PLAIN,
-                2,
-                (0, 255, 0),
-                thickness=2,
+    Decides on every frame whether to run the detector or only predict the
+    tracks with Sort.predict. The detector runs when there are no tracks, or
+    none was matched by the last detection, so that objects entering an
+    empty scene are found, when the predicted centre of some track is
+    uncertain by more than max_uncertainty of its size (see
+    Sort.uncertainty), when more than max_missed of the tracks were not
+    matched by the last detection, and in any case every max_stride frames,
+    but never more often than every min_stride frames.
+    """
+
+    def __init__(
+        self, min_stride=1, max_stride=12, max_uncertainty=0.15, max_missed=0.3
+    ):
+        """Initialization.
+
+        Params:
+          min_stride - minimum frames between detections
+          max_stride - maximum frames between detections
+          max_uncertainty - relative std of a track centre that asks for a detection
+          max_missed - fraction of unmatched tracks that asks for a detection
+        """
+        self.min_stride = min_stride
+        self.max_stride = max_stride
+        self.max_uncertainty = max_uncertainty
+        self.max_missed = max_missed
+        self.stride = None  # frames since the last detection
+
+    def should_detect(self, tracker):
+        """True if the detector should run on the next frame of tracker."""
+        if self.stride is None or self.stride + 1 >= self.max_stride:
+            detect = True
+        elif self.stride + 1 < self.min_stride:
+            detect = False
+        else:
+            uncertainty = tracker.uncertainty()[:, 1]
+            missed = tracker.trackers.time_since_update > 0
+            detect = (
+                len(uncertainty) == 0
+                or missed.all()
+                or uncertainty.max() > self.max_uncertainty
+                or missed.mean() > self.max_missed
             )
+        self.stride = 0 if detect else self.stride + 1
+        return detect
+
+
+def check_scheduler(min_stride=3, max_stride=12, num_frames=60):
+    """Check the scheduler.
+
+    Tracks a scene that starts empty and where a box enters at every frame
+    of a max_stride window in turn, running the detector when the
+    DetectionScheduler asks. The box must be detected within min_stride
+    frames of entering. Returns the list of the failed checks, empty when
+    all pass.
+    """
+    failed = []
+    for enter in range(max_stride, 2 * max_stride):
+        tracker = Sort()
+        scheduler = DetectionScheduler(min_stride, max_stride)
+        found = None
+        for index in range(num_frames):
+            if not scheduler.should_detect(tracker):
+                tracker.predict()
+                continue
+            dets = np.empty((0, 5))
+            if index >= enter:
+                x1 = 100.0 + 2.0 * (index - enter)
+                dets = np.array([[x1, 100.0, x1 + 50.0, 200.0, 1.0]])
+                found = index if found is None else found
+            tracker.update(dets)
+        if found is None or found - enter >= min_stride:
+            failed.append(
+                "box entering at frame %d detected at frame %s, min_stride %d"
+                % (enter, found, min_stride)
+            )
+    return failed
+
+
+def make_detector(args):
+    """Detector chosen with --detector, the model is loaded on first use."""
+    if args.detector == "yolo":
+        return YoloDetector(args.weights, args.repo, batch_size=args.batch_size)
+    return DETECTORS[args.detector]()
 
-        cv2.imshow("Video Tracker", frame)
 
-        key = cv2.waitKey(1)
-        if key == 27:
-            break
+def object_tracking(args):
+    """Rastreo de Objetos.
+
+    Decoding, detection and tracking run in threads of a Pipeline, while the
+    frames are drawn and shown here. Whether a frame is detected is decided
+    before retrieving it, so with --no_display frames that are not detected,
+    nor written to --video_output, are only grabbed. With --detect_fps the
+    detected frames are known in advance and decoding runs ahead of the
+    detector, which gets the frames queued meanwhile in batches of up to
+    --batch_size when it falls behind. Otherwise the DetectionScheduler
+    decides from the tracks, so a frame is scheduled once the previous one
+    is tracked and only its grab overlaps with the detection and tracking of
+    that frame. The time of the source then includes scheduling, --stats
+    reports the time of grabbing and retrieving apart. The tracks can be
+    written to --output.
+    """
+    source = FrameSource(args.video)
+    detector = make_detector(args)
+    mov_tracker = Sort()
+    scheduler = DetectionScheduler()  # decide en que frames correr el detector
+    stride = source.stride_for(args.detect_fps) if args.detect_fps else None
+    need_pixels = not args.no_display or args.video_output
+    tracked = [-1, threading.Condition()]  # last frame tracked
+    # frames queued for the detector, batch_size of them to be detected with
+    # --detect_fps, while the scheduler only lets one frame ahead
+    batch_size = args.batch_size * stride if stride is not None else 1
+    batches = []  # frames of every call to the detector
+
+    def decoded_frames():
+        while source.grab():
+            index = source.index
+            # procesar cuadro actual para detección o solo predecir los tracks
+            if stride is not None:
+                detect = index % stride == 0
+            else:
+                # the scheduler needs the tracks of the previous frame
+                with tracked[1]:
+                    while tracked[0] < index - 1 and not pipeline.stopped:
+                        tracked[1].wait(0.1)
+                if pipeline.stopped:
+                    return
+                detect = scheduler.should_detect(mov_tracker)
+            frame = source.retrieve() if detect or need_pixels else None
+            yield index, frame, detect
+
+    def detect(items):
+        # detecciones de personas de los frames elegidos, en un solo lote
+        frames = [frame for _, frame, detect in items if detect]
+        if frames:
+            batches.append(len(frames))
+        dets = iter(detector(frames) if frames else [])
+        return [
+            (index, frame, next(dets) if detect else None)
+            for index, frame, detect in items
+        ]
+
+    def track(item):
+        index, frame, dets = item
+        if dets is not None:
+            # actualizar SORT con nuevas detecciones
+            trackers = mov_tracker.update(dets)
+        else:
+            trackers = mov_tracker.predict()
+        with tracked[1]:
+            tracked[0] = index
+            tracked[1].notify_all()
+        return frame, trackers
+
+    pipeline = Pipeline(
+        decoded_frames(),
+        [
+            Stage(
+                "detect",
+                detect,
+                ordered=True,
+                queue_size=max(args.queue_size, batch_size),
+                batch_size=batch_size,
+            ),
+            Stage("track", track, ordered=True),
+        ],
+        queue_size=args.queue_size,
+        policy=args.queue_policy,
+        source_name="decode" if stride is not None else "schedule",
+    )
+    track_writer = None
+    if args.output:
+        track_writer = TrackWriter(args.output, args.output_format)
+    video_writer = None
+    if args.video_output:
+        video_writer = VideoWriter(args.video_output, source.fps)
+    try:
+        for index, (frame, trackers) in pipeline:
+            if track_writer is not None:
+                track_writer.write(index + 1, trackers)  # MOT frames begin at 1
+            if not need_pixels:
+                continue
+
+            # dibujar rectangulos delimitadores y etiquetas
+            draw_tracks(frame, trackers)
+            if video_writer is not None:
+                video_writer.write(frame)
+            if args.no_display:
+                continue
+
+            cv2.imshow("Video Tracker", frame)
+
+            key = cv2.waitKey(1)
+            if key == 27:
+                break
+    finally:
+        pipeline.stop()
+        source.release()
+        if track_writer is not None:
+            track_writer.close()
+        if video_writer is not None:
+            video_writer.close()
+    if not args.no_display:
+        cv2.destroyAllWindows()
+    dropped = pipeline.stats()["dropped"]
+    if dropped > 0 and (track_writer is not None or video_writer is not None):
+        print("%d frames dropped by the queues are missing from the outputs" % dropped)
+    if args.stats:
+        print(pipeline.report())
+        print(
+            "decoded %d frames, %d retrieved, in %.3f seconds; "
+            "%d detected in %d batches of up to %d"
+            % (
+                source.grabbed,
+                source.retrieved,
+                source.busy,
+                mov_tracker.frame_count,
+                len(batches),
+                max(batches, default=0),
+            )
+        )
+        if video_writer is not None:
+            print(
+                "encoded %d frames in %.3f seconds"
+                % (video_writer.written, video_writer.busy)
+            )
 
-        # incrementar el contador de frames
-        frame_id += 1
 
-    cap.release()
-    cv2.destroyAllWindows()
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description="Kalman tracking of people")
+    parser.add_argument("--video", help="Video to track.", type=str, default="test.mp4")
+    parser.add_argument(
+        "--detector",
+        help="Detector to run [yolo].",
+        choices=sorted(DETECTORS),
+        default="yolo",
+    )
+    parser.add_argument(
+        "--weights",
+        help="Local YOLOv5 checkpoint, or name of a pretrained model.",
+        type=str,
+        default="yolov5s",
+    )
+    parser.add_argument(
+        "--repo",
+        help="torch.hub repository of YOLOv5, a local clone avoids the network.",
+        type=str,
+        default="ultralytics/yolov5",
+    )
+    parser.add_argument(
+        "--detect_fps",
+        help="Run the detector at this frame rate instead of when the tracks ask.",
+        type=float,
+    )
+    parser.add_argument(
+        "--batch_size",
+        help="Frames detected per call with --detect_fps, when the detector falls behind [8].",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--no_display",
+        help="Do not show the video, frames are then only retrieved to detect.",
+        action="store_true",
+    )
+    parser.add_argument("--output", help="File to write the tracks to.", type=str)
+    parser.add_argument(
+        "--output_format",
+        help="Format of --output [txt].",
+        choices=TRACK_FORMATS,
+        default="txt",
+    )
+    parser.add_argument(
+        "--video_output", help="Video file to write the annotated frames to.", type=str
+    )
+    parser.add_argument(
+        "--queue_size", help="Frames buffered between stages.", type=int, default=8
+    )
+    parser.add_argument(
+        "--queue_policy",
+        help="When a queue is full, block or drop the oldest frame [block].",
+        choices=QUEUE_POLICIES,
+        default="block",
+    )
+    parser.add_argument(
+        "--stats",
+        help="Print the throughput of decoding, detection and tracking.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--check",
+        help="Check that the detection scheduler finds objects entering an empty scene.",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    if (
+        args.no_display
+        and args.queue_policy == "drop_oldest"
+        and (args.output or args.video_output)
+    ):
+        parser.error(
+            "--queue_policy drop_oldest would skip frames of --output and "
+            "--video_output, without a display use block"
+        )
+    return args
 
 
 if __name__ == "__main__":
-    object_tracking()
+    args = parse_args()
+    if args.check:
+        failed = check_scheduler()
+        for failure in failed:
+            print(failure)
+        print("scheduler check %s" % ("failed" if failed else "passed"))
+        raise SystemExit(1 if failed else 0)
+    object_tracking(args)
@@ -1,57 +1,162 @@
 """Kalman."""
 
+import argparse
+
 import cv2
-import numpy as np
+from detectors import DETECTORS, MotionDetector
+from mot_io import TRACK_FORMATS, TrackWriter
+from pipeline import QUEUE_POLICIES, Pipeline, Stage
 from sort import Sort
+from video import FrameSource, VideoWriter, draw_tracks
+
 
+def object_tracking(args):
+    """Rastreo de Objetos.
 
-def object_tracking():
-    """Rastreo de Objetos."""
-    cap = cv2.VideoCapture(r"kalman/test.mp4")
+    Decoding, detection and tracking run in threads of a Pipeline, while the
+    frames are drawn and shown here. The tracks can be written to --output
+    and the annotated frames to --video_output, and with --no_display
+    nothing is shown, so the same pipeline runs without a screen.
+    """
+    source = FrameSource(args.video)
 
-    object_detector = cv2.createBackgroundSubtractorMOG2(history=5500, varThreshold=40)
+    if args.detector == "motion":
+        object_detector = MotionDetector(scale=args.scale, method=args.motion_method)
+    else:
+        object_detector = DETECTORS[args.detector]()
     mot_tracker = Sort()
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        mask = object_detector.apply(frame)
-        _, mask = cv2.threshold(mask, 200, 255, cv2.THRESH_BINARY)
-        mask = cv2.GaussianBlur(mask, (5, 5), 0)
-        contours, _ = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        dets = []
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            if area > 2000:
-                x, y, w, h = cv2.boundingRect(cnt)
-                dets.append([x, y, x + w, y + h, 1.0])
-                cv2.drawContours(frame, [cnt], -1, (0, 0, 255), 2)
-        dets = np.array(dets)
-        trackers = mot_tracker.update(dets)
-
-        for d in trackers:
-            x1, y1, x2, y2, track_id = map(int, d)
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 3)
-            cv2.putText(
-                frame,
-                str(track_id),
-                (x1, y1 - 10),
-                cv2.FONT_HERSHEY_PLAIN,
-                2,
-                (0, 255, 0),
-                thickness=2,
-            )
+    def detect(item):
+        _, frame = item
+        dets = object_detector(frame)
+        contours = []
+        if isinstance(object_detector, MotionDetector):
+            contours = object_detector.contours[0]
+        return frame, contours, dets
+
+    def track(item):
+        frame, contours, dets = item
+        return frame, contours, mot_tracker.update(dets)
 
-        cv2.imshow("view", frame)
+    pipeline = Pipeline(
+        source.frames(),
+        [
+            Stage("detect", detect, ordered=True),  # MOG2 needs the frames in order
+            Stage("track", track, ordered=True),
+        ],
+        queue_size=args.queue_size,
+        policy=args.queue_policy,
+        source_name="decode",
+    )
+    track_writer = None
+    if args.output:
+        track_writer = TrackWriter(args.output, args.output_format)
+    video_writer = None
+    if args.video_output:
+        video_writer = VideoWriter(args.video_output, source.fps)
+    try:
+        for index, (frame, contours, trackers) in pipeline:
+            if track_writer is not None:
+                track_writer.write(index + 1, trackers)  # MOT frames begin at 1
+            if args.no_display and video_writer is None:
+                continue
+
+            cv2.drawContours(frame, contours, -1, (0, 0, 255), 2)
+            draw_tracks(frame, trackers)
+            if video_writer is not None:
+                video_writer.write(frame)
+            if args.no_display:
+                continue
+
+            cv2.imshow("view", frame)
+
+            key = cv2.waitKey(1)
+            if key == 27:
+                break
+    finally:
+        pipeline.stop()
+        source.release()
+        if track_writer is not None:
+            track_writer.close()
+        if video_writer is not None:
+            video_writer.close()
+    if not args.no_display:
+        cv2.destroyAllWindows()
+    dropped = pipeline.stats()["dropped"]
+    if dropped > 0 and (track_writer is not None or video_writer is not None):
+        print("%d frames dropped by the queues are missing from the outputs" % dropped)
+    if args.stats:
+        print(pipeline.report())
+        if video_writer is not None:
+            print(
+                "encoded %d frames in %.3f seconds"
+                % (video_writer.written, video_writer.busy)
+            )
 
-        key = cv2.waitKey(1)
-        if key == 27:
-            break
 
-    cap.release()
-    cv2.destroyAllWindows()
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description="Kalman tracking of moving objects")
+    parser.add_argument(
+        "--video", help="Video to track.", type=str, default="kalman/test.mp4"
+    )
+    parser.add_argument(
+        "--detector",
+        help="Detector to run [motion].",
+        choices=sorted(DETECTORS),
+        default="motion",
+    )
+    parser.add_argument(
+        "--motion_method",
+        help="Background model of the motion detector [mog2].",
+        choices=MotionDetector.METHODS,
+        default="mog2",
+    )
+    parser.add_argument(
+        "--scale",
+        help="Downscale factor of the frames for the motion detector [1.0].",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--no_display", help="Do not show the video.", action="store_true"
+    )
+    parser.add_argument("--output", help="File to write the tracks to.", type=str)
+    parser.add_argument(
+        "--output_format",
+        help="Format of --output [txt].",
+        choices=TRACK_FORMATS,
+        default="txt",
+    )
+    parser.add_argument(
+        "--video_output", help="Video file to write the annotated frames to.", type=str
+    )
+    parser.add_argument(
+        "--queue_size", help="Frames buffered between stages.", type=int, default=8
+    )
+    parser.add_argument(
+        "--queue_policy",
+        help="When a queue is full, block or drop the oldest frame [block].",
+        choices=QUEUE_POLICIES,
+        default="block",
+    )
+    parser.add_argument(
+        "--stats",
+        help="Print the throughput of decoding, detection and tracking.",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    if (
+        args.no_display
+        and args.queue_policy == "drop_oldest"
+        and (args.output or args.video_output)
+    ):
+        parser.error(
+            "--queue_policy drop_oldest would skip frames of --output and "
+            "--video_output, without a display use block"
+        )
+    return args
 
 
 if __name__ == "__main__":
-    object_tracking()
+    object_tracking(parse_args())
@@ -0,0 +1,296 @@
+"""Driver de SORT sobre el MOT benchmark.
+
+Tracks the det/det.txt detections of every sequence in seq_path/phase with
+Sort and writes the tracks to output/:
+
+  $ python main_sort.py --seq_path data --workers 4
+
+It was the __main__ of sort.py, which only keeps the tracker so that
+importing it does not load matplotlib, scikit-image or Tk; they are imported
+here when --display is used.
+"""
+
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from mot_io import TRACK_FORMATS, MOTDetections, TrackWriter
+from pipeline import prefetch
+from sort import Sort, SortStats
+
+
+class TrackDisplay(object):
+    """Vista de los tracks.
+
+    Draws the frames and the boxes of their tracks on a matplotlib axes. The
+    image and the boxes are a single artist each, updated in place every
+    frame, instead of one imshow and one Rectangle patch per track. read
+    decodes an image and decimates it to about the pixels of the axes, it is
+    thread safe so that the next images can be read in a thread pool.
+    """
+
+    def __init__(self, fig, ax, colours):
+        """Initialization.
+
+        Params:
+          fig - figure of ax, in interactive mode
+          ax - axes to draw on
+          colours - (K, 3) colours, track id modulo K picks the colour
+        """
+        self.fig = fig
+        self.ax = ax
+        self.colours = colours
+        self.image = None
+        self.boxes = None
+        self.max_size = None  # (height, width) of the axes in pixels
+
+    def start(self, title):
+        """Clear the axes for a new sequence."""
+        from matplotlib.collections import PolyCollection
+
+        self.ax.cla()
+        self.ax.set_title(title)
+        self.image = None
+        self.max_size = (self.ax.bbox.height, self.ax.bbox.width)
+        self.boxes = self.ax.add_collection(
+            PolyCollection([], facecolors="none", linewidths=3)
+        )
+
+    def read(self, fn):
+        """Read.
+
+        Returns the image of file fn, decimated to about the size of the axes
+        and contiguous, with its (height, width) before decimating, which are
+        the coordinates the tracks are drawn in.
+        """
+        from skimage import io
+
+        image = io.imread(fn)
+        height, width = image.shape[:2]
+        step = 1
+        if self.max_size is not None:
+            step = max(1, int(min(height / self.max_size[0], width / self.max_size[1])))
+        return np.ascontiguousarray(image[::step, ::step]), (height, width)
+
+    def show(self, image, tracks):
+        """Draw an image returned by read and its [x1,y1,x2,y2,id] tracks."""
+        image, (height, width) = image
+        extent = (-0.5, width - 0.5, height - 0.5, -0.5)
+        if self.image is None:
+            self.image = self.ax.imshow(image, extent=extent)
+        else:
+            self.image.set_data(image)
+            self.image.set_extent(extent)
+        x1, y1, x2, y2 = tracks[:, 0], tracks[:, 1], tracks[:, 2], tracks[:, 3]
+        verts = np.stack(
+            (
+                np.column_stack((x1, y1)),
+                np.column_stack((x2, y1)),
+                np.column_stack((x2, y2)),
+                np.column_stack((x1, y2)),
+            ),
+            axis=1,
+        )
+        self.boxes.set_verts(verts)
+        ids = tracks[:, 4].astype(np.int64)
+        self.boxes.set_edgecolor(self.colours[ids % len(self.colours)])
+        self.fig.canvas.draw_idle()
+        self.fig.canvas.flush_events()
+
+
+def track_sequence(seq_dets_fn, seq, args, display=None):
+    """Track one MOT sequence.
+
+    Runs a new Sort instance over the detections in seq_dets_fn and writes its
+    tracks to output/<seq>.<output_format> with a TrackWriter. display is None
+    or the TrackDisplay drawing the tracks over the benchmark images, which
+    are decoded ahead in a thread pool.
+    Returns the sequence name, the seconds spent in Sort.update and the
+    number of frames.
+    """
+    mot_tracker = Sort(
+        max_age=args.max_age,
+        min_hits=args.min_hits,
+        iou_threshold=args.iou_threshold,
+        stats=SortStats(window=1 << 20) if args.stats else None,
+    )  # create instance of the SORT tracker
+    seq_dets = MOTDetections.from_file(seq_dets_fn, cache=not args.no_cache)
+    if display:
+        display.start(seq + " Tracked Targets")
+        img_fn = os.path.join("mot_benchmark", args.phase, seq, "img1", "%06d.jpg")
+        images = prefetch(
+            display.read,
+            (img_fn % frame for frame in range(1, seq_dets.num_frames + 1)),
+            args.prefetch,
+            args.prefetch_workers,
+        )
+    total_time = 0.0
+    total_frames = 0
+
+    out_fn = os.path.join("output", "%s.%s" % (seq, args.output_format))
+    with TrackWriter(out_fn, args.output_format) as out_file:
+        print("Processing %s." % (seq))
+        for frame, dets in seq_dets:  # detection and frame numbers begin at 1
+            total_frames += 1
+
+            start_time = time.time()
+            trackers = mot_tracker.update(dets)
+            cycle_time = time.time() - start_time
+            total_time += cycle_time
+
+            out_file.write(frame, trackers)
+
+            if display:
+                display.show(next(images), trackers)
+    if display:
+        images.close()
+    if mot_tracker.stats is not None:
+        print("%s:\n%s" % (seq, mot_tracker.stats))
+    return seq, total_time, total_frames
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description="SORT demo")
+    parser.add_argument(
+        "--display",
+        dest="display",
+        help="Display online tracker output (slow) [False]",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--prefetch",
+        help="Images decoded ahead of the tracked frame with --display [8].",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--prefetch_workers",
+        help="Threads decoding images with --display [2].",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--seq_path", help="Path to detections.", type=str, default="data"
+    )
+    parser.add_argument(
+        "--phase", help="Subdirectory in seq_path.", type=str, default="train"
+    )
+    parser.add_argument(
+        "--max_age",
+        help="Maximum number of frames to keep alive a track without associated detections.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--min_hits",
+        help="Minimum number of associated detections before track is initialised.",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3
+    )
+    parser.add_argument(
+        "--no_cache",
+        help="Parse det.txt every run instead of memory-mapping a binary cache.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--output_format",
+        help="Format of the track files in output/ [txt].",
+        choices=TRACK_FORMATS,
+        default="txt",
+    )
+    parser.add_argument(
+        "--stats",
+        help="Print the time spent in every stage of Sort.update per sequence.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of processes tracking sequences in parallel [1].",
+        type=int,
+        default=1,
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """Track the sequences of --seq_path and print the frame rates."""
+    args = parse_args()
+    display = args.display
+    phase = args.phase
+    if display:
+        import matplotlib
+
+        matplotlib.use("TkAgg")
+        import matplotlib.pyplot as plt
+
+        colours = np.random.RandomState(0).rand(32, 3)
+        if not os.path.exists("mot_benchmark"):
+            print("""\n\tERROR: mot_benchmark link not found!\n\n
+                Create a symbolic link to the MOT benchmark\n
+                (https://motchallenge.net/data/2D_MOT_2015/#download). E.g.:\n\n
+                  $ ln -s /path/to/MOT2015_challenge/2DMOT2015 mot_benchmark\n\n""")
+            exit()
+        if args.workers > 1:
+            print("Note: --display runs the sequences one after another")
+            args.workers = 1
+        plt.ion()
+        fig = plt.figure()
+        ax1 = fig.add_subplot(111, aspect="equal")
+        display = TrackDisplay(fig, ax1, colours)
+    else:
+        display = None
+
+    if not os.path.exists("output"):
+        os.makedirs("output")
+    pattern = os.path.join(args.seq_path, phase, "*", "det", "det.txt")
+    sequences = [
+        (seq_dets_fn, seq_dets_fn[pattern.find("*") :].split(os.path.sep)[0])
+        for seq_dets_fn in glob.glob(pattern)
+    ]
+    start_time = time.time()
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [
+                pool.submit(track_sequence, seq_dets_fn, seq, args)
+                for seq_dets_fn, seq in sequences
+            ]
+            results = [future.result() for future in futures]
+    else:
+        results = [
+            track_sequence(seq_dets_fn, seq, args, display)
+            for seq_dets_fn, seq in sequences
+        ]
+    wall_time = time.time() - start_time
+
+    total_time = 0.0
+    total_frames = 0
+    for seq, seq_time, seq_frames in results:
+        print(
+            "%s: %.3f seconds for %d frames or %.1f FPS"
+            % (seq, seq_time, seq_frames, seq_frames / seq_time)
+        )
+        total_time += seq_time
+        total_frames += seq_frames
+    print(
+        "Total Tracking took: %.3f seconds for %d frames or %.1f FPS"
+        % (total_time, total_frames, total_frames / total_time)
+    )
+    print(
+        "Wall clock: %.3f seconds with %d workers or %.1f FPS"
+        % (wall_time, args.workers, total_frames / wall_time)
+    )
+
+    if display:
+        print("Note: to get real runtime results run without the option: --display")
+
+
+if __name__ == "__main__":
+    main()
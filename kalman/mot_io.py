@@ -0,0 +1,392 @@
+"""MOT files.
+
+Readers for the detection and ground truth files of the MOT benchmark used
+by the main_sort.py driver and a writer for its track files. Every row of a
+det.txt file is [frame, id, x, y, w, h, score, ...] with frames numbered
+from 1. Parsed files can be cached as memory-mapped .npy sidecars next to
+the text file.
+"""
+
+import itertools
+import json
+import os
+import shutil
+import zipfile
+
+import numpy as np
+
+# bump when the layout of the cache files changes
+CACHE_VERSION = 1
+
+# row of a MOT track file, the same the driver used to print per track
+MOT_TRACK_FORMAT = "%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1\n"
+
+# columns of the binary track files
+TRACK_COLUMNS = ("frame", "id", "x", "y", "w", "h")
+
+TRACK_FORMATS = ("txt", "npy", "npz")
+
+
+def cache_paths(seq_dets_fn):
+    """Paths of the detections, frame offsets and stamp sidecars of a det.txt."""
+    root = os.path.splitext(seq_dets_fn)[0]
+    return root + ".dets.npy", root + ".offsets.npy", root + ".cache.json"
+
+
+def mot_to_dets(rows):
+    """Convertir filas MOT a detecciones.
+
+    Takes MOT rows and returns the (N, 5) [x1,y1,x2,y2,score] detections
+    expected by Sort.update, converting all the boxes at once.
+    """
+    dets = np.array(rows[:, 2:7], dtype=float).reshape(-1, 5)
+    dets[:, 2:4] += dets[:, 0:2]  # convert to [x1,y1,w,h] to [x1,y1,x2,y2]
+    return dets
+
+
+class MOTDetections(object):
+    """Detections of a MOT sequence grouped by frame.
+
+    The rows are sorted by frame once, so the detections of any frame are a
+    contiguous view dets[offsets[frame - 1]:offsets[frame]] and iterating over
+    a sequence never scans the whole array again.
+    """
+
+    def __init__(self, dets, offsets):
+        """Initialization.
+
+        Params:
+          dets - (N, 5) [x1,y1,x2,y2,score] detections sorted by frame
+          offsets - (num_frames + 1,) start of every frame in dets
+        """
+        self.dets = dets
+        self.offsets = offsets
+
+    @classmethod
+    def from_array(cls, seq_dets):
+        """Group the rows of a MOT detection array by frame."""
+        seq_dets = np.asarray(seq_dets)
+        frames = seq_dets[:, 0].astype(np.int64)
+        order = np.argsort(frames, kind="stable")
+        frames = frames[order]
+        num_frames = int(frames[-1]) if len(frames) > 0 else 0
+        offsets = np.searchsorted(frames, np.arange(1, num_frames + 2), side="left")
+        # rows before frame 1 are never used
+        order = order[offsets[0] :]
+        return cls(mot_to_dets(seq_dets[order]), offsets - offsets[0])
+
+    @classmethod
+    def from_file(cls, seq_dets_fn, cache=False):
+        """Read and group a det.txt file.
+
+        With cache=True the detections are memory-mapped from the binary
+        sidecar files written by save_cache, which are created or refreshed
+        first when missing or older than the det.txt file.
+        """
+        if cache:
+            detections = cls.load_cache(seq_dets_fn)
+            if detections is not None:
+                return detections
+        detections = cls.from_array(np.loadtxt(seq_dets_fn, delimiter=",", ndmin=2))
+        if cache:
+            try:
+                detections.save_cache(seq_dets_fn)
+            except OSError:
+                pass  # read-only dataset, keep going without cache
+        return detections
+
+    def save_cache(self, seq_dets_fn):
+        """Write the binary sidecar files of seq_dets_fn.
+
+        The detections and the frame offsets go to .npy files next to the text
+        file, and a small JSON stamp with the size and modification time of
+        the text file is written last, so that a half written cache is never
+        used. Every file is replaced atomically, so concurrent writers are safe.
+        """
+        stat = os.stat(seq_dets_fn)
+        paths = cache_paths(seq_dets_fn)
+        tmp = ".%d.tmp" % os.getpid()
+        for path, array in zip(paths, (self.dets, self.offsets)):
+            with open(path + tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(path + tmp, path)
+        with open(paths[2] + tmp, "w") as f:
+            json.dump(
+                {
+                    "version": CACHE_VERSION,
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                },
+                f,
+            )
+        os.replace(paths[2] + tmp, paths[2])
+
+    @classmethod
+    def load_cache(cls, seq_dets_fn):
+        """Memory-map the sidecar files of seq_dets_fn, None if stale or missing."""
+        dets_fn, offsets_fn, stamp_fn = cache_paths(seq_dets_fn)
+        try:
+            stat = os.stat(seq_dets_fn)
+            with open(stamp_fn) as f:
+                stamp = json.load(f)
+            if stamp != {
+                "version": CACHE_VERSION,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }:
+                return None
+            return cls(
+                np.load(dets_fn, mmap_mode="r"), np.load(offsets_fn, mmap_mode="r")
+            )
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def frames(self):
+        """Frame of every detection."""
+        return np.repeat(np.arange(1, self.num_frames + 1), np.diff(self.offsets))
+
+    @property
+    def num_frames(self):
+        """Number of the last frame with detections."""
+        return len(self.offsets) - 1
+
+    def __len__(self):
+        """Number of frames."""
+        return self.num_frames
+
+    def __getitem__(self, frame):
+        """Detections of frame, numbered from 1 as in the MOT files."""
+        return self.dets[self.offsets[frame - 1] : self.offsets[frame]]
+
+    def __iter__(self):
+        """Iterate over the (frame, dets) of every frame, also the empty ones."""
+        for frame in range(1, self.num_frames + 1):
+            yield frame, self.dets[self.offsets[frame - 1] : self.offsets[frame]]
+
+
+class MOTGroundTruth(object):
+    """Ground truth of a MOT sequence grouped by frame.
+
+    Every row of a gt.txt file is [frame, id, x, y, w, h, conf, ...], rows
+    with conf 0 are not to be evaluated and are left out. As in
+    MOTDetections, the boxes of a frame are a contiguous view.
+    """
+
+    def __init__(self, ids, boxes, offsets):
+        """Initialization.
+
+        Params:
+          ids - (N,) ids of the objects sorted by frame
+          boxes - (N, 4) [x1,y1,x2,y2] boxes sorted by frame
+          offsets - (num_frames + 1,) start of every frame in ids and boxes
+        """
+        self.ids = ids
+        self.boxes = boxes
+        self.offsets = offsets
+
+    @classmethod
+    def from_file(cls, seq_gt_fn):
+        """Read and group a gt.txt file."""
+        rows = np.loadtxt(seq_gt_fn, delimiter=",", ndmin=2)
+        if rows.shape[1] > 6:
+            rows = rows[rows[:, 6] != 0]
+        frames = rows[:, 0].astype(np.int64)
+        order = np.argsort(frames, kind="stable")
+        frames = frames[order]
+        num_frames = int(frames[-1]) if len(frames) > 0 else 0
+        offsets = np.searchsorted(frames, np.arange(1, num_frames + 2), side="left")
+        order = order[offsets[0] :]
+        boxes = mot_to_dets(rows[order])[:, :4]
+        return cls(rows[order, 1].astype(np.int64), boxes, offsets - offsets[0])
+
+    @property
+    def num_frames(self):
+        """Number of the last frame with objects."""
+        return len(self.offsets) - 1
+
+    def __getitem__(self, frame):
+        """Ids and boxes of frame, empty past the last frame."""
+        if frame > self.num_frames:
+            return self.ids[:0], self.boxes[:0]
+        start, end = self.offsets[frame - 1], self.offsets[frame]
+        return self.ids[start:end], self.boxes[start:end]
+
+
+def stream_detections(seq_dets_fn, chunk_rows=65536):
+    """Stream a det.txt file.
+
+    Yields the (frame, dets) of every frame, also the empty ones, reading
+    chunk_rows lines at a time, so memory does not grow with the length of
+    the sequence. The rows of the file must be sorted by frame, as in the
+    MOT benchmark.
+    """
+    frame = 1
+    pending = np.empty((0, 5))
+    pending_frames = np.empty(0, dtype=np.int64)
+    with open(seq_dets_fn) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            last_chunk = len(lines) < chunk_rows
+            if len(lines) > 0:
+                rows = np.loadtxt(lines, delimiter=",", ndmin=2)
+                pending = np.concatenate((pending, mot_to_dets(rows)))
+                pending_frames = np.concatenate(
+                    (pending_frames, rows[:, 0].astype(np.int64))
+                )
+            if len(pending_frames) == 0:
+                return
+            # the last frame of a chunk may go on in the next one
+            end = int(pending_frames[-1]) + int(last_chunk)
+            offsets = np.searchsorted(pending_frames, np.arange(frame, end + 1))
+            for i in range(end - frame):
+                yield frame + i, pending[offsets[i] : offsets[i + 1]]
+            pending = pending[offsets[-1] :]
+            pending_frames = pending_frames[offsets[-1] :]
+            frame = end
+            if last_chunk:
+                return
+
+
+class TrackWriter(object):
+    """Buffered writer of the tracks of a sequence.
+
+    The tracks returned by Sort.update are copied into a preallocated chunk
+    of chunk_rows [frame, id, x, y, w, h] rows, which is written in bulk when
+    full, so memory stays bounded however long the sequence is. Formats:
+      txt - MOT text file, the same rows the driver used to print per track
+      npy - (N, 6) float64 array with the TRACK_COLUMNS
+      npz - one array per column, frame and id as int64
+    The binary formats spill the chunks to temporary files next to path and
+    assemble them on close, replacing path atomically.
+    """
+
+    def __init__(self, path, output_format="txt", chunk_rows=65536):
+        """Initialization.
+
+        Params:
+          path - file to write
+          output_format - one of TRACK_FORMATS
+          chunk_rows - rows buffered before writing
+        """
+        if output_format not in TRACK_FORMATS:
+            raise ValueError(
+                "Unknown output format %r, expected one of %s"
+                % (output_format, ", ".join(TRACK_FORMATS))
+            )
+        self.path = path
+        self.output_format = output_format
+        self.buffer = np.empty((chunk_rows, len(TRACK_COLUMNS)))
+        self.size = 0
+        self.rows = 0
+        tmp = ".%d.tmp" % os.getpid()
+        if output_format == "txt":
+            self.spills = {}
+        elif output_format == "npy":
+            self.spills = {"rows": "%s.rows%s" % (path, tmp)}
+        else:
+            self.spills = {
+                column: "%s.%s%s" % (path, column, tmp) for column in TRACK_COLUMNS
+            }
+        self.spill_files = {
+            name: open(spill, "wb") for name, spill in self.spills.items()
+        }
+        self.out_file = open(path, "w") if output_format == "txt" else None
+
+    def write(self, frame, tracks):
+        """Add the (k, 5) [x1,y1,x2,y2,id] tracks of frame."""
+        tracks = np.asarray(tracks)
+        chunk_rows = len(self.buffer)
+        while len(tracks) > 0:
+            if self.size == chunk_rows:
+                self.flush()
+            k = min(len(tracks), chunk_rows - self.size)
+            rows = self.buffer[self.size : self.size + k]
+            rows[:, 0] = frame
+            rows[:, 1] = tracks[:k, 4]
+            rows[:, 2:4] = tracks[:k, 0:2]
+            rows[:, 4:6] = tracks[:k, 2:4] - tracks[:k, 0:2]
+            self.size += k
+            tracks = tracks[k:]
+
+    def flush(self):
+        """Write the buffered rows."""
+        rows = self.buffer[: self.size]
+        if self.output_format == "txt":
+            self.out_file.write(
+                MOT_TRACK_FORMAT * len(rows) % tuple(rows.ravel().tolist())
+            )
+        elif self.output_format == "npy":
+            rows.tofile(self.spill_files["rows"])
+        else:
+            for i, column in enumerate(TRACK_COLUMNS):
+                values = rows[:, i]
+                if column in ("frame", "id"):
+                    values = values.astype(np.int64)
+                np.ascontiguousarray(values).tofile(self.spill_files[column])
+        self.rows += len(rows)
+        self.size = 0
+
+    def close(self):
+        """Write the remaining rows and finish the file."""
+        self.flush()
+        if self.output_format == "txt":
+            self.out_file.close()
+            return
+        for f in self.spill_files.values():
+            f.close()
+        tmp = self.path + ".%d.tmp" % os.getpid()
+        try:
+            if self.output_format == "npy":
+                with open(tmp, "wb") as f:
+                    self._copy_array(f, self.spills["rows"], np.float64, (self.rows, 6))
+            else:
+                with zipfile.ZipFile(
+                    tmp, "w", zipfile.ZIP_STORED, allowZip64=True
+                ) as z:
+                    for column in TRACK_COLUMNS:
+                        dtype = np.int64 if column in ("frame", "id") else np.float64
+                        with z.open(column + ".npy", "w", force_zip64=True) as f:
+                            self._copy_array(
+                                f, self.spills[column], dtype, (self.rows,)
+                            )
+            os.replace(tmp, self.path)
+        finally:
+            self._remove_spills()
+
+    @staticmethod
+    def _copy_array(f, spill, dtype, shape):
+        """Write a .npy header and the raw array in spill to f."""
+        np.lib.format.write_array_header_1_0(
+            f,
+            {
+                "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                "fortran_order": False,
+                "shape": shape,
+            },
+        )
+        with open(spill, "rb") as s:
+            shutil.copyfileobj(s, f)
+
+    def _remove_spills(self):
+        """Delete the temporary files."""
+        for spill in self.spills.values():
+            try:
+                os.remove(spill)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        """Use as a context manager, closing on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close, or only drop the temporary files on errors."""
+        if exc_type is None:
+            self.close()
+        elif self.output_format == "txt":
+            self.out_file.close()
+        else:
+            for f in self.spill_files.values():
+                f.close()
+            self._remove_spills()
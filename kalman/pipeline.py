@@ -0,0 +1,453 @@
+"""Pipeline de video.
+
+Runs the stages of a video driver (decode, detect, track, ...) in worker
+threads connected by bounded queues, so that a slow stage does not leave the
+others idle. Results are consumed in the calling thread, where drawing and
+cv2.imshow can run:
+
+  pipeline = Pipeline(
+      read_frames(cap),
+      [Stage("detect", detect, workers=2), Stage("track", track, ordered=True)],
+  )
+  for index, result in pipeline:
+      show(result)
+  print(pipeline.report())
+
+OpenCV and NumPy release the GIL in their heavy calls, so the threads overlap.
+"""
+
+import heapq
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+QUEUE_POLICIES = ("block", "drop_oldest")
+
+
+def read_frames(cap):
+    """Frames of a cv2.VideoCapture until the end of the video."""
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield frame
+
+
+def prefetch(fn, items, lookahead=8, workers=2):
+    """Prefetch.
+
+    Yields fn(item) for every item in order, computing up to lookahead of the
+    next ones in a pool of workers threads while the caller uses the current
+    one, e.g. to decode the next images of a sequence while it is tracked.
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for item in items:
+                pending.append(pool.submit(fn, item))
+                if len(pending) > lookahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class PipelineError(Exception):
+    """A stage failed, the original exception is the __cause__."""
+
+
+class BoundedQueue(object):
+    """Cola acotada.
+
+    FIFO of at most size items. When it is full, put either waits for room
+    (policy "block", backpressure up to the source) or discards the oldest
+    item (policy "drop_oldest", for real time use where stale frames are
+    worthless). Dropped items are passed to on_drop.
+    """
+
+    def __init__(self, size=8, policy="block", on_drop=None):
+        """Initialization.
+
+        Params:
+          size - maximum number of items
+          policy - one of QUEUE_POLICIES
+          on_drop - called with every dropped item
+        """
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(
+                "Unknown queue policy %r, expected one of %s"
+                % (policy, ", ".join(QUEUE_POLICIES))
+            )
+        self.size = size
+        self.policy = policy
+        self.on_drop = on_drop
+        self.items = deque()
+        self.closed = False
+        self.dropped = 0
+        self.max_depth = 0
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        """Current depth."""
+        return len(self.items)
+
+    def put(self, item):
+        """Add item, items put after close are discarded."""
+        dropped = None
+        with self.cond:
+            if self.policy == "block":
+                while len(self.items) >= self.size and not self.closed:
+                    self.cond.wait()
+            elif len(self.items) >= self.size:
+                dropped = self.items.popleft()
+                self.dropped += 1
+            if self.closed:
+                return
+            self.items.append(item)
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.cond.notify_all()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def get(self):
+        """Next item, waits for one. Raises IndexError once closed and empty."""
+        with self.cond:
+            while not self.items and not self.closed:
+                self.cond.wait()
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        """No more items will be put, wakes up the waiting threads."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def clear(self):
+        """Drop the queued items without calling on_drop."""
+        with self.cond:
+            self.items.clear()
+            self.cond.notify_all()
+
+
+class Stage(object):
+    """Etapa del pipeline.
+
+    Applies fn to the items of its input queue in workers threads. fn must be
+    thread safe when workers > 1, and the items then leave in any order;
+    ordered=True makes a stage process the items in frame order, waiting for
+    late ones and skipping the dropped ones, which is what a tracker needs.
+    When batch_size is given, fn takes a list of items and returns the list
+    of their results: a worker takes the next item, waiting for it, and then
+    those already queued up to batch_size, so batches only grow when the
+    stage falls behind and an item never waits for the ones after it.
+    queue_size and policy of the input queue default to those of the
+    Pipeline.
+    """
+
+    def __init__(
+        self,
+        name,
+        fn,
+        workers=1,
+        ordered=False,
+        queue_size=None,
+        policy=None,
+        batch_size=None,
+    ):
+        """Initialization.
+
+        Params:
+          name - name in the stats
+          fn - called as fn(item), its result goes to the next stage
+          workers - number of threads
+          ordered - process the items in the order of the source
+          queue_size - size of the input queue
+          policy - policy of the input queue, see QUEUE_POLICIES
+          batch_size - maximum number of items per call to fn, None passes
+            single items
+        """
+        if ordered and workers != 1:
+            raise ValueError("Ordered stages run in a single worker")
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.ordered = ordered
+        self.queue_size = queue_size
+        self.policy = policy
+        self.batch_size = batch_size
+        self.count = 0
+        self.batches = 0
+        self.busy = 0.0
+
+
+class Pipeline(object):
+    """Pipeline de etapas con hilos.
+
+    Feeds the items of source, read in a thread of its own, through the
+    stages and yields (index, result) pairs, index being the position of the
+    item in source. Items dropped by a "drop_oldest" queue are skipped.
+    """
+
+    def __init__(
+        self, source, stages, queue_size=8, policy="block", source_name="source"
+    ):
+        """Initialization.
+
+        Params:
+          source - iterable of items, e.g. decoded frames
+          stages - list of Stage
+          queue_size - default size of the queues
+          policy - default queue policy, see QUEUE_POLICIES
+          source_name - name of the source in the stats
+        """
+        self.source = source
+        self.source_name = source_name
+        self.source_busy = 0.0
+        self.stages = stages
+        # indices dropped before every ordered stage, that it must not wait for
+        self.dropped = [set() for _ in stages]
+        self.dropped_lock = threading.Lock()
+        self.queues = [
+            BoundedQueue(
+                stage.queue_size or queue_size,
+                stage.policy or policy,
+                partial(self._on_drop, i),
+            )
+            for i, stage in enumerate(stages)
+        ]
+        self.output = BoundedQueue(queue_size, policy)
+        self.source_count = 0
+        self.error = None
+        self.stopped = False
+        self.threads = []
+        self.start_time = None
+        self.end_time = None
+
+    def _on_drop(self, i, item):
+        """Remember the index of an item dropped before stage i."""
+        with self.dropped_lock:
+            for j in range(i, len(self.stages)):
+                if self.stages[j].ordered:
+                    self.dropped[j].add(item[0])
+
+    def _fail(self, exc):
+        """Record the first error and stop."""
+        if self.error is None:
+            self.error = exc
+        self.stop()
+
+    def _read_source(self):
+        """Thread putting the items of source in the first queue."""
+        out = self.queues[0] if self.queues else self.output
+        try:
+            items = iter(self.source)
+            index = 0
+            while not out.closed:
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                self.source_busy += time.perf_counter() - start
+                out.put((index, item))
+                index += 1
+                self.source_count = index
+        except Exception as exc:
+            self._fail(exc)
+        finally:
+            out.close()
+
+    def _ordered_items(self, queue, dropped):
+        """Items of queue in index order, skipping the dropped ones."""
+        pending = []
+        expected = 0
+        while True:
+            try:
+                item = queue.get()
+            except IndexError:
+                break
+            heapq.heappush(pending, item)
+            while pending:
+                with self.dropped_lock:
+                    while expected in dropped and pending[0][0] != expected:
+                        dropped.discard(expected)
+                        expected += 1
+                if pending[0][0] != expected:
+                    break
+                yield heapq.heappop(pending)
+                expected += 1
+        # the source is exhausted, whatever is left is in order
+        while pending:
+            yield heapq.heappop(pending)
+
+    def _unordered_items(self, queue):
+        """Items of queue as they come."""
+        while True:
+            try:
+                yield queue.get()
+            except IndexError:
+                return
+
+    def _batches(self, items, queue, batch_size):
+        """Lists of up to batch_size items, as many as are already queued."""
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size or len(queue) == 0:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _run_stage(self, i, done):
+        """Worker thread of stage i."""
+        stage = self.stages[i]
+        queue = self.queues[i]
+        out = self.queues[i + 1] if i + 1 < len(self.stages) else self.output
+        if stage.ordered:
+            items = self._ordered_items(queue, self.dropped[i])
+        else:
+            items = self._unordered_items(queue)
+        if stage.batch_size is not None:
+            items = self._batches(items, queue, stage.batch_size)
+        try:
+            for item in items:
+                start = time.perf_counter()
+                if stage.batch_size is not None:
+                    indices = [index for index, _ in item]
+                    results = stage.fn([batch_item for _, batch_item in item])
+                else:
+                    indices, results = [item[0]], [stage.fn(item[1])]
+                stage.busy += time.perf_counter() - start
+                stage.count += len(indices)
+                stage.batches += 1
+                for index, result in zip(indices, results):
+                    out.put((index, result))
+        except Exception as exc:
+            self._fail(exc)
+        finally:
+            with done[1]:
+                done[0] -= 1
+                if done[0] == 0:
+                    out.close()
+
+    def start(self):
+        """Start the threads, iterating does it if needed."""
+        self.start_time = time.perf_counter()
+        self.threads = [threading.Thread(target=self._read_source, daemon=True)]
+        for i, stage in enumerate(self.stages):
+            done = [stage.workers, threading.Lock()]
+            self.threads.extend(
+                threading.Thread(target=self._run_stage, args=(i, done), daemon=True)
+                for _ in range(stage.workers)
+            )
+        for thread in self.threads:
+            thread.start()
+
+    def __iter__(self):
+        """Yield the (index, result) of every item that went through the stages."""
+        if not self.threads:
+            self.start()
+        try:
+            while True:
+                try:
+                    item = self.output.get()
+                except IndexError:
+                    break
+                yield item
+        finally:
+            self.stop()
+            self.end_time = time.perf_counter()
+        if self.error is not None:
+            raise PipelineError("Pipeline stage failed") from self.error
+
+    def stop(self):
+        """Stop all the stages, e.g. when the consumer quits early."""
+        self.stopped = True
+        for queue in self.queues + [self.output]:
+            queue.close()
+            queue.clear()
+
+    def stats(self):
+        """Stats.
+
+        Returns a dict per stage with the items processed, the calls to fn,
+        the time busy in fn, its throughput in items per second busy, and the max depth and
+        drops of its input queue, the same for the source, reading items
+        instead of running fn, plus the wall time of the run and the items
+        dropped by all the queues.
+        """
+        wall = 0.0
+        if self.start_time is not None:
+            wall = (self.end_time or time.perf_counter()) - self.start_time
+        stats = {"items": self.source_count, "wall": wall}
+        stats[self.source_name] = {
+            "items": self.source_count,
+            "busy": self.source_busy,
+            "fps": (
+                self.source_count / self.source_busy if self.source_busy > 0 else 0.0
+            ),
+        }
+        for stage, queue in zip(self.stages, self.queues):
+            stats[stage.name] = {
+                "items": stage.count,
+                "batches": stage.batches,
+                "busy": stage.busy,
+                "fps": stage.count / stage.busy if stage.busy > 0 else 0.0,
+                "depth": len(queue),
+                "max_depth": queue.max_depth,
+                "dropped": queue.dropped,
+            }
+        stats["output"] = {
+            "max_depth": self.output.max_depth,
+            "dropped": self.output.dropped,
+        }
+        stats["dropped"] = self.output.dropped + sum(q.dropped for q in self.queues)
+        return stats
+
+    def report(self):
+        """Table of the stats."""
+        stats = self.stats()
+        source = stats[self.source_name]
+        lines = [
+            "%-10s %8s %9s %9s %9s %8s"
+            % ("stage", "items", "busy [s]", "FPS", "max depth", "dropped"),
+            "%-10s %8d %9.3f %9.1f %9s %8s"
+            % (
+                self.source_name,
+                source["items"],
+                source["busy"],
+                source["fps"],
+                "-",
+                "-",
+            ),
+        ]
+        for stage in self.stages:
+            s = stats[stage.name]
+            lines.append(
+                "%-10s %8d %9.3f %9.1f %9d %8d"
+                % (
+                    stage.name,
+                    s["items"],
+                    s["busy"],
+                    s["fps"],
+                    s["max_depth"],
+                    s["dropped"],
+                )
+            )
+        lines.append(
+            "%d items in %.3f seconds or %.1f FPS, %d dropped before output"
+            % (
+                stats["items"],
+                stats["wall"],
+                stats["items"] / stats["wall"] if stats["wall"] > 0 else 0.0,
+                stats["output"]["dropped"],
+            )
+        )
+        return "\n".join(lines)
@@ -0,0 +1,463 @@
+"""Seguimiento por segmentos en paralelo.
+
+Splits a long video into overlapping segments of frames that are detected
+and tracked, each by a Sort of its own, in a process pool, and stitches the
+track ids of consecutive segments by the IOU of their tracks over the frames
+they share, so that ids are consistent across the whole video:
+
+  $ python segments.py --video recording.mp4 --detector yolo --workers 8
+  $ python segments.py --dets det.txt --workers 8 --output tracks.txt
+
+With --dets the detections of a MOT det.txt file are tracked instead, read
+through the memory-mapped cache of mot_io. Every segment starts a cold
+Sort, which warms up over the overlap, whose frames are taken from the
+earlier segment, so the overlap should cover the min_hits of Sort. A video
+can only be split with a stateless detector: a background model, like that
+of the motion detector, would start cold in every segment. Seeking must be
+frame accurate, as it is for most containers with an index. --check
+compares the stitched tracks of a synthetic sequence to a single run.
+"""
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import cv2
+import numpy as np
+from detectors import DETECTORS, MotionDetector
+from mot_io import TRACK_FORMATS, MOTDetections, TrackWriter
+from sort import Sort, iou_batch, linear_assignment
+from video import FrameSource
+
+
+def split_segments(num_frames, num_segments, overlap):
+    """Split segments.
+
+    Returns the (start, end) frame ranges, end excluded, of num_segments
+    segments covering num_frames frames, every one but the last running
+    overlap frames into the next.
+    """
+    num_segments = max(1, min(num_segments, num_frames))
+    bounds = np.linspace(0, num_frames, num_segments + 1).round().astype(int)
+    return [
+        (int(start), int(min(end + overlap, num_frames)))
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def make_detector(detector, detector_kwargs):
+    """Detector named detector, created in the worker that runs it."""
+    return DETECTORS[detector](**detector_kwargs)
+
+
+def track_frames(frames, sort_kwargs):
+    """Track the (index, dets) of frames with a new Sort.
+
+    Returns the (N, 6) [frame, id, x1, y1, x2, y2] rows of its tracks, frames
+    being the indices of frames and ids local to the Sort.
+    """
+    tracker = Sort(**sort_kwargs)
+    rows = []
+    for index, dets in frames:
+        trackers = tracker.update(dets)
+        frame_rows = np.empty((len(trackers), 6))
+        frame_rows[:, 0] = index
+        frame_rows[:, 1] = trackers[:, 4]
+        frame_rows[:, 2:] = trackers[:, :4]
+        rows.append(frame_rows)
+    return np.concatenate(rows) if rows else np.empty((0, 6))
+
+
+def track_segment(video, start, end, detector, detector_kwargs, sort_kwargs):
+    """Track a segment.
+
+    Detects and tracks the frames from start to end of video with a new
+    detector and Sort. Returns the (N, 6) [frame, id, x1, y1, x2, y2] rows of
+    its tracks, frames numbered from 0 in the whole video and ids local to the
+    segment, the number of frames and the seconds it took.
+    """
+    start_time = time.time()
+    object_detector = make_detector(detector, detector_kwargs)
+    with FrameSource(video, start, end) as source:
+
+        def frames():
+            while True:
+                frame = source.read()
+                if frame is None:
+                    return
+                yield source.index, object_detector(frame)
+
+        rows = track_frames(frames(), sort_kwargs)
+        num_frames = source.grabbed
+    return rows, num_frames, time.time() - start_time
+
+
+def track_dets_segment(seq_dets, start, end, sort_kwargs):
+    """Track a segment of detections.
+
+    Same as track_segment for the detections of the frames from start to end,
+    numbered from 0, of seq_dets, a MOTDetections or the path of a det.txt
+    file read through the cache of mot_io.
+    """
+    start_time = time.time()
+    if not isinstance(seq_dets, MOTDetections):
+        seq_dets = MOTDetections.from_file(seq_dets, cache=True)
+    end = min(end, seq_dets.num_frames)
+    # MOT frames begin at 1
+    frames = ((index, seq_dets[index + 1]) for index in range(start, end))
+    rows = track_frames(frames, sort_kwargs)
+    return rows, end - start, time.time() - start_time
+
+
+def match_tracks(prev_rows, next_rows, iou_threshold=0.3, min_frames=3):
+    """Match tracks.
+
+    Pairs the tracks of two segments over the frames both cover. The score of
+    a pair is the mean IOU of their boxes over the frames where both are
+    present, pairs sharing fewer than min_frames frames are left out. Returns
+    the (K, 2) [prev id, next id] pairs of an optimal assignment scoring at
+    least iou_threshold.
+    """
+    if len(prev_rows) == 0 or len(next_rows) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    prev_ids, prev_idx = np.unique(prev_rows[:, 1], return_inverse=True)
+    next_ids, next_idx = np.unique(next_rows[:, 1], return_inverse=True)
+    total = np.zeros((len(prev_ids), len(next_ids)))
+    shared = np.zeros((len(prev_ids), len(next_ids)), dtype=np.int64)
+    for frame in np.intersect1d(prev_rows[:, 0], next_rows[:, 0]):
+        p = prev_rows[:, 0] == frame
+        n = next_rows[:, 0] == frame
+        rows, cols = np.ix_(prev_idx[p], next_idx[n])
+        total[rows, cols] += iou_batch(prev_rows[p, 2:], next_rows[n, 2:])
+        shared[rows, cols] += 1
+    score = np.where(shared >= min_frames, total / np.maximum(shared, 1), 0.0)
+    pairs = linear_assignment(-score)
+    pairs = pairs[score[pairs[:, 0], pairs[:, 1]] >= iou_threshold]
+    return np.column_stack((prev_ids[pairs[:, 0]], next_ids[pairs[:, 1]])).astype(
+        np.int64
+    )
+
+
+def stitch_segments(segments, results, iou_threshold=0.3, min_frames=3):
+    """Stitch segments.
+
+    Joins the track rows of consecutive segments, as returned by
+    track_segment, into the rows of the whole video. Two consecutive segments
+    hand over in the middle of the frames they share, so that a track alive
+    there is seen by both for about half the overlap. The tracks of a segment
+    matched by match_tracks keep the id of their previous track, the others
+    getting new ids. Ids are numbered from 1 in order of appearance.
+    """
+    if not segments:
+        return np.empty((0, 6))
+    handovers = [0]
+    for (_, prev_end), (start, _) in zip(segments[:-1], segments[1:]):
+        handovers.append((start + prev_end) // 2)
+    handovers.append(segments[-1][1])
+    stitched = []
+    global_ids = {}
+    next_id = 1
+    prev_rows = None
+    prev_end = 0
+    for i, ((start, end), rows) in enumerate(zip(segments, results)):
+        ids = {}
+        if prev_rows is not None:
+            prev_overlap = prev_rows[(prev_rows[:, 0] >= start)]
+            next_overlap = rows[rows[:, 0] < prev_end]
+            for prev_id, track_id in match_tracks(
+                prev_overlap, next_overlap, iou_threshold, min_frames
+            ):
+                # tracks only seen after the previous handover have no id
+                if prev_id in global_ids:
+                    ids[track_id] = global_ids[prev_id]
+        kept = rows[(rows[:, 0] >= handovers[i]) & (rows[:, 0] < handovers[i + 1])]
+        for track_id in kept[:, 1].astype(np.int64):
+            if track_id not in ids:
+                ids[track_id] = next_id
+                next_id += 1
+        kept = kept.copy()
+        kept[:, 1] = [ids[track_id] for track_id in kept[:, 1].astype(np.int64)]
+        stitched.append(kept)
+        global_ids = ids
+        prev_rows = rows
+        prev_end = end
+    return np.concatenate(stitched)
+
+
+def synthetic_dets(num_objects=40, num_frames=600, dropout=0.05, seed=0):
+    """Synthetic detections.
+
+    Returns the MOT detection rows of num_objects boxes of 30-90 px moving at
+    constant velocity over a 1280x720 scene, each seen from a random frame
+    for at least 20 frames, missed with probability dropout and jittered by
+    1 px.
+    """
+    rng = np.random.RandomState(seed)
+    rows = []
+    for _ in range(num_objects):
+        first = rng.randint(0, num_frames - 20)
+        frames = np.arange(first, min(num_frames, first + rng.randint(20, num_frames)))
+        frames = frames[rng.uniform(size=len(frames)) >= dropout]
+        wh = rng.uniform(30, 90, 2)
+        xy = rng.uniform(0, np.array([1280.0, 720.0]) - wh)
+        xy = xy + np.outer(frames - first, rng.normal(0, 2, 2))
+        xy += rng.normal(0, 1, xy.shape)
+        obj_rows = np.empty((len(frames), 7))
+        obj_rows[:, 0] = frames + 1  # MOT frames begin at 1
+        obj_rows[:, 1] = -1
+        obj_rows[:, 2:4] = xy
+        obj_rows[:, 4:6] = wh
+        obj_rows[:, 6] = 1.0
+        rows.append(obj_rows)
+    return np.concatenate(rows)
+
+
+def id_agreement(rows, ref_rows):
+    """Id agreement.
+
+    Pairs the rows of every frame of two runs by IOU, and returns the number
+    of pairs and how many of them map the id of ref_rows to the id of rows
+    that most of the pairs of that id do.
+    """
+    pairs = []
+    for frame in np.unique(ref_rows[:, 0]):
+        a = rows[rows[:, 0] == frame]
+        b = ref_rows[ref_rows[:, 0] == frame]
+        if len(a) == 0:
+            continue
+        iou = iou_batch(a[:, 2:], b[:, 2:])
+        matched = linear_assignment(-iou)
+        matched = matched[iou[matched[:, 0], matched[:, 1]] >= 0.5]
+        pairs.append(np.column_stack((b[matched[:, 1], 1], a[matched[:, 0], 1])))
+    pairs = np.concatenate(pairs) if pairs else np.empty((0, 2))
+    _, counts = np.unique(pairs, axis=0, return_counts=True)
+    ref_ids = np.unique(pairs, axis=0)[:, 0]
+    # the count of the most common id of rows for every id of ref_rows
+    agree = sum(counts[ref_ids == ref_id].max() for ref_id in np.unique(ref_ids))
+    return len(pairs), int(agree)
+
+
+def check_stitching(num_segments=(2, 4, 8), overlap=50, tolerance=0.01, seeds=3):
+    """Check stitching.
+
+    Tracks synthetic sequences in one segment and split in num_segments,
+    and compares the stitched tracks to those of the single run: the number
+    of rows and of ids, and the fraction of rows whose id maps to the same id
+    of the single run, may differ by at most tolerance. Returns the list of
+    the failed checks, empty when all pass.
+    """
+    sort_kwargs = dict(max_age=1, min_hits=3, iou_threshold=0.3)
+    failed = []
+    for seed in range(seeds):
+        seq_dets = MOTDetections.from_array(synthetic_dets(seed=seed))
+        num_frames = seq_dets.num_frames
+        single = track_dets_segment(seq_dets, 0, num_frames, sort_kwargs)[0]
+        single_ids = len(np.unique(single[:, 1]))
+        for n in num_segments:
+            segments = split_segments(num_frames, n, overlap)
+            rows = stitch_segments(
+                segments,
+                [
+                    track_dets_segment(seq_dets, start, end, sort_kwargs)[0]
+                    for start, end in segments
+                ],
+            )
+            num_ids = len(np.unique(rows[:, 1]))
+            pairs, agree = id_agreement(rows, single)
+            name = "seed %d, %d segments" % (seed, n)
+            if abs(len(rows) - len(single)) > tolerance * len(single):
+                failed.append(
+                    "%s: %d rows, %d in one run" % (name, len(rows), len(single))
+                )
+            elif abs(num_ids - single_ids) > tolerance * single_ids:
+                failed.append("%s: %d ids, %d in one run" % (name, num_ids, single_ids))
+            elif agree < (1.0 - tolerance) * len(single):
+                failed.append(
+                    "%s: %d of %d rows with the ids of one run"
+                    % (name, agree, len(single))
+                )
+    return failed
+
+
+def write_tracks(path, output_format, rows):
+    """Write the [frame, id, x1, y1, x2, y2] rows with a TrackWriter."""
+    with TrackWriter(path, output_format) as out_file:
+        frames, offsets = np.unique(rows[:, 0], return_index=True)
+        offsets = np.append(offsets, len(rows))
+        for i, frame in enumerate(frames.astype(np.int64)):
+            tracks = rows[offsets[i] : offsets[i + 1]]
+            # MOT frames begin at 1
+            out_file.write(frame + 1, np.column_stack((tracks[:, 2:], tracks[:, 1])))
+
+
+def detector_kwargs(args):
+    """Arguments of the detector chosen with --detector."""
+    if args.detector == "motion":
+        return {"scale": args.scale, "method": args.motion_method}
+    if args.detector == "yolo":
+        return {"weights": args.weights, "repo": args.repo, "batch_size": 1}
+    return {}
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description="Segment-parallel video tracking")
+    inputs = parser.add_mutually_exclusive_group()
+    inputs.add_argument("--video", help="Video to track.", type=str)
+    inputs.add_argument(
+        "--dets", help="MOT det.txt file to track instead of a video.", type=str
+    )
+    parser.add_argument(
+        "--detector",
+        help="Detector to run on --video, stateless to split it [yolo].",
+        choices=sorted(DETECTORS),
+        default="yolo",
+    )
+    parser.add_argument(
+        "--motion_method",
+        help="Background model of the motion detector [mog2].",
+        choices=MotionDetector.METHODS,
+        default="mog2",
+    )
+    parser.add_argument(
+        "--scale",
+        help="Downscale factor of the frames for the motion detector [1.0].",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--weights", help="YOLO checkpoint or model name.", default="yolov5s"
+    )
+    parser.add_argument(
+        "--repo", help="torch.hub repository of YOLO.", default="ultralytics/yolov5"
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of processes tracking segments in parallel [1].",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--segments",
+        help="Number of segments, by default one per worker.",
+        type=int,
+    )
+    parser.add_argument(
+        "--overlap",
+        help="Frames every segment shares with the next one.",
+        type=int,
+        default=50,
+    )
+    parser.add_argument(
+        "--max_age",
+        help="Maximum number of frames to keep alive a track without associated detections.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--min_hits",
+        help="Minimum number of associated detections before track is initialised.",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3
+    )
+    parser.add_argument(
+        "--stitch_threshold",
+        help="Minimum mean IOU of two tracks in an overlap to stitch them.",
+        type=float,
+        default=0.3,
+    )
+    parser.add_argument("--output", help="File to write the tracks to.", type=str)
+    parser.add_argument(
+        "--output_format",
+        help="Format of --output [txt].",
+        choices=TRACK_FORMATS,
+        default="txt",
+    )
+    parser.add_argument(
+        "--check",
+        help="Compare the stitched tracks of synthetic sequences to a single run.",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    if not args.check and args.video is None and args.dets is None:
+        parser.error("one of --video, --dets or --check is required")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.check:
+        failed = check_stitching(overlap=args.overlap)
+        for failure in failed:
+            print(failure)
+        print("stitching check %s" % ("failed" if failed else "passed"))
+        raise SystemExit(1 if failed else 0)
+    if args.dets:
+        # the cache is built once here and memory-mapped by every worker
+        num_frames = MOTDetections.from_file(args.dets, cache=True).num_frames
+    else:
+        with FrameSource(args.video) as source:
+            num_frames = source.num_frames
+        if num_frames <= 0:
+            raise SystemExit(
+                "Unknown length of %s, streams cannot be split" % args.video
+            )
+    segments = split_segments(num_frames, args.segments or args.workers, args.overlap)
+    if args.video and len(segments) > 1 and not DETECTORS[args.detector].stateless:
+        raise SystemExit(
+            "The %s detector depends on the frames before, a video can only be split "
+            "with a stateless detector, or track its --dets" % args.detector
+        )
+    sort_kwargs = dict(
+        max_age=args.max_age,
+        min_hits=args.min_hits,
+        iou_threshold=args.iou_threshold,
+    )
+    if args.dets:
+        segment = partial(track_dets_segment, args.dets, sort_kwargs=sort_kwargs)
+    else:
+        segment = partial(
+            track_segment,
+            args.video,
+            detector=args.detector,
+            detector_kwargs=detector_kwargs(args),
+            sort_kwargs=sort_kwargs,
+        )
+    start_time = time.time()
+    if args.workers > 1:
+        # one OpenCV thread per process, the pool already uses the cores
+        with ProcessPoolExecutor(
+            max_workers=args.workers, initializer=cv2.setNumThreads, initargs=(1,)
+        ) as pool:
+            futures = [pool.submit(segment, start, end) for start, end in segments]
+            results = [future.result() for future in futures]
+    else:
+        results = [segment(start, end) for start, end in segments]
+    rows = stitch_segments(
+        segments, [r[0] for r in results], args.stitch_threshold, min_frames=3
+    )
+    wall_time = time.time() - start_time
+    if args.output:
+        write_tracks(args.output, args.output_format, rows)
+
+    total_time = 0.0
+    total_frames = 0
+    for (start, end), (_, seg_frames, seg_time) in zip(segments, results):
+        print(
+            "frames %d-%d: %.3f seconds for %d frames or %.1f FPS"
+            % (start, end - 1, seg_time, seg_frames, seg_frames / seg_time)
+        )
+        total_time += seg_time
+        total_frames += seg_frames
+    print(
+        "%d tracks in %d frames, %d frames tracked twice in overlaps"
+        % (len(np.unique(rows[:, 1])), num_frames, total_frames - num_frames)
+    )
+    print(
+        "Wall clock: %.3f seconds with %d workers or %.1f FPS"
+        % (wall_time, args.workers, num_frames / wall_time)
+    )
@@ -0,0 +1,492 @@
+"""Servicio de seguimiento.
+
+Local service keeping one SORT tracker per stream id, for processes that
+track many streams (e.g. cameras) and should not each run their own
+trackers. Requests of all the connections are queued, and every tick
+advances the streams with a pending frame in one MultiSort.update, waiting
+up to batch_window seconds to gather more streams:
+
+  $ python service.py serve --socket /tmp/sort.sock
+  $ python service.py load --socket /tmp/sort.sock --streams 64 --fps 30
+
+Messages are a REQUEST header [stream, request id, N] followed by N
+float32 [x1,y1,x2,y2,score] detections, answered by a RESPONSE header
+[request id, N] followed by N TRACK_DTYPE tracks. Requests on a connection
+may be pipelined, their responses carry the request id. The frames of a
+stream are tracked in the order they arrive, one per tick. A stream without
+requests for stream_timeout seconds is dropped with its tracks, and its next
+request starts it again from scratch. There is no error response: a request
+that fails, or would exceed max_streams, closes its connection.
+"""
+
+import argparse
+import asyncio
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sort import MultiSort
+
+# stream, request id, number of detections
+REQUEST = struct.Struct("<III")
+# request id, number of tracks
+RESPONSE = struct.Struct("<II")
+DETECTION_DTYPE = np.dtype("<f4")
+TRACK_DTYPE = np.dtype([("box", "<f4", (4,)), ("id", "<u4")])
+# larger requests are taken as a corrupt stream and close the connection
+MAX_DETECTIONS = 1 << 16
+
+
+def encode_request(stream, request_id, dets):
+    """Request tracking the (N, 5) [x1,y1,x2,y2,score] dets of a stream."""
+    dets = np.asarray(dets, dtype=DETECTION_DTYPE).reshape(-1, 5)
+    return REQUEST.pack(stream, request_id, len(dets)) + dets.tobytes()
+
+
+def encode_response(request_id, tracks):
+    """Response with the (N, 5) [x1,y1,x2,y2,id] tracks of Sort.update."""
+    records = np.empty(len(tracks), dtype=TRACK_DTYPE)
+    records["box"] = tracks[:, :4]
+    records["id"] = tracks[:, 4]
+    return RESPONSE.pack(request_id, len(tracks)) + records.tobytes()
+
+
+def decode_tracks(payload):
+    """(N, 5) [x1,y1,x2,y2,id] tracks of the payload of a response."""
+    records = np.frombuffer(payload, dtype=TRACK_DTYPE)
+    tracks = np.empty((len(records), 5))
+    tracks[:, :4] = records["box"]
+    tracks[:, 4] = records["id"]
+    return tracks
+
+
+class TrackingService(object):
+    """Servicio de seguimiento multi-stream.
+
+    Keeps a MultiSort with a stream per stream id, added on its first
+    request. Requests are queued per stream, and a tick takes the oldest
+    request of every stream, waiting batch_window seconds for more streams
+    unless max_batch of them are already pending. Ticks run in a worker
+    thread, so the event loop keeps reading requests meanwhile. Streams idle
+    for stream_timeout seconds are dropped between ticks and their MultiSort
+    streams reused, so memory is bounded by the streams in use.
+    """
+
+    def __init__(
+        self,
+        max_age=1,
+        min_hits=3,
+        iou_threshold=0.3,
+        batch_window=0.002,
+        max_batch=256,
+        stream_timeout=60.0,
+        max_streams=4096,
+    ):
+        """Initialization.
+
+        Params:
+          max_age, min_hits, iou_threshold - parameters of every stream
+          batch_window - seconds a tick waits for more streams
+          max_batch - pending streams that start a tick without waiting
+          stream_timeout - seconds without requests after which a stream is
+            dropped
+          max_streams - streams tracked at once, requests of further streams
+            fail
+        """
+        self.tracker = MultiSort(
+            max_age=max_age, min_hits=min_hits, iou_threshold=iou_threshold
+        )
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.stream_timeout = stream_timeout
+        self.max_streams = max_streams
+        self.streams = {}  # stream id -> MultiSort stream
+        self.free_streams = []  # MultiSort streams of dropped stream ids
+        self.last_request = {}  # stream id -> loop time of its last request
+        self.pending = {}  # stream id -> deque of (dets, future)
+        self.ticking = set()  # stream ids of the running tick
+        self.next_expiry = 0.0
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.ready = asyncio.Event()
+        self.full = asyncio.Event()
+        self.ticks = 0
+        self.requests = 0
+        self.failed = 0
+        self.expired = 0
+        self.tick_times = deque(maxlen=10000)
+
+    def submit(self, stream, dets):
+        """Queue the detections of a stream, returns a future of its tracks."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        new = stream not in self.last_request
+        if new and len(self.last_request) >= self.max_streams:
+            self.expire(loop.time())
+        if new and len(self.last_request) >= self.max_streams:
+            self.failed += 1
+            future.set_exception(
+                RuntimeError("Too many streams, at most %d" % self.max_streams)
+            )
+            return future
+        self.last_request[stream] = loop.time()
+        self.pending.setdefault(stream, deque()).append((dets, future))
+        self.ready.set()
+        if len(self.pending) >= self.max_batch:
+            self.full.set()
+        return future
+
+    def _tick(self, batch):
+        """Advance the streams of batch, {stream id: dets}, in a MultiSort step."""
+        for stream in batch:
+            if stream not in self.streams:
+                if self.free_streams:
+                    self.streams[stream] = self.free_streams.pop()
+                else:
+                    self.streams[stream] = self.tracker.add_stream()
+        start = time.perf_counter()
+        tracks = self.tracker.update(
+            {self.streams[stream]: dets for stream, dets in batch.items()}
+        )
+        self.tick_times.append(time.perf_counter() - start)
+        return {stream: tracks[self.streams[stream]] for stream in batch}
+
+    def _free_stream(self, index):
+        """Reset a MultiSort stream and make it available to new stream ids."""
+        self.tracker.reset_stream(index)
+        self.free_streams.append(index)
+
+    def expire(self, now):
+        """Drop the streams without requests since now - stream_timeout."""
+        for stream, last in list(self.last_request.items()):
+            if (
+                now - last < self.stream_timeout
+                or stream in self.pending
+                or stream in self.ticking
+            ):
+                continue
+            del self.last_request[stream]
+            index = self.streams.pop(stream, None)
+            if index is not None:
+                # in the tick thread, after the running tick
+                self.executor.submit(self._free_stream, index)
+            self.expired += 1
+
+    async def run(self):
+        """Run ticks while there are requests, until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.ready.wait()
+            if self.batch_window > 0 and not self.full.is_set():
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.batch_window)
+                except asyncio.TimeoutError:
+                    pass
+            self.ready.clear()
+            self.full.clear()
+            batch, futures = {}, {}
+            for stream in list(self.pending):
+                queue = self.pending[stream]
+                batch[stream], futures[stream] = queue.popleft()
+                if not queue:
+                    del self.pending[stream]
+            if self.pending:
+                self.ready.set()
+            self.ticking = set(batch)
+            try:
+                tracks = await loop.run_in_executor(self.executor, self._tick, batch)
+            except Exception as exc:
+                # fail this batch only, the next ticks go on
+                self.failed += len(batch)
+                for future in futures.values():
+                    if not future.done():
+                        future.set_exception(exc)
+            else:
+                self.ticks += 1
+                self.requests += len(batch)
+                for stream, future in futures.items():
+                    if not future.done():
+                        future.set_result(tracks[stream])
+            self.ticking = set()
+            now = loop.time()
+            if now >= self.next_expiry:
+                self.expire(now)
+                self.next_expiry = now + min(self.stream_timeout, 1.0)
+
+    async def handle(self, reader, writer):
+        """Serve the requests of a connection."""
+
+        def respond(request_id, future):
+            if future.cancelled() or writer.is_closing():
+                return
+            if future.exception() is not None:
+                # no error responses, the client sees the connection close
+                writer.close()
+                return
+            writer.write(encode_response(request_id, future.result()))
+
+        try:
+            while True:
+                header = await reader.readexactly(REQUEST.size)
+                stream, request_id, num_dets = REQUEST.unpack(header)
+                if num_dets > MAX_DETECTIONS:
+                    break
+                payload = await reader.readexactly(
+                    num_dets * 5 * DETECTION_DTYPE.itemsize
+                )
+                dets = np.frombuffer(payload, dtype=DETECTION_DTYPE).reshape(-1, 5)
+                future = self.submit(stream, dets)
+                future.add_done_callback(lambda f, r=request_id: respond(r, f))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def report(self):
+        """Requests, ticks and the streams and time per tick."""
+        times = np.array(self.tick_times) * 1e3
+        return (
+            "%d streams, %d expired, %d requests in %d ticks or %.1f streams "
+            "per tick, %d failed, tick p50 %.3f ms p99 %.3f ms"
+            % (
+                len(self.streams),
+                self.expired,
+                self.requests,
+                self.ticks,
+                self.requests / max(self.ticks, 1),
+                self.failed,
+                np.percentile(times, 50) if len(times) else 0.0,
+                np.percentile(times, 99) if len(times) else 0.0,
+            )
+        )
+
+
+class TrackingClient(object):
+    """Cliente del servicio.
+
+    Sends the detections of any number of streams over one connection and
+    awaits their tracks, several requests may be in flight at once.
+    """
+
+    def __init__(self, reader, writer):
+        """Initialization.
+
+        Params:
+          reader, writer - asyncio streams of an open connection
+        """
+        self.reader = reader
+        self.writer = writer
+        self.next_request = 0
+        self.waiting = {}  # request id -> future
+        self.reading = asyncio.ensure_future(self._read_responses())
+
+    @classmethod
+    async def connect(cls, socket_path=None, host="127.0.0.1", port=8765):
+        """Connect to the Unix socket_path, or else to host:port."""
+        if socket_path:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def _read_responses(self):
+        """Resolve the futures of the responses as they come."""
+        try:
+            while True:
+                header = await self.reader.readexactly(RESPONSE.size)
+                request_id, num_tracks = RESPONSE.unpack(header)
+                payload = await self.reader.readexactly(
+                    num_tracks * TRACK_DTYPE.itemsize
+                )
+                future = self.waiting.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(decode_tracks(payload))
+        except (asyncio.IncompleteReadError, ConnectionError) as exc:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Service closed: %s" % exc))
+            self.waiting.clear()
+
+    async def update(self, stream, dets):
+        """Tracks of stream after its next frame, in the format of Sort.update."""
+        request_id = self.next_request
+        self.next_request = (self.next_request + 1) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request_id] = future
+        self.writer.write(encode_request(stream, request_id, dets))
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        """Close the connection."""
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.reading.cancel()
+
+
+async def serve(args):
+    """Run the service until interrupted."""
+    service = TrackingService(
+        max_age=args.max_age,
+        min_hits=args.min_hits,
+        iou_threshold=args.iou_threshold,
+        batch_window=args.batch_window,
+        max_batch=args.max_batch,
+        stream_timeout=args.stream_timeout,
+        max_streams=args.max_streams,
+    )
+    if args.socket:
+        server = await asyncio.start_unix_server(service.handle, args.socket)
+    else:
+        server = await asyncio.start_server(service.handle, args.host, args.port)
+    ticks = asyncio.ensure_future(service.run())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        ticks.cancel()
+        service.executor.shutdown()
+        print(service.report())
+
+
+async def load(args):
+    """Load generator.
+
+    Drives --streams streams of synthetic detections (see
+    bench_sort.synthetic_scene) over --connections connections, every stream
+    sending a frame at --fps, or as soon as it gets the tracks of the last
+    one with --fps 0, and prints the percentiles of the request latency.
+    """
+    from bench_sort import synthetic_scene
+
+    clients = [
+        await TrackingClient.connect(args.socket, args.host, args.port)
+        for _ in range(args.connections)
+    ]
+    latency = []
+
+    async def drive(stream, client):
+        frames = synthetic_scene(args.objects, num_frames=args.frames, seed=stream)
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        for dets in frames:
+            start = time.perf_counter()
+            await client.update(stream, dets)
+            latency.append(time.perf_counter() - start)
+            if args.fps > 0:
+                next_time += 1.0 / args.fps
+                await asyncio.sleep(max(0.0, next_time - loop.time()))
+
+    start_time = time.perf_counter()
+    await asyncio.gather(
+        *(
+            drive(args.first_stream + i, clients[i % len(clients)])
+            for i in range(args.streams)
+        )
+    )
+    wall_time = time.perf_counter() - start_time
+    for client in clients:
+        await client.close()
+    latency = np.array(latency) * 1e3
+    print(
+        "%d streams over %d connections, %d requests in %.3f seconds or %.1f per second"
+        % (
+            args.streams,
+            args.connections,
+            len(latency),
+            wall_time,
+            len(latency) / wall_time,
+        )
+    )
+    print(
+        "latency [ms] p50 %.3f p95 %.3f p99 %.3f max %.3f"
+        % (
+            np.percentile(latency, 50),
+            np.percentile(latency, 95),
+            np.percentile(latency, 99),
+            latency.max(),
+        )
+    )
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description="SORT tracking service")
+    parser.add_argument(
+        "mode", help="Run the service or the load generator.", choices=("serve", "load")
+    )
+    parser.add_argument("--socket", help="Unix socket, else TCP.", type=str)
+    parser.add_argument("--host", help="TCP host.", type=str, default="127.0.0.1")
+    parser.add_argument("--port", help="TCP port.", type=int, default=8765)
+    parser.add_argument(
+        "--max_age",
+        help="Maximum number of frames to keep alive a track without associated detections.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--min_hits",
+        help="Minimum number of associated detections before track is initialised.",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3
+    )
+    parser.add_argument(
+        "--batch_window",
+        help="Seconds a tick waits to gather more streams.",
+        type=float,
+        default=0.002,
+    )
+    parser.add_argument(
+        "--max_batch",
+        help="Pending streams that start a tick at once.",
+        type=int,
+        default=256,
+    )
+    parser.add_argument(
+        "--stream_timeout",
+        help="Seconds without requests after which a stream is dropped.",
+        type=float,
+        default=60.0,
+    )
+    parser.add_argument(
+        "--max_streams",
+        help="Streams tracked at once, requests of further streams fail.",
+        type=int,
+        default=4096,
+    )
+    parser.add_argument(
+        "--streams", help="Streams of the load generator.", type=int, default=16
+    )
+    parser.add_argument(
+        "--first_stream", help="Id of the first stream.", type=int, default=0
+    )
+    parser.add_argument(
+        "--connections",
+        help="Connections the streams are spread over.",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--frames", help="Frames sent per stream.", type=int, default=200
+    )
+    parser.add_argument("--objects", help="Objects per stream.", type=int, default=20)
+    parser.add_argument(
+        "--fps",
+        help="Frames per second of every stream, 0 sends back to back.",
+        type=float,
+        default=30.0,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        asyncio.run(serve(args) if args.mode == "serve" else load(args))
+    except KeyboardInterrupt:
+        pass
@@ -19,35 +19,117 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
 
-import argparse
-import glob
-import os
+import math
+import struct
 import time
+from collections import deque
 
-import matplotlib
-import matplotlib.patches as patches
-import matplotlib.pyplot as plt
 import numpy as np
-from filterpy.kalman import KalmanFilter
-from skimage import io
 
-matplotlib.use("TkAgg")
+LINEAR_ASSIGNMENT_SOLVERS = {}
+_resolved_solvers = {}
+
+# with decompose=True, problems with fewer detections or trackers are still
+# solved in one piece by the dense path, faster below about 150 boxes in the
+# frames of bench_association.py
+DECOMPOSE_MIN_SIZE = 200
+
+# magic, version, dtype of the states, tracks, frame_count and next_id of a
+# Sort snapshot, followed by the arrays of KalmanBoxTrackerBank.snapshot_into
+SNAPSHOT_HEADER = struct.Struct("<4sI8sqqq")
+SNAPSHOT_MAGIC = b"SORT"
+SNAPSHOT_VERSION = 1
+
+# ways associate_detections_to_trackers can solve a frame
+ASSOCIATION_PATHS = (
+    "empty",
+    "one_to_one",
+    "solver",
+    "decomposed",
+    "gated_one_to_one",
+    "gated_solver",
+)
+
+
+def register_solver(name):
+    """Register a linear assignment solver.
+
+    Decorates a factory that imports whatever the solver needs and returns a
+    function mapping a cost matrix to the (row, col) pairs of the assignment
+    that minimises the total cost. The factory runs once, on first use.
+    """
 
-np.random.seed(0)
+    def register(factory):
+        LINEAR_ASSIGNMENT_SOLVERS[name] = factory
+        return factory
 
+    return register
+
+
+@register_solver("lapjv")
+def _lapjv_solver():
+    import lap
+
+    def solve(cost_matrix):
+        _, x, _ = lap.lapjv(cost_matrix, extend_cost=True)
+        rows = np.flatnonzero(x >= 0)
+        return np.stack((rows, x[rows]), axis=1)
+
+    return solve
 
-def linear_assignment(cost_matrix):
-    """Asignacion lineal."""
-    try:
-        import lap
 
-        _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
-        return np.array([[y[i], i] for i in x if i >= 0])  #
-    except ImportError:
-        from scipy.optimize import linear_sum_assignment
+@register_solver("scipy")
+def _scipy_solver():
+    from scipy.optimize import linear_sum_assignment
 
+    def solve(cost_matrix):
         x, y = linear_sum_assignment(cost_matrix)
-        return np.array(list(zip(x, y)))
+        return np.stack((x, y), axis=1)
+
+    return solve
+
+
+@register_solver("greedy")
+def _greedy_solver():
+    def solve(cost_matrix):
+        """Approximate: takes the cheapest free pair until a side runs out."""
+        order = np.argsort(cost_matrix, axis=None, kind="stable")
+        rows, cols = np.unravel_index(order, cost_matrix.shape)
+        free_rows = np.ones(cost_matrix.shape[0], dtype=bool)
+        free_cols = np.ones(cost_matrix.shape[1], dtype=bool)
+        matched = []
+        for r, c in zip(rows.tolist(), cols.tolist()):
+            if free_rows[r] and free_cols[c]:
+                free_rows[r] = free_cols[c] = False
+                matched.append((r, c))
+                if len(matched) == min(cost_matrix.shape):
+                    break
+        return np.array(sorted(matched), dtype=int).reshape(-1, 2)
+
+    return solve
+
+
+def get_solver(name=None):
+    """Get a linear assignment solver.
+
+    Resolves the solver registered under name, or lapjv falling back to scipy
+    when lap is not installed if name is None. Resolved solvers are cached.
+    """
+    if name not in _resolved_solvers:
+        if name is None:
+            try:
+                solver = LINEAR_ASSIGNMENT_SOLVERS["lapjv"]()
+            except ImportError:
+                solver = LINEAR_ASSIGNMENT_SOLVERS["scipy"]()
+        else:
+            solver = LINEAR_ASSIGNMENT_SOLVERS[name]()
+        _resolved_solvers[name] = solver
+    return _resolved_solvers[name]
+
+
+def linear_assignment(cost_matrix, solver=None):
+    """Asignacion lineal."""
+    return get_solver(solver)(cost_matrix)
 
 
 def iou_batch(bb_test, bb_gt):
@@ -70,6 +152,125 @@ def iou_batch(bb_test, bb_gt):
     return o
 
 
+def iou_sparse(bb_test, bb_gt, test_groups=None, gt_groups=None):
+    """IOU between the overlapping boxes.
+
+    Sparse version of iou_batch: returns the (rows, cols, iou) triplets of the
+    bb_test/bb_gt pairs with positive overlap, sorted by row and then by column.
+    Candidates come from a uniform grid over the top left corners of bb_gt,
+    with cells as large as the largest box, so only boxes of neighbouring
+    cells are ever compared. When test_groups and gt_groups label the boxes
+    with non negative integers, only boxes of the same group are paired.
+    """
+    if len(bb_test) == 0 or len(bb_gt) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+    origin = bb_gt[:, :2].min(axis=0)
+    extent = bb_gt[:, :2].max(axis=0) - origin
+    # widened a little so that rounding never hides a candidate, and never
+    # finer than a million cells per side
+    max_wh = (bb_gt[:, 2:4] - bb_gt[:, :2]).max(axis=0) * (1.0 + 1e-6)
+    cell = np.maximum(np.maximum(max_wh, extent * 1e-6), np.finfo(float).tiny)
+    num_cells = (extent // cell).astype(np.int64) + 1
+    gx, gy = ((bb_gt[:, :2] - origin) // cell).astype(np.int64).T
+    if gt_groups is not None:
+        gy += np.asarray(gt_groups, dtype=np.int64) * num_cells[1]
+    order = np.argsort(gy * num_cells[0] + gx, kind="stable")
+    keys = (gy * num_cells[0] + gx)[order]
+
+    # cells that may hold the top left corner of an overlapping box
+    first = (bb_test[:, :2] - max_wh - origin) // cell
+    last = (bb_test[:, 2:4] - origin) // cell
+    first = np.clip(first, 0, num_cells - 1).astype(np.int64)
+    last = np.clip(last, -1, num_cells - 1).astype(np.int64)
+    # one contiguous run of keys per test box and grid row
+    row_counts = np.maximum(last[:, 1] - first[:, 1] + 1, 0)
+    test = np.repeat(np.arange(len(bb_test)), row_counts)
+    grid_row = np.repeat(first[:, 1] - np.cumsum(row_counts) + row_counts, row_counts)
+    grid_row += np.arange(len(test))
+    if test_groups is not None:
+        grid_row += np.asarray(test_groups, dtype=np.int64)[test] * num_cells[1]
+    lo = np.searchsorted(keys, grid_row * num_cells[0] + first[test, 0], side="left")
+    hi = np.searchsorted(keys, grid_row * num_cells[0] + last[test, 0], side="right")
+    counts = np.maximum(hi - lo, 0)
+    rows = np.repeat(test, counts)
+    start = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    cols = order[start + np.arange(len(rows))]
+
+    bb_test = bb_test[rows]
+    bb_gt = bb_gt[cols]
+    xx1 = np.maximum(bb_test[:, 0], bb_gt[:, 0])
+    yy1 = np.maximum(bb_test[:, 1], bb_gt[:, 1])
+    xx2 = np.minimum(bb_test[:, 2], bb_gt[:, 2])
+    yy2 = np.minimum(bb_test[:, 3], bb_gt[:, 3])
+    w = np.maximum(0.0, xx2 - xx1)
+    h = np.maximum(0.0, yy2 - yy1)
+    wh = w * h
+    o = wh / (
+        (bb_test[:, 2] - bb_test[:, 0]) * (bb_test[:, 3] - bb_test[:, 1])
+        + (bb_gt[:, 2] - bb_gt[:, 0]) * (bb_gt[:, 3] - bb_gt[:, 1])
+        - wh
+    )
+    keep = o > 0
+    rows, cols, o = rows[keep], cols[keep], o[keep]
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], o[order]
+
+
+def sparse_assignment(rows, cols, ious, num_rows, num_cols, solver=None):
+    """Asignacion lineal dispersa.
+
+    Maximises the total IOU over the sparse (rows, cols, ious) graph. Each
+    connected component of the graph is solved on its own: when the best pairs
+    of its rows (or columns) do not compete for the same box they are the
+    optimum, otherwise linear_assignment solves its small dense block. Zero
+    IOU pairs never change the optimum, so with an exact solver the matches
+    are those of the dense problem.
+    Returns the matched (row, col) pairs sorted by row and their IOU.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    size = num_rows + num_cols
+    graph = coo_matrix(
+        (np.ones(len(rows)), (rows, num_rows + cols)), shape=(size, size)
+    )
+    num_components, labels = connected_components(graph, directed=False)
+    component = labels[rows]
+    # components where the best pair of every row (or of every column) uses a
+    # distinct column (row) are solved by those pairs, no solver needed
+    solved = np.zeros(num_components, dtype=bool)
+    matched = []
+    for mine, other, num_other in ((rows, cols, num_cols), (cols, rows, num_rows)):
+        edges = np.lexsort((-ious, mine))
+        first = np.ones(len(edges), dtype=bool)
+        first[1:] = mine[edges[1:]] != mine[edges[:-1]]
+        best = edges[first]
+        clash = np.bincount(other[best], minlength=num_other)[other[best]] > 1
+        ok = np.ones(num_components, dtype=bool)
+        ok[component[best[clash]]] = False
+        ok &= ~solved
+        matched.append(best[ok[component[best]]])
+        solved |= ok
+
+    shared = np.flatnonzero(~solved[component])
+    shared = shared[np.argsort(component[shared], kind="stable")]
+    bounds = np.flatnonzero(np.diff(component[shared])) + 1
+    for edges in np.split(shared, bounds) if len(shared) > 0 else []:
+        r, ri = np.unique(rows[edges], return_inverse=True)
+        c, ci = np.unique(cols[edges], return_inverse=True)
+        cost = np.zeros((len(r), len(c)))
+        cost[ri, ci] = -ious[edges]
+        block = np.full((len(r), len(c)), -1)
+        block[ri, ci] = edges
+        m = linear_assignment(cost, solver).reshape(-1, 2)
+        # the solver may also pair boxes that do not overlap at all
+        edge = block[m[:, 0], m[:, 1]]
+        matched.append(edge[edge >= 0])
+    matched = np.concatenate(matched)
+    matched = matched[np.argsort(rows[matched], kind="stable")]
+    return np.stack((rows[matched], cols[matched]), axis=1), ious[matched]
+
+
 def convert_bbox_to_z(bbox):
     """Convertir bbox a z.
 
@@ -104,51 +305,158 @@ def convert_x_to_bbox(x, score=None):
         ).reshape((1, 5))
 
 
+def convert_bboxes_to_z(bboxes):
+    """Convertir bboxes a z.
+
+    Batched version of convert_bbox_to_z: takes an (N, 4+) array of boxes in
+    the form [x1,y1,x2,y2] and returns an (N, 4) array of [x,y,s,r] rows.
+    """
+    w = bboxes[:, 2] - bboxes[:, 0]
+    h = bboxes[:, 3] - bboxes[:, 1]
+    z = np.empty((len(bboxes), 4), dtype=np.result_type(bboxes, np.float32))
+    z[:, 0] = bboxes[:, 0] + w / 2.0
+    z[:, 1] = bboxes[:, 1] + h / 2.0
+    z[:, 2] = w * h  # scale is just area
+    z[:, 3] = w / h
+    return z
+
+
+def convert_x_to_bboxes(x, out=None):
+    """Convertir x a bboxes.
+
+    Batched version of convert_x_to_bbox: takes an (N, 4+) array of states in
+    the centre form [x,y,s,r] and returns an (N, 4) array of [x1,y1,x2,y2] rows,
+    written into out when given.
+    """
+    w = np.sqrt(x[:, 2] * x[:, 3])
+    h = x[:, 2] / w
+    bboxes = np.empty((len(x), 4), dtype=x.dtype) if out is None else out
+    bboxes[:, 0] = x[:, 0] - w / 2.0
+    bboxes[:, 1] = x[:, 1] - h / 2.0
+    bboxes[:, 2] = x[:, 0] + w / 2.0
+    bboxes[:, 3] = x[:, 1] + h / 2.0
+    return bboxes
+
+
+def constant_velocity_model(dtype=np.float64):
+    """Constant velocity model.
+
+    Returns the F, H, Q, R and initial P matrices shared by every box tracker.
+    """
+    F = np.eye(7, dtype=dtype)
+    F[0, 4] = F[1, 5] = F[2, 6] = 1.0
+    H = np.eye(4, 7, dtype=dtype)
+    Q = np.eye(7, dtype=dtype)
+    Q[-1, -1] *= 0.01
+    Q[4:, 4:] *= 0.01
+    R = np.eye(4, dtype=dtype)
+    R[2:, 2:] *= 10.0
+    P = np.eye(7, dtype=dtype)
+    P[4:, 4:] *= 1000.0  # give high uncertainty to the unobservable initial velocities
+    P *= 10.0
+    return F, H, Q, R, P
+
+
+def predict_covariances(P, Q):
+    """P = FPF' + Q of the constant velocity model, in place on the (N, 7, 7) P."""
+    P[:, :3, :] += P[:, 4:, :]
+    P[:, :, :3] += P[:, :, 4:]
+    P += Q
+    return P
+
+
+def update_covariances(P, R, identity):
+    """Kalman gains.
+
+    Returns the (N, 7, 4) gains and the updated covariances of the (N, 7, 7)
+    predicted covariances P, with the Joseph form. identity is the 7x7
+    identity of the dtype of P.
+    """
+    PHT = P[:, :, :4]
+    S = PHT[:, :4, :] + R
+    K = PHT @ np.linalg.inv(S)
+    I_KH = np.broadcast_to(identity, P.shape).copy()
+    I_KH[:, :, :4] -= K
+    P = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ R @ K.transpose(0, 2, 1)
+    return K, P
+
+
+class GainCache(object):
+    """Ganancia de estado estacionario.
+
+    F, H, Q, R and the initial P are shared by every track, so a track
+    matched frame after frame converges to the steady state of the filter,
+    the covariance that predicting and updating leaves unchanged, with a
+    constant gain. The steady covariance, its prediction and the gain are
+    computed once, iterating the filter until it converges. Tracks at the
+    steady state keep no covariance of their own: predicting them costs
+    nothing and updating them x += K y. KalmanBoxTrackerBank filters the
+    other tracks exactly, new ones and those that missed a frame, until after
+    an update their covariance is within tolerance of the steady one,
+    relative to its largest entry. A cache can be shared by trackers of the
+    same dtype.
+    """
+
+    def __init__(self, tolerance=5e-3, dtype=np.float64, max_iterations=10000):
+        """Initialization.
+
+        Params:
+          tolerance - largest difference of a covariance to the steady one,
+            relative to its largest entry, for a track to take the steady state
+          dtype - floating point type of the covariances and gains
+          max_iterations - filter steps allowed to converge
+        """
+        self.tolerance = tolerance
+        self.dtype = np.dtype(dtype)
+        _, _, Q, R, P = constant_velocity_model(np.float64)
+        identity = np.eye(7)
+        P = P[None]
+        for _ in range(max_iterations):
+            predicted = predict_covariances(P.copy(), Q)
+            K, updated = update_covariances(predicted, R, identity)
+            if np.abs(updated - P).max() <= 1e-12 * np.abs(updated).max():
+                break
+            P = updated
+        else:
+            raise ValueError(
+                "Kalman filter not converged in %d iterations" % max_iterations
+            )
+        self.P = updated[0].astype(self.dtype)
+        self.predicted = predicted[0].astype(self.dtype)
+        self.K = K[0].astype(self.dtype)
+        self._scale = np.abs(self.P).max()
+
+    def steady(self, P):
+        """True for the (N, 7, 7) updated covariances P close to the steady one."""
+        diff = np.abs(P - self.P).reshape(len(P), 49).max(axis=1)
+        return diff <= self.tolerance * self._scale
+
+
 class KalmanBoxTracker(object):
     """This class represents the internal state of individual tracked objects observed as bbox."""
 
     count = 0
+    # predicted boxes kept in history while coasting
+    history_size = 64
 
     def __init__(self, bbox):
         """Initialization.
 
         Initialises a tracker using initial bounding box.
         """
+        from filterpy.kalman import KalmanFilter
+
         # define constant velocity model
         self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        self.kf.F = np.array(
-            [
-                [1, 0, 0, 0, 1, 0, 0],
-                [0, 1, 0, 0, 0, 1, 0],
-                [0, 0, 1, 0, 0, 0, 1],
-                [0, 0, 0, 1, 0, 0, 0],
-                [0, 0, 0, 0, 1, 0, 0],
-                [0, 0, 0, 0, 0, 1, 0],
-                [0, 0, 0, 0, 0, 0, 1],
-            ]
+        self.kf.F, self.kf.H, self.kf.Q, self.kf.R, self.kf.P = (
+            constant_velocity_model()
         )
-        self.kf.H = np.array(
-            [
-                [1, 0, 0, 0, 0, 0, 0],
-                [0, 1, 0, 0, 0, 0, 0],
-                [0, 0, 1, 0, 0, 0, 0],
-                [0, 0, 0, 1, 0, 0, 0],
-            ]
-        )
-
-        self.kf.R[2:, 2:] *= 10.0
-        self.kf.P[
-            4:, 4:
-        ] *= 1000.0  # give high uncertainty to the unobservable initial velocities
-        self.kf.P *= 10.0
-        self.kf.Q[-1, -1] *= 0.01
-        self.kf.Q[4:, 4:] *= 0.01
 
         self.kf.x[:4] = convert_bbox_to_z(bbox)
         self.time_since_update = 0
         self.id = KalmanBoxTracker.count
         KalmanBoxTracker.count += 1
-        self.history = []
+        self.history = deque(maxlen=self.history_size)
         self.hits = 0
         self.hit_streak = 0
         self.age = 0
@@ -156,7 +464,7 @@ class KalmanBoxTracker(object):
     def update(self, bbox):
         """Updates the state vector with observed bbox."""
         self.time_since_update = 0
-        self.history = []
+        self.history.clear()
         self.hits += 1
         self.hit_streak += 1
         self.kf.update(convert_bbox_to_z(bbox))
@@ -184,69 +492,715 @@ class KalmanBoxTracker(object):
         return convert_x_to_bbox(self.kf.x)
 
 
-def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
+class KalmanBoxTrackerBank(object):
+    """Struct-of-arrays bank of box trackers.
+
+    Keeps the states (N x 7), covariances (N x 7 x 7), counters and ids of every
+    track in NumPy arrays so that predict, update, birth and death each run as
+    one batched operation. The filter is the same constant velocity model used
+    by KalmanBoxTracker, with the products by F and H expanded by hand.
+    """
+
+    # values of _steady of the tracks at the steady state of a GainCache
+    STEADY_UPDATED = 1
+    STEADY_PREDICTED = 2
+
+    _fields = (
+        "_x",
+        "_P",
+        "_steady",
+        "_ids",
+        "_hits",
+        "_hit_streak",
+        "_age",
+        "_time_since_update",
+        "_streams",
+        "_slots",
+    )
+
+    # fields of a snapshot, in buffer order, with the shape of every track
+    _snapshot_fields = (
+        ("_x", (7,)),
+        ("_P", (7, 7)),
+        ("_ids", ()),
+        ("_hits", ()),
+        ("_hit_streak", ()),
+        ("_age", ()),
+        ("_time_since_update", ()),
+    )
+
+    def __init__(self, dtype=np.float64, capacity=64, gain_cache=None):
+        """Initialization.
+
+        Params:
+          dtype - floating point type of the states and covariances
+          capacity - number of tracks to preallocate room for
+          gain_cache - a GainCache of the same dtype, the tracks at its steady
+            state are flagged in _steady instead of keeping their covariance
+        """
+        self.dtype = np.dtype(dtype)
+        if gain_cache is not None and gain_cache.dtype != self.dtype:
+            raise ValueError(
+                "Gain cache of %s, the tracks use %s" % (gain_cache.dtype, self.dtype)
+            )
+        self.F, self.H, self.Q, self.R, self.P0 = constant_velocity_model(self.dtype)
+        self._I = np.eye(7, dtype=self.dtype)
+        self.gain_cache = gain_cache
+        self.n = 0
+        self._x = np.zeros((capacity, 7), dtype=self.dtype)
+        self._P = np.zeros((capacity, 7, 7), dtype=self.dtype)
+        # 0 exact, STEADY_UPDATED or STEADY_PREDICTED at the steady state
+        self._steady = np.zeros(capacity, dtype=np.int8)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._hits = np.zeros(capacity, dtype=np.int64)
+        self._hit_streak = np.zeros(capacity, dtype=np.int64)
+        self._age = np.zeros(capacity, dtype=np.int64)
+        self._time_since_update = np.zeros(capacity, dtype=np.int64)
+        self._streams = np.zeros(capacity, dtype=np.int64)
+        self._slots = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self):
+        """Number of live tracks."""
+        return self.n
+
+    @property
+    def x(self):
+        """States of the live tracks."""
+        return self._x[: self.n]
+
+    @property
+    def P(self):
+        """Covariances of the live tracks, a copy with a gain cache."""
+        if self.gain_cache is not None:
+            steady = self._steady[: self.n]
+            P = self._P[: self.n].copy()
+            P[steady == self.STEADY_UPDATED] = self.gain_cache.P
+            P[steady == self.STEADY_PREDICTED] = self.gain_cache.predicted
+            return P
+        return self._P[: self.n]
+
+    @property
+    def steady(self):
+        """True for the live tracks at the steady state of the gain cache."""
+        return self._steady[: self.n] > 0
+
+    @property
+    def ids(self):
+        """Ids of the live tracks."""
+        return self._ids[: self.n]
+
+    @property
+    def hits(self):
+        """Total number of hits of the live tracks."""
+        return self._hits[: self.n]
+
+    @property
+    def hit_streak(self):
+        """Consecutive hits of the live tracks."""
+        return self._hit_streak[: self.n]
+
+    @property
+    def age(self):
+        """Age in frames of the live tracks."""
+        return self._age[: self.n]
+
+    @property
+    def time_since_update(self):
+        """Frames since the last hit of the live tracks."""
+        return self._time_since_update[: self.n]
+
+    @property
+    def streams(self):
+        """Stream of the live tracks, see MultiSort."""
+        return self._streams[: self.n]
+
+    @property
+    def slots(self):
+        """Slot of the live tracks in a TrajectoryStore, -1 without store."""
+        return self._slots[: self.n]
+
+    def _reserve(self, size):
+        """Grow the arrays so that they can hold at least size tracks."""
+        capacity = len(self._x)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        for name in self._fields:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[: self.n] = old[: self.n]
+            setattr(self, name, new)
+
+    def predict(self, idx=None, detected=True):
+        """Prediction.
+
+        Advances the state vectors of the tracks idx (all by default) and
+        returns their (N, 4) predicted boxes. detected=False is for frames the
+        detector skipped: only the states and the ages advance, not the
+        counters of hits and misses.
+        """
+        if idx is None:
+            x, P = self.x, self._P[: self.n]
+        else:
+            x, P = self._x[idx], self._P[idx]
+        x[(x[:, 6] + x[:, 2]) <= 0, 6] = 0.0
+        x[:, :3] += x[:, 4:]
+        if self.gain_cache is not None:
+            self._predict_steady(P, slice(0, self.n) if idx is None else idx)
+        predict_covariances(P, self.Q)
+        if idx is None:
+            self.age[:] += 1
+            if detected:
+                self.hit_streak[self.time_since_update > 0] = 0
+                self.time_since_update[:] += 1
+        else:
+            self._x[idx], self._P[idx] = x, P
+            self._age[idx] += 1
+            if detected:
+                self._hit_streak[idx] *= self._time_since_update[idx] == 0
+                self._time_since_update[idx] += 1
+        return convert_x_to_bboxes(x)
+
+    def _predict_steady(self, P, rows):
+        """Prepare the covariances P of the tracks rows for their prediction.
+
+        The covariances of the tracks at the steady state are not used, they
+        are predicted along with the others, which is cheaper than leaving
+        them out.
+        """
+        steady = self._steady[rows]
+        # tracks predicted twice without an update leave the steady state
+        P[steady == self.STEADY_PREDICTED] = self.gain_cache.predicted
+        self._steady[rows] = np.where(
+            steady == self.STEADY_UPDATED, self.STEADY_PREDICTED, 0
+        )
+
+    def _update_steady(self, idx):
+        """Gains of the tracks idx, updating the covariances of those not at the steady state."""
+        cache = self.gain_cache
+        steady = self._steady[idx] == self.STEADY_PREDICTED
+        K = np.empty((len(idx), 7, 4), dtype=self.dtype)
+        K[steady] = cache.K
+        exact = idx[~steady]
+        if len(exact) > 0:
+            P = self._P[exact]
+            P[self._steady[exact] == self.STEADY_UPDATED] = cache.P
+            K[~steady], P = update_covariances(P, self.R, self._I)
+            self._P[exact] = P
+            # back to the steady state once the covariance is close to it
+            steady[~steady] = cache.steady(P)
+        self._steady[idx] = np.where(steady, self.STEADY_UPDATED, 0)
+        return K
+
+    def update(self, idx, bboxes):
+        """Updates the state vectors of the tracks idx with observed bboxes."""
+        x = self._x[idx]
+        y = convert_bboxes_to_z(bboxes).astype(self.dtype, copy=False) - x[:, :4]
+        if self.gain_cache is not None:
+            K = self._update_steady(np.asarray(idx))
+        else:
+            K, self._P[idx] = update_covariances(self._P[idx], self.R, self._I)
+        x += (K @ y[:, :, None])[:, :, 0]
+        self._x[idx] = x
+        self._time_since_update[idx] = 0
+        self._hits[idx] += 1
+        self._hit_streak[idx] += 1
+
+    def birth(self, bboxes, ids, streams=0, slots=-1):
+        """Creates new tracks initialised from bboxes with the given ids."""
+        m = len(bboxes)
+        self._reserve(self.n + m)
+        new = slice(self.n, self.n + m)
+        self._x[new] = 0.0
+        self._x[new, :4] = convert_bboxes_to_z(bboxes)
+        self._P[new] = self.P0
+        self._steady[new] = 0
+        self._ids[new] = ids
+        self._hits[new] = 0
+        self._hit_streak[new] = 0
+        self._age[new] = 0
+        self._time_since_update[new] = 0
+        self._streams[new] = streams
+        self._slots[new] = slots
+        self.n += m
+
+    def remove(self, mask):
+        """Removes the tracks flagged in mask, keeping the order of the others."""
+        keep = np.flatnonzero(~mask)
+        for name in self._fields:
+            array = getattr(self, name)
+            array[: len(keep)] = array[keep]
+        self.n = len(keep)
+
+    def get_state(self):
+        """Get state.
+
+        Returns the (N, 4) current bounding box estimates.
+        """
+        return convert_x_to_bboxes(self.x)
+
+    def _snapshot_views(self, buffer, n, offset):
+        """Arrays of n tracks in buffer from offset, and the offset after them."""
+        views = []
+        for name, shape in self._snapshot_fields:
+            dtype = getattr(self, name).dtype
+            count = n * math.prod(shape)
+            view = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+            views.append((name, view.reshape((n,) + shape)))
+            offset += count * dtype.itemsize
+        return views, offset
+
+    def snapshot_size(self):
+        """Bytes written by snapshot_into."""
+        per_track = sum(
+            getattr(self, name).dtype.itemsize * math.prod(shape)
+            for name, shape in self._snapshot_fields
+        )
+        return self.n * per_track
+
+    def snapshot_into(self, buffer, offset=0):
+        """Snapshot into buffer.
+
+        Copies the states, covariances, counters and ids of the live tracks,
+        field after field, into the writable buffer from offset. Streams and
+        slots are not saved. Returns the offset after the last byte written.
+        """
+        views, end = self._snapshot_views(buffer, self.n, offset)
+        for name, view in views:
+            view[...] = self.P if name == "_P" else getattr(self, name)[: self.n]
+        return end
+
+    def restore(self, buffer, n, offset=0):
+        """Replaces the tracks with the n saved in buffer from offset by snapshot_into.
+
+        Returns the offset after the last byte read.
+        """
+        views, end = self._snapshot_views(buffer, n, offset)
+        self._reserve(n)
+        for name, view in views:
+            getattr(self, name)[:n] = view
+        self._steady[:n] = 0
+        self._streams[:n] = 0
+        self._slots[:n] = -1
+        self.n = n
+        return end
+
+
+class TrajectoryStore(object):
+    """Trayectorias de los tracks.
+
+    Keeps the last capacity [x1,y1,x2,y2] boxes of every live track, with
+    their frames, in a ring buffer of one shared (slots, capacity, 4) array,
+    so memory stays flat however long tracks coast. Every track gets a slot
+    when it is opened, boxes are appended for many tracks at once, and the
+    slot is freed again when the track is closed, after exporting its boxes
+    to on_export.
+    """
+
+    def __init__(self, capacity=64, on_export=None, dtype=np.float64, slots=64):
+        """Initialization.
+
+        Params:
+          capacity - boxes kept per track
+          on_export - called as on_export(track_id, frames, boxes) when a track
+            is closed, with the boxes kept, oldest first
+          dtype - floating point type of the boxes
+          slots - number of tracks to preallocate room for
+        """
+        self.capacity = capacity
+        self.on_export = on_export
+        self.boxes = np.zeros((slots, capacity, 4), dtype=dtype)
+        self.frames = np.zeros((slots, capacity), dtype=np.int64)
+        self.length = np.zeros(slots, dtype=np.int64)
+        self.slot_ids = np.full(slots, -1, dtype=np.int64)
+        self.free = list(range(slots - 1, -1, -1))
+        self.track_slots = {}
+
+    def __len__(self):
+        """Number of open tracks."""
+        return len(self.track_slots)
+
+    def __contains__(self, track_id):
+        """True if track_id is open."""
+        return track_id in self.track_slots
+
+    def _grow(self):
+        """Double the number of slots."""
+        slots = len(self.length)
+        self.boxes = np.concatenate((self.boxes, np.zeros_like(self.boxes)))
+        self.frames = np.concatenate((self.frames, np.zeros_like(self.frames)))
+        self.length = np.concatenate((self.length, np.zeros_like(self.length)))
+        self.slot_ids = np.concatenate((self.slot_ids, np.full(slots, -1)))
+        self.free.extend(range(2 * slots - 1, slots - 1, -1))
+
+    def open(self, track_ids):
+        """Opens empty trajectories for track_ids, returns their slots."""
+        slots = np.empty(len(track_ids), dtype=np.int64)
+        for i, track_id in enumerate(track_ids):
+            if not self.free:
+                self._grow()
+            slot = self.free.pop()
+            self.track_slots[int(track_id)] = slot
+            slots[i] = slot
+        self.slot_ids[slots] = track_ids
+        self.length[slots] = 0
+        return slots
+
+    def append(self, slots, frame, bboxes):
+        """Appends the (N, 4) boxes of frame to the trajectories in slots."""
+        pos = self.length[slots] % self.capacity
+        self.boxes[slots, pos] = bboxes
+        self.frames[slots, pos] = frame
+        self.length[slots] += 1
+
+    def _history(self, slot):
+        """Frames and boxes kept in slot, oldest first."""
+        length = self.length[slot]
+        n = min(length, self.capacity)
+        pos = (length - n + np.arange(n)) % self.capacity
+        return self.frames[slot, pos], self.boxes[slot, pos]
+
+    def last(self, track_id, k=None):
+        """Last boxes.
+
+        Returns the frames and (k, 4) boxes of the last k entries (all the
+        kept ones by default) of the trajectory of track_id, oldest first.
+        """
+        frames, boxes = self._history(self.track_slots[track_id])
+        if k is not None:
+            start = max(len(frames) - k, 0)
+            frames, boxes = frames[start:], boxes[start:]
+        return frames, boxes
+
+    def close(self, slots):
+        """Exports and frees the trajectories in slots."""
+        for slot in np.asarray(slots, dtype=np.int64).tolist():
+            track_id = int(self.slot_ids[slot])
+            if self.on_export is not None:
+                self.on_export(track_id, *self._history(slot))
+            del self.track_slots[track_id]
+            self.slot_ids[slot] = -1
+            self.free.append(slot)
+
+    def close_all(self):
+        """Exports and frees every open trajectory, e.g. at the end of a video."""
+        self.close(list(self.track_slots.values()))
+
+
+def associate_detections_to_trackers(
+    detections,
+    trackers,
+    iou_threshold=0.3,
+    gated=False,
+    solver=None,
+    info=None,
+    decompose=False,
+):
     """Associate the detections to the trackers.
 
     Assigns detections to tracked object (both represented as bounding boxes)
+    With decompose=True, problems of at least DECOMPOSE_MIN_SIZE detections
+    and trackers are scored by iou_sparse and, when the one to one shortcut
+    does not apply, split into independent clusters of overlapping boxes by
+    sparse_assignment, without building the dense IOU matrix. The matches
+    are the same with an exact solver, but the unmatched detections come in
+    another order, so Sort numbers the new tracks differently. With
+    gated=True the IOU is only computed for overlapping pairs, see
+    associate_detections_to_trackers_gated. solver names the linear
+    assignment solver, see get_solver. If info is a dict, info["path"] is set
+    to the path taken, one of ASSOCIATION_PATHS.
 
     Returns 3 lists of matches, unmatched_detections and unmatched_trackers
     """
     if len(trackers) == 0 or len(detections) == 0:
+        if info is not None:
+            info["path"] = "empty"
         return (
             np.empty((0, 2), dtype=int),
             np.arange(len(detections)),
             np.empty((0, 5), dtype=int),
         )
+    if gated and iou_threshold > 0:
+        return associate_detections_to_trackers_gated(
+            detections, trackers, iou_threshold, solver, info=info
+        )
 
-    iou_matrix = iou_batch(detections, trackers)
-
-    if min(iou_matrix.shape) > 0:
-        a = (iou_matrix > iou_threshold).astype(np.int32)
+    if (
+        decompose
+        and min(len(detections), len(trackers)) >= DECOMPOSE_MIN_SIZE
+        and iou_threshold > 0
+    ):
+        # the clusters come from the overlapping pairs alone, the dense
+        # matrix is never built
+        rows, cols, ious = iou_sparse(detections, trackers)
+        above = ious > iou_threshold
+        row_hits = np.bincount(rows[above], minlength=len(detections))
+        col_hits = np.bincount(cols[above], minlength=len(trackers))
+        if above.any() and row_hits.max() == 1 and col_hits.max() == 1:
+            path = "one_to_one"
+            matched_indices = np.stack((rows[above], cols[above]), axis=1)
+            matched_ious = ious[above]
+        else:
+            path = "decomposed"
+            matched_indices, matched_ious = sparse_assignment(
+                rows, cols, ious, len(detections), len(trackers), solver=solver
+            )
+    else:
+        iou_matrix = iou_batch(detections, trackers)
+        a = iou_matrix > iou_threshold
         if a.sum(1).max() == 1 and a.sum(0).max() == 1:
+            path = "one_to_one"
             matched_indices = np.stack(np.where(a), axis=1)
         else:
-            matched_indices = linear_assignment(-iou_matrix)
+            path = "solver"
+            matched_indices = linear_assignment(-iou_matrix, solver).reshape(-1, 2)
+        matched_ious = iou_matrix[matched_indices[:, 0], matched_indices[:, 1]]
+    if info is not None:
+        info["path"] = path
+
+    unmatched_detections = np.flatnonzero(
+        ~np.isin(np.arange(len(detections)), matched_indices[:, 0])
+    )
+    unmatched_trackers = np.flatnonzero(
+        ~np.isin(np.arange(len(trackers)), matched_indices[:, 1])
+    )
+
+    # filter out matched with low IOU
+    low = matched_ious < iou_threshold
+    matches = matched_indices[~low]
+    unmatched_detections = np.concatenate(
+        (unmatched_detections, matched_indices[low, 0])
+    )
+    unmatched_trackers = np.concatenate((unmatched_trackers, matched_indices[low, 1]))
+
+    return matches, unmatched_detections, unmatched_trackers
+
+
+def associate_detections_to_trackers_gated(
+    detections,
+    trackers,
+    iou_threshold=0.3,
+    solver=None,
+    det_groups=None,
+    trk_groups=None,
+    info=None,
+):
+    """Associate the detections to the trackers through a spatial gate.
+
+    Same matches as associate_detections_to_trackers, but only the pairs of
+    overlapping boxes found by iou_sparse are scored, so memory and time grow
+    with the number of overlaps instead of detections x trackers. The
+    unmatched detections and trackers are returned in ascending order, while
+    the dense solver path lists first those it left out and then those it
+    paired below the threshold, so with the same matches Sort numbers the new
+    tracks in another order.
+    Requires iou_threshold > 0, as zero IOU pairs are never considered.
+    det_groups and trk_groups optionally split the boxes into independent
+    problems, each with its own entry of an iou_threshold array, that are
+    associated exactly as if they were solved one after another. If info is
+    a dict, info["path"] is set to "gated_one_to_one" when every group took
+    the one to one shortcut and to "gated_solver" otherwise.
+
+    Returns 3 lists of matches, unmatched_detections and unmatched_trackers
+    """
+    num_dets, num_trks = len(detections), len(trackers)
+    rows, cols, ious = iou_sparse(detections, trackers, det_groups, trk_groups)
+    if det_groups is None:
+        det_groups = np.zeros(num_dets, dtype=int)
+    det_groups = np.asarray(det_groups, dtype=int)
+    num_groups = det_groups.max() + 1 if num_dets > 0 else 0
+    threshold = np.asarray(iou_threshold, dtype=float)
+    if threshold.ndim > 0:
+        threshold = threshold[det_groups]
     else:
-        matched_indices = np.empty(shape=(0, 2))
+        threshold = np.full(num_dets, threshold)
 
-    unmatched_detections = []
-    for d, det in enumerate(detections):
-        if d not in matched_indices[:, 0]:
-            unmatched_detections.append(d)
-    unmatched_trackers = []
-    for t, trk in enumerate(trackers):
-        if t not in matched_indices[:, 1]:
-            unmatched_trackers.append(t)
+    # one to one shortcut, taken by the groups where no box has two
+    # candidates above the threshold
+    above = ious > threshold[rows]
+    clash = (np.bincount(rows[above], minlength=num_dets)[rows] > 1) | (
+        np.bincount(cols[above], minlength=num_trks)[cols] > 1
+    )
+    group = det_groups[rows]
+    shortcut = np.bincount(group[above], minlength=num_groups) > 0
+    shortcut[group[above & clash]] = False
+    shortcut = shortcut[group]
+    matched = np.flatnonzero(above & shortcut)
+    matched_indices = np.stack((rows[matched], cols[matched]), axis=1)
+    matched_ious = ious[matched]
+    if not shortcut.all():
+        solve = ~shortcut
+        pairs, pair_ious = sparse_assignment(
+            rows[solve], cols[solve], ious[solve], num_dets, num_trks, solver
+        )
+        matched_indices = np.concatenate((matched_indices, pairs))
+        matched_ious = np.concatenate((matched_ious, pair_ious))
+    if info is not None:
+        info["path"] = "gated_one_to_one" if shortcut.all() else "gated_solver"
 
     # filter out matched with low IOU
-    matches = []
-    for m in matched_indices:
-        if iou_matrix[m[0], m[1]] < iou_threshold:
-            unmatched_detections.append(m[0])
-            unmatched_trackers.append(m[1])
-        else:
-            matches.append(m.reshape(1, 2))
-    if len(matches) == 0:
-        matches = np.empty((0, 2), dtype=int)
-    else:
-        matches = np.concatenate(matches, axis=0)
+    matches = matched_indices[matched_ious >= threshold[matched_indices[:, 0]]]
+
+    unmatched_detections = np.setdiff1d(np.arange(num_dets), matches[:, 0])
+    unmatched_trackers = np.setdiff1d(np.arange(num_trks), matches[:, 1])
+    return matches, unmatched_detections, unmatched_trackers
 
-    return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+
+class SortStats(object):
+    """Rolling statistics of Sort.update.
+
+    Keeps the wall time of every stage of the last window frames (predict,
+    associate, update, birth and output, which also removes the dead tracks),
+    the number of tracks and detections and the association path taken, see
+    ASSOCIATION_PATHS. callback, if given, is called after every frame with
+    the dict of that frame.
+    """
+
+    STAGES = ("predict", "associate", "update", "birth", "output")
+
+    def __init__(self, window=1000, callback=None):
+        """Initialization.
+
+        Params:
+          window - number of frames kept
+          callback - called as callback(frame_stats) after every frame
+        """
+        self.window = window
+        self.callback = callback
+        self.times = np.zeros((window, len(self.STAGES)))
+        self.tracks = np.zeros(window, dtype=np.int64)
+        self.detections = np.zeros(window, dtype=np.int64)
+        self.paths = np.zeros(window, dtype=np.int64)
+        self.frames = 0
+
+    def record(self, clock, num_tracks, num_dets, path):
+        """Record a frame.
+
+        Params:
+          clock - perf_counter before the first stage and after every stage
+          num_tracks - predicted tracks associated to the detections
+          num_dets - detections of the frame
+          path - association path, one of ASSOCIATION_PATHS
+        """
+        i = self.frames % self.window
+        self.times[i] = np.diff(clock)
+        self.tracks[i] = num_tracks
+        self.detections[i] = num_dets
+        self.paths[i] = ASSOCIATION_PATHS.index(path)
+        self.frames += 1
+        if self.callback is not None:
+            frame_stats = dict(zip(self.STAGES, self.times[i].tolist()))
+            frame_stats.update(tracks=num_tracks, detections=num_dets, path=path)
+            self.callback(frame_stats)
+
+    def reset(self):
+        """Forget the recorded frames."""
+        self.frames = 0
+
+    def summary(self):
+        """Summary of the recorded frames.
+
+        Returns a dict with the mean, 95th percentile and maximum time in ms
+        of every stage and of the whole update, the mean number of tracks and
+        detections and how many frames took every association path.
+        """
+        n = min(self.frames, self.window)
+        times = self.times[:n] * 1e3
+        times = np.hstack((times, times.sum(axis=1, keepdims=True)))
+        summary = {"frames": n}
+        for stage, t in zip(self.STAGES + ("total",), times.T):
+            summary[stage] = {
+                "mean_ms": float(t.mean()) if n else 0.0,
+                "p95_ms": float(np.percentile(t, 95)) if n else 0.0,
+                "max_ms": float(t.max()) if n else 0.0,
+            }
+        summary["tracks"] = float(self.tracks[:n].mean()) if n else 0.0
+        summary["detections"] = float(self.detections[:n].mean()) if n else 0.0
+        counts = np.bincount(self.paths[:n], minlength=len(ASSOCIATION_PATHS))
+        summary["paths"] = dict(zip(ASSOCIATION_PATHS, counts.tolist()))
+        return summary
+
+    def __str__(self):
+        """Table of the summary."""
+        summary = self.summary()
+        lines = ["%-10s %9s %9s %9s" % ("stage", "mean [ms]", "p95 [ms]", "max [ms]")]
+        for stage in self.STAGES + ("total",):
+            s = summary[stage]
+            lines.append(
+                "%-10s %9.3f %9.3f %9.3f"
+                % (stage, s["mean_ms"], s["p95_ms"], s["max_ms"])
+            )
+        lines.append(
+            "%d frames, %.1f tracks and %.1f detections per frame"
+            % (summary["frames"], summary["tracks"], summary["detections"])
+        )
+        lines.append(
+            "paths: "
+            + ", ".join("%s %d" % (p, c) for p, c in summary["paths"].items() if c)
+        )
+        return "\n".join(lines)
+
+
+def read_snapshot_header(buffer):
+    """Dtype, number of tracks, frame_count and next_id of a Sort snapshot."""
+    magic, version, dtype, n, frame_count, next_id = SNAPSHOT_HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Not a Sort snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(
+            "Unknown snapshot version %d, expected %d" % (version, SNAPSHOT_VERSION)
+        )
+    return np.dtype(dtype.rstrip(b"\0").decode()), n, frame_count, next_id
 
 
 class Sort(object):
     """Clase Sort."""
 
-    def __init__(self, max_age=30, min_hits=3, iou_threshold=0.3):
+    def __init__(
+        self,
+        max_age=30,
+        min_hits=3,
+        iou_threshold=0.3,
+        dtype=np.float64,
+        gated=False,
+        solver=None,
+        stats=None,
+        trajectories=None,
+        gain_cache=None,
+        decompose=False,
+    ):
         """Initialize Sort.
 
-        Sets key parameters for SORT
+        Sets key parameters for SORT. dtype selects the floating point type of
+        the Kalman states (np.float32 halves the memory traffic of the bank).
+        gated=True only scores overlapping detection/tracker pairs, which pays
+        off in crowded scenes with hundreds of boxes or more; the tracks are
+        the same, but new ones may be numbered in another order, see
+        associate_detections_to_trackers_gated. solver names the
+        linear assignment solver, see get_solver. Track ids are numbered per
+        instance, so independent trackers give the same ids in any process.
+        stats, a SortStats, records the timings of every update; without it
+        update is not instrumented. trajectories, a TrajectoryStore, records
+        the box of every live track in every frame under its output id and
+        exports it when the track dies. gain_cache, a GainCache of the same
+        dtype, skips the covariance algebra of the tracks matched frame after
+        frame, at the steady state of the filter within its tolerance.
+        decompose=True splits large dense association problems into clusters
+        of overlapping boxes, see associate_detections_to_trackers; the tracks
+        are the same but new ones may be numbered in another order.
         """
         self.max_age = max_age
         self.min_hits = min_hits
         self.iou_threshold = iou_threshold
-        self.trackers = []
+        self.gated = gated
+        self.decompose = decompose
+        self.solver = solver
+        self.stats = stats
+        self.trajectories = trajectories
+        get_solver(solver)
+        self.trackers = KalmanBoxTrackerBank(dtype=dtype, gain_cache=gain_cache)
         self.frame_count = 0
+        self.next_id = 0
 
     def update(self, dets=np.empty((0, 5))):
         """Update Sort.
@@ -260,165 +1214,412 @@ class Sort(object):
 
         NOTE: The number of objects returned may differ from the number of detections provided.
         """
+        # only tracks matched or born in this frame are reported
+        ret = np.empty((len(dets), 5))
+        n = self._update(dets, ret[:, :4], ret[:, 4])
+        return ret[:n]
+
+    def _update(self, dets, out_boxes, out_ids):
+        """Update into out_boxes and out_ids.
+
+        Runs update for dets and writes the [x1,y1,x2,y2] boxes and the ids of
+        the tracks it reports into the first rows of out_boxes and out_ids,
+        which need room for len(dets) rows. Returns the number of tracks written.
+        """
+        stats = self.stats
+        if stats is not None:
+            clock = [time.perf_counter()]
+            info = {}
+        else:
+            info = None
         self.frame_count += 1
+        trackers = self.trackers
         # get predicted locations from existing trackers.
-        trks = np.zeros((len(self.trackers), 5))
-        to_del = []
-        ret = []
-        for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
-            trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
-            if np.any(np.isnan(pos)):
-                to_del.append(t)
-        trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
-        for t in reversed(to_del):
-            self.trackers.pop(t)
+        trks = trackers.predict()
+        invalid = np.isnan(trks).any(axis=1)
+        if invalid.any():
+            if self.trajectories is not None:
+                self.trajectories.close(trackers.slots[invalid])
+            trackers.remove(invalid)
+            trks = trks[~invalid]
+        if stats is not None:
+            clock.append(time.perf_counter())
         matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(
-            dets, trks, self.iou_threshold
+            dets,
+            trks,
+            self.iou_threshold,
+            gated=self.gated,
+            solver=self.solver,
+            info=info,
+            decompose=self.decompose,
         )
+        if stats is not None:
+            clock.append(time.perf_counter())
 
         # update matched trackers with assigned detections
-        for m in matched:
-            self.trackers[m[1]].update(dets[m[0], :])
+        if len(matched) > 0:
+            trackers.update(matched[:, 1], dets[matched[:, 0], :4])
+        if stats is not None:
+            clock.append(time.perf_counter())
 
         # create and initialise new trackers for unmatched detections
-        for i in unmatched_dets:
-            trk = KalmanBoxTracker(dets[i, :])
-            self.trackers.append(trk)
-        i = len(self.trackers)
-        for trk in reversed(self.trackers):
-            d = trk.get_state()[0]
-            if (trk.time_since_update < 1) and (
-                trk.hit_streak >= self.min_hits or self.frame_count <= self.min_hits
-            ):
-                ret.append(
-                    np.concatenate((d, [trk.id + 1])).reshape(1, -1)
-                )  # +1 as MOT benchmark requires positive
-            i -= 1
-            # remove dead tracklet
-            if trk.time_since_update > self.max_age:
-                self.trackers.pop(i)
-        if len(ret) > 0:
-            return np.concatenate(ret)
-        return np.empty((0, 5))
-
-
-def parse_args():
-    """Parse input arguments."""
-    parser = argparse.ArgumentParser(description="SORT demo")
-    parser.add_argument(
-        "--display",
-        dest="display",
-        help="Display online tracker output (slow) [False]",
-        action="store_true",
-    )
-    parser.add_argument(
-        "--seq_path", help="Path to detections.", type=str, default="data"
-    )
-    parser.add_argument(
-        "--phase", help="Subdirectory in seq_path.", type=str, default="train"
-    )
-    parser.add_argument(
-        "--max_age",
-        help="Maximum number of frames to keep alive a track without associated detections.",
-        type=int,
-        default=1,
-    )
-    parser.add_argument(
-        "--min_hits",
-        help="Minimum number of associated detections before track is initialised.",
-        type=int,
-        default=3,
-    )
-    parser.add_argument(
-        "--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3
-    )
-    args = parser.parse_args()
-    return args
+        if len(unmatched_dets) > 0:
+            unmatched_dets = np.asarray(unmatched_dets, dtype=int)
+            ids = self.next_id + np.arange(len(unmatched_dets))
+            self.next_id += len(unmatched_dets)
+            slots = -1
+            if self.trajectories is not None:
+                slots = self.trajectories.open(ids + 1)
+            trackers.birth(dets[unmatched_dets, :4], ids, slots=slots)
+        if stats is not None:
+            clock.append(time.perf_counter())
+
+        tsu = trackers.time_since_update
+        alive = (tsu < 1) & (
+            (trackers.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits)
+        )
+        # reversed order, as the per-tracker loop used to report them
+        alive = np.flatnonzero(alive)[::-1]
+        n = len(alive)
+        convert_x_to_bboxes(trackers.x[alive], out=out_boxes[:n])
+        out_ids[:n] = trackers.ids[alive] + 1  # +1 as MOT benchmark requires positive
+        if self.trajectories is not None:
+            self.trajectories.append(
+                trackers.slots, self.frame_count, trackers.get_state()
+            )
 
+        # remove dead tracklet
+        dead = tsu > self.max_age
+        if dead.any():
+            if self.trajectories is not None:
+                self.trajectories.close(trackers.slots[dead])
+            trackers.remove(dead)
+        if stats is not None:
+            clock.append(time.perf_counter())
+            stats.record(clock, len(trks), len(dets), info["path"])
+        return n
+
+    def run_sequence(self, seq_dets, out=None):
+        """Run a sequence.
+
+        Tracks a whole sequence in one call, for offline jobs. seq_dets is a
+        mot_io.MOTDetections or a MOT detection array of
+        [frame, id, x, y, w, h, score, ...] rows with frames numbered from 1,
+        frames without detections are tracked as empty frames. Every frame
+        runs update on a slice of the detections grouped by frame, writing its
+        tracks straight into out, an (M, 6) array of
+        [frame, id, x1, y1, x2, y2] rows. A track is only reported in frames
+        where it got a detection, so M = number of detections always fits, and
+        out is allocated with that size when not given.
+        Returns the view of out holding the tracks, in frame order.
+        """
+        if not hasattr(seq_dets, "offsets"):
+            from mot_io import MOTDetections
+
+            seq_dets = MOTDetections.from_array(seq_dets)
+        dets, offsets = seq_dets.dets, seq_dets.offsets
+        if out is None:
+            out = np.empty((len(dets), 6))
+        elif len(out) < len(dets):
+            raise ValueError(
+                "Output of %d rows too small for %d detections" % (len(out), len(dets))
+            )
+        n = 0
+        for frame in range(1, len(offsets)):
+            count = self._update(
+                dets[offsets[frame - 1] : offsets[frame]], out[n:, 2:6], out[n:, 1]
+            )
+            out[n : n + count, 0] = frame
+            n += count
+        return out[:n]
 
-if __name__ == "__main__":
-    # all train
-    args = parse_args()
-    display = args.display
-    phase = args.phase
-    total_time = 0.0
-    total_frames = 0
-    colours = np.random.rand(32, 3)  # used only for display
-    if display:
-        if not os.path.exists("mot_benchmark"):
-            print(
-                """\n\tERROR: mot_benchmark link not found!\n\n
-                Create a symbolic link to the MOT benchmark\n
-                (https://motchallenge.net/data/2D_MOT_2015/#download). E.g.:\n\n
-                  $ ln -s /path/to/MOT2015_challenge/2DMOT2015 mot_benchmark\n\n"""
+    def predict(self):
+        """Predict only.
+
+        Advances the tracks one frame without running the association, for
+        frames where the detector is skipped. Unlike update with no detections
+        the tracks keep their hit streak and do not age towards max_age, so
+        the same tracks as in the last update are reported. Only update counts
+        frames and records stats and trajectories.
+        Returns the predicted boxes of those tracks in the format of update.
+        """
+        trackers = self.trackers
+        trks = trackers.predict(detected=False)
+        alive = (
+            (trackers.time_since_update < 1)
+            & (
+                (trackers.hit_streak >= self.min_hits)
+                | (self.frame_count <= self.min_hits)
             )
-            exit()
-        plt.ion()
-        fig = plt.figure()
-        ax1 = fig.add_subplot(111, aspect="equal")
-
-    if not os.path.exists("output"):
-        os.makedirs("output")
-    pattern = os.path.join(args.seq_path, phase, "*", "det", "det.txt")
-    for seq_dets_fn in glob.glob(pattern):
-        mot_tracker = Sort(
-            max_age=args.max_age,
-            min_hits=args.min_hits,
-            iou_threshold=args.iou_threshold,
-        )  # create instance of the SORT tracker
-        seq_dets = np.loadtxt(seq_dets_fn, delimiter=",")
-        seq = seq_dets_fn[pattern.find("*") :].split(os.path.sep)[0]
-
-        with open(os.path.join("output", "%s.txt" % (seq)), "w") as out_file:
-            print("Processing %s." % (seq))
-            for frame in range(int(seq_dets[:, 0].max())):
-                frame += 1  # detection and frame numbers begin at 1
-                dets = seq_dets[seq_dets[:, 0] == frame, 2:7]
-                dets[:, 2:4] += dets[:, 0:2]  # convert to [x1,y1,w,h] to [x1,y1,x2,y2]
-                total_frames += 1
-
-                if display:
-                    fn = os.path.join(
-                        "mot_benchmark", phase, seq, "img1", "%06d.jpg" % (frame)
-                    )
-                    im = io.imread(fn)
-                    ax1.imshow(im)
-                    plt.title(seq + " Tracked Targets")
-
-                start_time = time.time()
-                trackers = mot_tracker.update(dets)
-                cycle_time = time.time() - start_time
-                total_time += cycle_time
-
-                for d in trackers:
-                    print(
-                        "%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1"
-                        % (frame, d[4], d[0], d[1], d[2] - d[0], d[3] - d[1]),
-                        file=out_file,
-                    )
-                    if display:
-                        d = d.astype(np.int32)
-                        ax1.add_patch(
-                            patches.Rectangle(
-                                (d[0], d[1]),
-                                d[2] - d[0],
-                                d[3] - d[1],
-                                fill=False,
-                                lw=3,
-                                ec=colours[d[4] % 32, :],
-                            )
-                        )
-
-                if display:
-                    fig.canvas.flush_events()
-                    plt.draw()
-                    ax1.cla()
-
-    print(
-        "Total Tracking took: %.3f seconds for %d frames or %.1f FPS"
-        % (total_time, total_frames, total_frames / total_time)
-    )
+            & ~np.isnan(trks).any(axis=1)
+        )
+        alive = np.flatnonzero(alive)[::-1]
+        ret = np.empty((len(alive), 5))
+        ret[:, :4] = trks[alive]
+        ret[:, 4] = trackers.ids[alive] + 1
+        return ret
+
+    def snapshot_size(self):
+        """Bytes of a snapshot of the current state."""
+        return SNAPSHOT_HEADER.size + self.trackers.snapshot_size()
+
+    def snapshot_into(self, buffer):
+        """Snapshot into buffer.
+
+        Writes the state of the tracker (frame_count, next_id and the states,
+        covariances, counters and ids of its tracks) into the writable buffer,
+        e.g. a bytearray or the buf of a multiprocessing SharedMemory, as one
+        contiguous block of snapshot_size() bytes. The parameters, stats and
+        trajectories are not part of the state. Returns the bytes written.
+        """
+        size = self.snapshot_size()
+        if memoryview(buffer).nbytes < size:
+            raise ValueError(
+                "Snapshot needs %d bytes, the buffer has %d"
+                % (size, memoryview(buffer).nbytes)
+            )
+        SNAPSHOT_HEADER.pack_into(
+            buffer,
+            0,
+            SNAPSHOT_MAGIC,
+            SNAPSHOT_VERSION,
+            self.trackers.dtype.str.encode(),
+            len(self.trackers),
+            self.frame_count,
+            self.next_id,
+        )
+        self.trackers.snapshot_into(buffer, SNAPSHOT_HEADER.size)
+        return size
+
+    def snapshot(self):
+        """Snapshot of the current state as a bytearray, see snapshot_into."""
+        buffer = bytearray(self.snapshot_size())
+        self.snapshot_into(buffer)
+        return buffer
+
+    def restore(self, buffer):
+        """Restore.
+
+        Replaces the state of the tracker with a snapshot, after which it
+        continues exactly as the tracker the snapshot was taken from, given the
+        same parameters. The tracks are copied, so buffer can be released
+        afterwards. With trajectories, the open ones are closed and the
+        restored tracks start empty ones.
+        """
+        dtype, n, frame_count, next_id = read_snapshot_header(buffer)
+        if dtype != self.trackers.dtype:
+            raise ValueError(
+                "Snapshot of %s states, the tracker uses %s"
+                % (dtype, self.trackers.dtype)
+            )
+        if self.trajectories is not None:
+            self.trajectories.close_all()
+        self.trackers.restore(buffer, n, SNAPSHOT_HEADER.size)
+        if self.trajectories is not None:
+            self.trackers.slots[:] = self.trajectories.open(self.trackers.ids + 1)
+        self.frame_count = frame_count
+        self.next_id = next_id
+
+    @classmethod
+    def from_snapshot(cls, buffer, **kwargs):
+        """New Sort with the state of a snapshot and the parameters in kwargs."""
+        tracker = cls(dtype=read_snapshot_header(buffer)[0], **kwargs)
+        tracker.restore(buffer)
+        return tracker
+
+    def uncertainty(self):
+        """Incertidumbre de los tracks.
+
+        Returns an (N, 2) array with the [id, std] of every live track, where
+        std is the standard deviation of the predicted centre relative to the
+        size of the box. It grows with every frame predicted without a
+        detection, which makes it a cue to run the detector again.
+        """
+        P, x = self.trackers.P, self.trackers.x
+        ret = np.empty((len(x), 2))
+        ret[:, 0] = self.trackers.ids + 1
+        ret[:, 1] = np.sqrt(
+            (P[:, 0, 0] + P[:, 1, 1]) / np.maximum(np.abs(x[:, 2]), 1.0)
+        )
+        return ret
+
+
+class MultiSort(object):
+    """Several independent SORT trackers advanced in one batched step.
+
+    Every stream (e.g. a camera) has its own parameters, frame count and ids,
+    but the tracks of all the streams live in one KalmanBoxTrackerBank, so a
+    tick predicts, associates and updates all of them with single vectorized
+    calls. Association never pairs boxes of different streams: the tracks of
+    a stream are those of a Sort(gated=True) fed with the same detections.
+    """
+
+    def __init__(
+        self,
+        num_streams=0,
+        max_age=30,
+        min_hits=3,
+        iou_threshold=0.3,
+        dtype=np.float64,
+        solver=None,
+        gain_cache=None,
+    ):
+        """Initialize MultiSort.
+
+        Creates num_streams streams with the given parameters, which are also
+        the defaults of add_stream. iou_threshold must be positive. gain_cache
+        is a GainCache shared by the tracks of all the streams, see Sort.
+        """
+        self.defaults = (max_age, min_hits, iou_threshold)
+        self.max_age = np.empty(0, dtype=np.int64)
+        self.min_hits = np.empty(0, dtype=np.int64)
+        self.iou_threshold = np.empty(0)
+        self.frame_count = np.empty(0, dtype=np.int64)
+        self.next_id = np.empty(0, dtype=np.int64)
+        self.trackers = KalmanBoxTrackerBank(dtype=dtype, gain_cache=gain_cache)
+        self.solver = solver
+        get_solver(solver)
+        for _ in range(num_streams):
+            self.add_stream()
+
+    @property
+    def num_streams(self):
+        """Number of streams."""
+        return len(self.frame_count)
+
+    def add_stream(self, max_age=None, min_hits=None, iou_threshold=None):
+        """Add a stream.
+
+        Parameters left to None take the defaults given to the constructor.
+        Returns the index of the new stream.
+        """
+        params = [
+            default if value is None else value
+            for value, default in zip((max_age, min_hits, iou_threshold), self.defaults)
+        ]
+        self.max_age = np.append(self.max_age, params[0])
+        self.min_hits = np.append(self.min_hits, params[1])
+        self.iou_threshold = np.append(self.iou_threshold, params[2])
+        self.frame_count = np.append(self.frame_count, 0)
+        self.next_id = np.append(self.next_id, 0)
+        return self.num_streams - 1
+
+    def reset_stream(self, stream):
+        """Reset a stream.
+
+        Drops the tracks of stream and restarts its frame count and ids, as a
+        new stream with the same parameters, so that the index of a stream
+        that ended can be reused instead of adding a stream.
+        """
+        dead = self.trackers.streams == stream
+        if dead.any():
+            self.trackers.remove(dead)
+        self.frame_count[stream] = 0
+        self.next_id[stream] = 0
+
+    def update(self, dets):
+        """Update MultiSort.
+
+        Params:
+          dets - a list with the detections of every stream, or a dict
+          {stream: detections} with only the streams that have a new frame,
+          each in the format of Sort.update. Streams missing from the dict
+          are not advanced.
+        Returns the tracks of the given streams in the format of Sort.update,
+        as a list or a dict like dets.
+        """
+        if isinstance(dets, dict):
+            streams = np.fromiter(dets.keys(), dtype=np.int64, count=len(dets))
+            dets_list = list(dets.values())
+        else:
+            if len(dets) != self.num_streams:
+                raise ValueError(
+                    "expected detections for %d streams, got %d"
+                    % (self.num_streams, len(dets))
+                )
+            streams = np.arange(self.num_streams)
+            dets_list = dets
+        # frames without detections may come as np.empty((0, 5)) or np.array([])
+        boxes = [
+            (
+                np.asarray(d, dtype=float).reshape(len(d), -1)[:, :4]
+                if len(d) > 0
+                else np.empty((0, 4))
+            )
+            for d in dets_list
+        ]
+        counts = np.array([len(d) for d in boxes], dtype=np.int64)
+        boxes = np.concatenate(boxes) if len(boxes) > 0 else np.empty((0, 4))
+        det_streams = np.repeat(streams, counts)
+
+        trackers = self.trackers
+        active = np.zeros(self.num_streams, dtype=bool)
+        active[streams] = True
+        self.frame_count[streams] += 1
+        # get predicted locations from the trackers of the given streams.
+        rows = np.flatnonzero(active[trackers.streams])
+        trks = trackers.predict(rows if len(rows) < len(trackers) else None)
+        invalid = np.isnan(trks).any(axis=1)
+        if invalid.any():
+            dead = np.zeros(len(trackers), dtype=bool)
+            dead[rows[invalid]] = True
+            trackers.remove(dead)
+            rows = np.flatnonzero(active[trackers.streams])
+            trks = trks[~invalid]
+        matched, unmatched_dets, _ = associate_detections_to_trackers_gated(
+            boxes,
+            trks,
+            self.iou_threshold,
+            self.solver,
+            det_streams,
+            trackers.streams[rows],
+        )
+
+        # update matched trackers with assigned detections
+        if len(matched) > 0:
+            trackers.update(rows[matched[:, 1]], boxes[matched[:, 0]])
+
+        # create and initialise new trackers for unmatched detections, the
+        # unmatched detections of a stream come in one ascending run
+        if len(unmatched_dets) > 0:
+            born_streams = det_streams[unmatched_dets]
+            run = np.flatnonzero(np.r_[True, born_streams[1:] != born_streams[:-1]])
+            rank = np.arange(len(unmatched_dets)) - np.repeat(
+                run, np.diff(np.r_[run, len(unmatched_dets)])
+            )
+            ids = self.next_id[born_streams] + rank
+            self.next_id += np.bincount(born_streams, minlength=self.num_streams)
+            trackers.birth(boxes[unmatched_dets], ids, born_streams)
+
+        rows = np.flatnonzero(active[trackers.streams])
+        row_streams = trackers.streams[rows]
+        tsu = trackers.time_since_update[rows]
+        alive = (tsu < 1) & (
+            (trackers.hit_streak[rows] >= self.min_hits[row_streams])
+            | (self.frame_count[row_streams] <= self.min_hits[row_streams])
+        )
+        # per stream, in the reversed order of Sort.update
+        alive = rows[alive][::-1]
+        alive = alive[np.argsort(trackers.streams[alive], kind="stable")]
+        ret = np.empty((len(alive), 5))
+        ret[:, :4] = convert_x_to_bboxes(trackers.x[alive])
+        ret[:, 4] = trackers.ids[alive] + 1  # +1 as MOT benchmark requires positive
+        per_stream = np.bincount(trackers.streams[alive], minlength=self.num_streams)
+        ret = np.split(ret, np.cumsum(per_stream)[:-1])
+
+        # remove dead tracklet
+        dead = tsu > self.max_age[row_streams]
+        if dead.any():
+            mask = np.zeros(len(trackers), dtype=bool)
+            mask[rows[dead]] = True
+            trackers.remove(mask)
+        if isinstance(dets, dict):
+            return {stream: ret[stream] for stream in dets}
+        return ret
+
+
+if __name__ == "__main__":
+    # the MOT driver moved to main_sort.py, python sort.py still runs it
+    from main_sort import main
 
-    if display:
-        print("Note: to get real runtime results run without the option: --display")
+    main()
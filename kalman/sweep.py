@@ -0,0 +1,386 @@
+"""Barrido de parametros de Sort.
+
+Tracks the MOT sequences of the main_sort.py driver with every combination
+of max_age, min_hits and iou_threshold in a process pool, and reports for every
+configuration the time spent in Sort.update together with its MOTA and IDF1
+against the gt/gt.txt file of every sequence, so that the cheapest
+configuration meeting an accuracy target can be chosen:
+
+  $ python sweep.py --max_age 1 3 5 --min_hits 1 3 --workers 8 --target_mota 0.3
+
+The detections are parsed and grouped by frame once, into the memory-mapped
+cache of mot_io, which every worker maps instead of parsing det.txt again.
+The metrics are accumulated frame by frame while tracking, so no track file
+is written. --check only runs MOTMetrics on small hand made sequences with
+known counts.
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from mot_io import MOTDetections, MOTGroundTruth
+from sort import Sort, iou_batch, linear_assignment, sparse_assignment
+
+# sequences of the worker, set by load_sequences
+_sequences = None
+
+
+class MOTMetrics(object):
+    """Metricas MOT.
+
+    Accumulates frame by frame the CLEAR MOT counts (misses, false positives
+    and id switches) and the identity matches of IDF1 of a sequence. A track
+    matches a ground truth box with IOU >= iou_threshold. As in CLEAR MOT,
+    the match of an object in the previous frame is kept while still valid and
+    the other objects are matched by linear assignment of the IOU; an id
+    switch is an object matched to a track other than its last one. IDF1 pairs
+    objects and tracks once for the whole sequence, maximising the frames
+    where they match. Distractors and crowd regions are not handled.
+    """
+
+    def __init__(self, iou_threshold=0.5):
+        """Initialization.
+
+        Params:
+          iou_threshold - minimum IOU of a track and an object to match
+        """
+        self.iou_threshold = iou_threshold
+        self.num_gt = 0
+        self.num_hyp = 0
+        self.matches = 0
+        self.misses = 0
+        self.false_positives = 0
+        self.id_switches = 0
+        self.last_match = {}  # object id -> id of its last matched track
+        self.id_frames = {}  # (object id, track id) -> frames matched
+
+    def update(self, gt_ids, gt_boxes, hyp_ids, hyp_boxes):
+        """Add a frame of (N,) object ids, (N, 4) boxes and their tracks."""
+        gt_ids = np.asarray(gt_ids, dtype=np.int64)
+        hyp_ids = np.asarray(hyp_ids, dtype=np.int64)
+        self.num_gt += len(gt_ids)
+        self.num_hyp += len(hyp_ids)
+        if len(gt_ids) == 0 or len(hyp_ids) == 0:
+            self.misses += len(gt_ids)
+            self.false_positives += len(hyp_ids)
+            return
+        iou = iou_batch(gt_boxes, hyp_boxes)
+        valid = iou >= self.iou_threshold
+        rows, cols = np.nonzero(valid)
+        for key in zip(gt_ids[rows].tolist(), hyp_ids[cols].tolist()):
+            self.id_frames[key] = self.id_frames.get(key, 0) + 1
+
+        # keep the matches of the previous frame that are still valid
+        hyp_index = {h: j for j, h in enumerate(hyp_ids.tolist())}
+        free_gt = np.ones(len(gt_ids), dtype=bool)
+        free_hyp = np.ones(len(hyp_ids), dtype=bool)
+        for i, g in enumerate(gt_ids.tolist()):
+            j = hyp_index.get(self.last_match.get(g))
+            # two objects may have last matched the same track, one keeps it
+            if j is not None and free_hyp[j] and valid[i, j]:
+                free_gt[i] = free_hyp[j] = False
+        matched = len(gt_ids) - int(np.count_nonzero(free_gt))
+
+        rows, cols = np.flatnonzero(free_gt), np.flatnonzero(free_hyp)
+        if len(rows) > 0 and len(cols) > 0:
+            block = np.where(valid[np.ix_(rows, cols)], iou[np.ix_(rows, cols)], 0.0)
+            for r, c in linear_assignment(-block):
+                if block[r, c] < self.iou_threshold:
+                    continue
+                g, h = int(gt_ids[rows[r]]), int(hyp_ids[cols[c]])
+                if self.last_match.get(g, h) != h:
+                    self.id_switches += 1
+                self.last_match[g] = h
+                matched += 1
+        self.matches += matched
+        self.misses += len(gt_ids) - matched
+        self.false_positives += len(hyp_ids) - matched
+
+    def counts(self):
+        """Counts of the frames so far, with the true positive ids of IDF1."""
+        idtp = 0
+        if self.id_frames:
+            pairs = np.array(list(self.id_frames), dtype=np.int64)
+            frames = np.array(list(self.id_frames.values()), dtype=float)
+            gt, rows = np.unique(pairs[:, 0], return_inverse=True)
+            hyp, cols = np.unique(pairs[:, 1], return_inverse=True)
+            _, weights = sparse_assignment(rows, cols, frames, len(gt), len(hyp))
+            idtp = int(weights.sum())
+        return {
+            "num_gt": self.num_gt,
+            "num_hyp": self.num_hyp,
+            "matches": self.matches,
+            "misses": self.misses,
+            "false_positives": self.false_positives,
+            "id_switches": self.id_switches,
+            "idtp": idtp,
+        }
+
+
+def check_metrics():
+    """Check metrics.
+
+    Runs MOTMetrics on small hand made sequences with known counts. Returns
+    the list of the failed checks, empty when all pass.
+    """
+    box = np.array([[0.0, 0.0, 10.0, 10.0]])
+    boxes = np.vstack((box, box))
+    cases = [
+        # objects 1 and 2 last matched track 7, only one of them keeps it
+        (
+            "shared last match",
+            [([1], box, [7], box), ([2], box, [7], box), ([1, 2], boxes, [7], box)],
+            dict(matches=3, misses=1, false_positives=0, id_switches=0),
+        ),
+        # object 1 moves from track 7 to track 8
+        (
+            "id switch",
+            [([1], box, [7], box), ([1], box, [8], box)],
+            dict(matches=2, misses=0, false_positives=0, id_switches=1),
+        ),
+        # a track far from the object is a miss and a false positive
+        (
+            "no overlap",
+            [([1], box, [7], box + 20.0)],
+            dict(matches=0, misses=1, false_positives=1, id_switches=0),
+        ),
+    ]
+    failed = []
+    for name, frames, expected in cases:
+        metrics = MOTMetrics()
+        for frame in frames:
+            metrics.update(*frame)
+        counts = metrics.counts()
+        if counts["matches"] > min(counts["num_gt"], counts["num_hyp"]):
+            failed.append("%s: more matches than boxes %r" % (name, counts))
+        elif any(counts[key] != value for key, value in expected.items()):
+            failed.append("%s: expected %r, got %r" % (name, expected, counts))
+    return failed
+
+
+def mot_scores(counts):
+    """MOTA and IDF1 of the counts of MOTMetrics, summed over sequences."""
+    num_gt = max(counts["num_gt"], 1)
+    errors = counts["misses"] + counts["false_positives"] + counts["id_switches"]
+    return (
+        1.0 - errors / num_gt,
+        2.0 * counts["idtp"] / max(counts["num_gt"] + counts["num_hyp"], 1),
+    )
+
+
+def find_sequences(seq_path, phase):
+    """(name, det.txt, gt.txt) of the sequences having ground truth."""
+    pattern = os.path.join(seq_path, phase, "*", "det", "det.txt")
+    sequences = []
+    for seq_dets_fn in sorted(glob.glob(pattern)):
+        seq_dir = os.path.dirname(os.path.dirname(seq_dets_fn))
+        seq_gt_fn = os.path.join(seq_dir, "gt", "gt.txt")
+        if os.path.exists(seq_gt_fn):
+            sequences.append((os.path.basename(seq_dir), seq_dets_fn, seq_gt_fn))
+    return sequences
+
+
+def load_sequences(sequences):
+    """Load sequences.
+
+    Pool initializer mapping the cached detections and reading the ground
+    truth of the sequences once per worker.
+    """
+    global _sequences
+    _sequences = []
+    for seq, seq_dets_fn, seq_gt_fn in sequences:
+        seq_dets = MOTDetections.load_cache(seq_dets_fn)
+        if seq_dets is None:
+            seq_dets = MOTDetections.from_file(seq_dets_fn)
+        _sequences.append((seq, seq_dets, MOTGroundTruth.from_file(seq_gt_fn)))
+
+
+def evaluate(config, metric_iou=0.5):
+    """Evaluate a configuration.
+
+    Tracks every sequence of the worker with a Sort of config, the
+    (max_age, min_hits, iou_threshold) to try, and returns the config, the
+    seconds spent in Sort.update, the frames tracked and the MOTMetrics
+    counts summed over the sequences.
+    """
+    max_age, min_hits, iou_threshold = config
+    total_time = 0.0
+    total_frames = 0
+    totals = None
+    for _, seq_dets, seq_gt in _sequences:
+        tracker = Sort(max_age=max_age, min_hits=min_hits, iou_threshold=iou_threshold)
+        metrics = MOTMetrics(metric_iou)
+        empty = np.empty((0, 5))
+        for frame in range(1, max(seq_dets.num_frames, seq_gt.num_frames) + 1):
+            dets = seq_dets[frame] if frame <= seq_dets.num_frames else empty
+            start_time = time.perf_counter()
+            trackers = tracker.update(dets)
+            total_time += time.perf_counter() - start_time
+            gt_ids, gt_boxes = seq_gt[frame]
+            metrics.update(gt_ids, gt_boxes, trackers[:, 4], trackers[:, :4])
+            total_frames += 1
+        counts = metrics.counts()
+        if totals is None:
+            totals = counts
+        else:
+            totals = {key: totals[key] + counts[key] for key in totals}
+    return config, total_time, total_frames, totals
+
+
+def parse_args():
+    """Parse input arguments."""
+    parser = argparse.ArgumentParser(description="SORT parameter sweep")
+    parser.add_argument(
+        "--seq_path", help="Path to detections.", type=str, default="data"
+    )
+    parser.add_argument(
+        "--phase", help="Subdirectory in seq_path.", type=str, default="train"
+    )
+    parser.add_argument(
+        "--max_age",
+        help="Values of the maximum number of frames to keep alive a track.",
+        type=int,
+        nargs="+",
+        default=[1, 3, 5],
+    )
+    parser.add_argument(
+        "--min_hits",
+        help="Values of the minimum number of hits before a track is initialised.",
+        type=int,
+        nargs="+",
+        default=[1, 3],
+    )
+    parser.add_argument(
+        "--iou_threshold",
+        help="Values of the minimum IOU for match.",
+        type=float,
+        nargs="+",
+        default=[0.3],
+    )
+    parser.add_argument(
+        "--metric_iou",
+        help="Minimum IOU of a track and a ground truth box to match.",
+        type=float,
+        default=0.5,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of processes evaluating configurations in parallel [1].",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--target_mota", help="Minimum MOTA of the chosen configuration.", type=float
+    )
+    parser.add_argument(
+        "--target_idf1", help="Minimum IDF1 of the chosen configuration.", type=float
+    )
+    parser.add_argument("--output", help="JSON file to write the results to.", type=str)
+    parser.add_argument(
+        "--check",
+        help="Only check the metrics on small known sequences and exit.",
+        action="store_true",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.check:
+        failed = check_metrics()
+        for failure in failed:
+            print(failure)
+        print("Metrics check %s" % ("failed" if failed else "passed"))
+        raise SystemExit(1 if failed else 0)
+    sequences = find_sequences(args.seq_path, args.phase)
+    if not sequences:
+        raise SystemExit(
+            "No sequences with det/det.txt and gt/gt.txt in %s"
+            % os.path.join(args.seq_path, args.phase)
+        )
+    # parse every det.txt once, the workers map the cache
+    for _, seq_dets_fn, _ in sequences:
+        MOTDetections.from_file(seq_dets_fn, cache=True)
+    configs = list(itertools.product(args.max_age, args.min_hits, args.iou_threshold))
+
+    start_time = time.time()
+    if args.workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=load_sequences,
+            initargs=(sequences,),
+        ) as pool:
+            futures = [
+                pool.submit(evaluate, config, args.metric_iou) for config in configs
+            ]
+            results = [future.result() for future in futures]
+    else:
+        load_sequences(sequences)
+        results = [evaluate(config, args.metric_iou) for config in configs]
+    wall_time = time.time() - start_time
+
+    rows = []
+    for (max_age, min_hits, iou_threshold), seconds, frames, counts in results:
+        mota, idf1 = mot_scores(counts)
+        rows.append(
+            dict(
+                counts,
+                max_age=max_age,
+                min_hits=min_hits,
+                iou_threshold=iou_threshold,
+                seconds=seconds,
+                fps=frames / seconds if seconds > 0 else 0.0,
+                mota=mota,
+                idf1=idf1,
+            )
+        )
+    rows.sort(key=lambda r: r["seconds"])
+    print(
+        "%7s %8s %7s %9s %9s %7s %7s %7s"
+        % ("max_age", "min_hits", "iou", "time [s]", "FPS", "MOTA", "IDF1", "IDSW")
+    )
+    for r in rows:
+        print(
+            "%7d %8d %7.2f %9.3f %9.1f %7.3f %7.3f %7d"
+            % (
+                r["max_age"],
+                r["min_hits"],
+                r["iou_threshold"],
+                r["seconds"],
+                r["fps"],
+                r["mota"],
+                r["idf1"],
+                r["id_switches"],
+            )
+        )
+    print(
+        "%d configurations of %d sequences in %.3f seconds with %d workers"
+        % (len(configs), len(sequences), wall_time, args.workers)
+    )
+    if args.target_mota is not None or args.target_idf1 is not None:
+        chosen = [
+            r
+            for r in rows
+            if r["mota"] >= (args.target_mota or -np.inf)
+            and r["idf1"] >= (args.target_idf1 or -np.inf)
+        ]
+        if chosen:
+            print(
+                "Cheapest on target: max_age %d, min_hits %d, iou_threshold %.2f"
+                % (
+                    chosen[0]["max_age"],
+                    chosen[0]["min_hits"],
+                    chosen[0]["iou_threshold"],
+                )
+            )
+        else:
+            print("No configuration meets the target")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
@@ -0,0 +1,231 @@
+"""Video.
+
+Frame source for the drivers that only retrieves the frames that are used,
+and a writer that encodes annotated videos in the background.
+cv2.VideoCapture.read is grab, which advances to the next frame, followed by
+retrieve, which converts it to a BGR image. Frames that are neither detected
+nor shown only need the grab. With the FFmpeg backend grab still decodes, so
+skipping retrieve saves the conversion and copy, while seeking over long
+strides also saves the decoding:
+
+  source = FrameSource("test.mp4")
+  while source.grab():
+      if source.index % 5 == 0:
+          frame = source.retrieve()
+"""
+
+import threading
+import time
+
+import cv2
+from pipeline import BoundedQueue
+
+
+class FrameSource(object):
+    """Fuente de frames.
+
+    Wraps a cv2.VideoCapture (or opens a path) keeping the index of the last
+    grabbed frame, numbered from 0, how many frames were grabbed and
+    retrieved, and the seconds spent grabbing, retrieving and seeking in
+    busy. Frames from start to end (excluded) are read.
+    """
+
+    def __init__(self, video, start=0, end=None):
+        """Initialization.
+
+        Params:
+          video - path of the video or a cv2.VideoCapture
+          start - index of the first frame
+          end - index after the last frame, None reads to the end
+        """
+        self.cap = cv2.VideoCapture(video) if isinstance(video, str) else video
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+        # 0 or negative for streams
+        self.num_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.end = end
+        self.index = start - 1
+        self.grabbed = 0
+        self.retrieved = 0
+        self.busy = 0.0
+        if start > 0:
+            self.seek(start)
+
+    def seek(self, index):
+        """Make index the next frame grabbed."""
+        start = time.perf_counter()
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        self.busy += time.perf_counter() - start
+        self.index = index - 1
+
+    def grab(self):
+        """Grab the next frame without retrieving it, False at the end."""
+        if self.end is not None and self.index + 1 >= self.end:
+            return False
+        start = time.perf_counter()
+        grabbed = self.cap.grab()
+        self.busy += time.perf_counter() - start
+        if not grabbed:
+            return False
+        self.index += 1
+        self.grabbed += 1
+        return True
+
+    def retrieve(self):
+        """Retrieve the image of the last grabbed frame, None if it fails."""
+        start = time.perf_counter()
+        ret, frame = self.cap.retrieve()
+        self.busy += time.perf_counter() - start
+        self.retrieved += 1
+        return frame if ret else None
+
+    def read(self):
+        """Grab and retrieve the next frame, None at the end."""
+        return self.retrieve() if self.grab() else None
+
+    def stride_for(self, target_fps):
+        """Stride between the frames sampled at target_fps, 1 if unknown."""
+        if self.fps <= 0 or not target_fps:
+            return 1
+        return max(1, int(round(self.fps / target_fps)))
+
+    def frames(self, need=None, stride=1):
+        """Frames.
+
+        Yields the (index, frame) of every frame, where frame is None if it was
+        only grabbed. Frames are retrieved when need(index) is true, by default
+        every stride frames.
+        """
+        while self.grab():
+            if need(self.index) if need is not None else self.index % stride == 0:
+                yield self.index, self.retrieve()
+            else:
+                yield self.index, None
+
+    def sample(self, target_fps=None, stride=1, seek_stride=None):
+        """Sample.
+
+        Yields the (index, frame) of every stride frames, or of the frames at
+        target_fps. The frames in between are grabbed, or skipped with a
+        seek when the stride is at least seek_stride, which pays off with
+        long strides on videos with frequent key frames.
+        """
+        if target_fps:
+            stride = self.stride_for(target_fps)
+        first = True
+        while True:
+            if seek_stride is not None and stride >= seek_stride:
+                if first:
+                    # the first multiple of stride, as the grab path samples
+                    index = -(-(self.index + 1) // stride) * stride
+                    if index != self.index + 1:
+                        self.seek(index)
+                    first = False
+                else:
+                    self.seek(self.index + stride)
+                if not self.grab():
+                    return
+            else:
+                while True:
+                    if not self.grab():
+                        return
+                    if self.index % stride == 0:
+                        break
+            yield self.index, self.retrieve()
+
+    def release(self):
+        """Close the video."""
+        self.cap.release()
+
+    def __enter__(self):
+        """Use as a context manager, releasing on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Release the video."""
+        self.release()
+
+
+def draw_tracks(frame, tracks, colour=(0, 255, 0)):
+    """Draw the [x1,y1,x2,y2,id] tracks, with their ids, on frame."""
+    for d in tracks:
+        x1, y1, x2, y2, track_id = map(int, d[:5])
+        cv2.rectangle(frame, (x1, y1), (x2, y2), colour, 3)
+        cv2.putText(
+            frame,
+            str(track_id),
+            (x1, y1 - 10),
+            cv2.FONT_HERSHEY_PLAIN,
+            2,
+            colour,
+            thickness=2,
+        )
+    return frame
+
+
+class VideoWriter(object):
+    """Escritor de video en segundo plano.
+
+    Encodes frames with cv2.VideoWriter in a thread of its own, fed through a
+    BoundedQueue, so that encoding overlaps with tracking. The file is
+    opened with the size of the first frame. With policy "drop_oldest" a slow
+    encoder drops frames instead of slowing down the caller.
+    """
+
+    def __init__(self, path, fps=25.0, fourcc="mp4v", queue_size=16, policy="block"):
+        """Initialization.
+
+        Params:
+          path - video file to write
+          fps - frame rate of the video
+          fourcc - four character code of the codec
+          queue_size - frames buffered for the encoder
+          policy - policy of the queue, see pipeline.QUEUE_POLICIES
+        """
+        self.path = path
+        self.fps = fps if fps > 0 else 25.0
+        self.fourcc = fourcc
+        self.queue = BoundedQueue(queue_size, policy)
+        self.writer = None
+        self.written = 0
+        self.busy = 0.0
+        self.thread = threading.Thread(target=self._encode, daemon=True)
+        self.thread.start()
+
+    def _encode(self):
+        """Encoder thread."""
+        while True:
+            try:
+                frame = self.queue.get()
+            except IndexError:
+                break
+            start = time.perf_counter()
+            if self.writer is None:
+                height, width = frame.shape[:2]
+                self.writer = cv2.VideoWriter(
+                    self.path,
+                    cv2.VideoWriter_fourcc(*self.fourcc),
+                    self.fps,
+                    (width, height),
+                )
+            self.writer.write(frame)
+            self.busy += time.perf_counter() - start
+            self.written += 1
+
+    def write(self, frame):
+        """Queue a frame to encode."""
+        self.queue.put(frame)
+
+    def close(self):
+        """Encode the queued frames and close the file."""
+        self.queue.close()
+        self.thread.join()
+        if self.writer is not None:
+            self.writer.release()
+
+    def __enter__(self):
+        """Use as a context manager, closing on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the video."""
+        self.close()